@@ -2,6 +2,9 @@ from dash import Dash
 import dash_bootstrap_components as dbc
 import layout
 import callbacks
+import export
+import instrumentation
+import payloads
 import argparse
 
 # Our stylesheets. If you're not connected to the internet, the fonts/etc. will look different.
@@ -17,6 +20,11 @@ app = Dash(__name__,  external_stylesheets=external_stylesheets,
            title=layout.app_title, suppress_callback_exceptions=True)
 app.layout = layout.master_layout
 server = app.server
+payloads.register(server) # first, so that compression is the last thing done to a response
+export.register_routes(server)
+if export.EXPORT_WARM_UP:
+    export.warm_up() # start the image renderers now, not when the user first asks for an image
+instrumentation.register_routes(server) # /metrics
 
 # Themes available from dbc:
 dbc_themes = {}
@@ -55,9 +63,13 @@ if __name__ == '__main__':
     parser.add_argument('--theme',
                         help=dbc_theme_help_string, required=False)
     parser.add_argument('--debug', help='run in debug mode', action='store_true', required=False)
+    parser.add_argument('--timings', help='show recent callback timings at the bottom of the page',
+                        action='store_true', required=False)
     args = vars(parser.parse_args()) # returns a dict, via vars()
     theme = dbc_themes['BOOTSTRAP'] # our default theme
     if args['theme'] is not None and args['theme'].upper() in dbc_themes:
         theme = dbc_themes[args['theme'].upper()]
     app.config.external_stylesheets += [theme]
+    if args['timings'] and layout.debug_panel not in app.layout.children:
+        app.layout.children.append(layout.debug_panel)
     app.run(debug=args['debug'])
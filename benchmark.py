@@ -0,0 +1,328 @@
+"""
+Benchmarks of the plotting and query hot paths, on synthetic data of a chosen size.
+
+Usage:
+    python benchmark.py [--scale small|medium|large] [--patients N] [--days N] [--properties N] [--groups N]
+                        [--repeats 3] [--only NAME ...] [--baseline benchmark_baseline.json]
+                        [--save-baseline] [--tolerance 0.25] [--write-data DIR]
+
+Each benchmark reports the best wall time of --repeats runs and the peak memory allocated
+during one further run (measured with tracemalloc, which also sees numpy's and pandas' buffers).
+
+With a baseline file (written by --save-baseline, for each scale separately), the results are compared
+with it, and the exit status is 1 if any benchmark got slower, or used more memory, by more than
+--tolerance (a fraction; default 0.25). Timings depend on the machine, so keep one baseline per machine
+(e.g. the CI runner), and re-save it when a change is meant to alter performance.
+
+The synthetic data has the shape of assets/fake_timeseries_data.csv and assets/fake_demographic_data.csv
+(patients measured every half day, grouped by 'Treatment' and 'Home location') and goes through
+the same loading code (datasets.register_study() and datasets.get_study()) as the real files.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextvars import copy_context
+
+import numpy as np
+import pandas as pd
+from dash._callback_context import context_value
+from dash._utils import AttributeDict
+
+import callbacks
+import datasets
+import derived_metrics
+import figure_cache
+import labels
+import layout
+import stats_cube
+import utils
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+SCALES = {'small':{'patients':64, 'days':13, 'properties':4, 'groups':3},   # about the size of the demo data
+          'medium':{'patients':500, 'days':30, 'properties':8, 'groups':5},
+          'large':{'patients':2000, 'days':60, 'properties':16, 'groups':8}}
+MIN_REGRESSION_SECONDS = 0.005 # differences smaller than this are noise
+MIN_REGRESSION_MB = 1.
+GROUP_BY = ['Treatment', 'Home location']
+
+
+def make_synthetic_study(patients : int, days : int, properties : int, groups : int, seed : int=0):
+    """
+    Function to generate a study shaped like the demo data, of any size.
+
+    Parameters
+    ----------
+    patients : int
+       The number of patients.
+    days : int
+       The number of days; each patient is measured every half day from Day 0 to Day days-1.
+    properties : int
+       The number of timeseries properties (the demographics always have 3, like the demo data, plus
+       one more per 4 timeseries properties).
+    groups : int
+       The number of distinct values of 'Treatment' and of 'Home location'.
+    seed : int, default : 0
+       Seed of the random number generator, so that runs are reproducible.
+
+    Returns
+    -------
+    pd.DataFrame, pd.DataFrame
+       The (wide) timeseries and demographics tables, with the columns of the demo CSV files.
+    """
+    rng = np.random.default_rng(seed)
+    # 9-digit IDs like the demo's, one drawn from each of `patients` equal slices of the range, so they're unique.
+    stride = 900_000_000//patients
+    patient_ids = (100_000_000 + stride*np.arange(patients) + rng.integers(stride, size=patients)).astype(str)
+    day_values = np.arange(0, days - 0.25, 0.5)
+    treatments = np.array(['Placebo', *[f'{10*(i + 1)}mg New Drug' for i in range(groups - 1)]])
+    locations = np.array([f'Region {i + 1}' for i in range(groups)])
+    patient_treatment = treatments[rng.integers(groups, size=patients)]
+    patient_location = locations[rng.integers(groups, size=patients)]
+    # Missed visits: drop 10% of the (patient, day) rows.
+    rows = np.array([(p, d) for p in range(patients) for d in range(len(day_values))])
+    rows = rows[rng.random(len(rows)) >= 0.1]
+    p_idx, d_idx = rows[:, 0], rows[:, 1]
+    df_timeseries = pd.DataFrame({'Patient ID':patient_ids[p_idx], 'Day':day_values[d_idx]})
+    for i in range(properties):
+        baseline = rng.uniform(1, 500, size=patients)
+        trend = rng.normal(0, 0.05, size=patients)
+        values = baseline[p_idx]*(1 + trend[p_idx]*day_values[d_idx]) + rng.normal(0, 0.05, size=len(rows))*baseline[p_idx]
+        values[rng.random(len(rows)) < 0.02] = np.nan
+        df_timeseries[f'Property {i + 1} (units)'] = np.round(values, 2)
+    df_timeseries['Treatment'] = patient_treatment[p_idx]
+    df_timeseries['Home location'] = patient_location[p_idx]
+    df_demographics = pd.DataFrame({'Patient ID':patient_ids,
+                                    'Age':rng.integers(4, 18, size=patients),
+                                    'BMI':np.round(rng.normal(19, 3, size=patients), 2),
+                                    'Family income (x $1000)':np.round(rng.lognormal(4.5, 0.8, size=patients), 3)})
+    for i in range(properties//4):
+        df_demographics[f'Score {i + 1}'] = np.round(rng.uniform(0, 100, size=patients), 1)
+    return df_timeseries, df_demographics
+
+
+def load_synthetic_study(directory : str, **sizes):
+    """
+    Write a synthetic study (see make_synthetic_study()) to CSV files in `directory`
+    and load it the way the app does. Returns (df_all, df_metrics, dataset_key).
+    The tables stay cached under dataset_key, so the callbacks find them after the files are deleted.
+    """
+    df_timeseries, df_demographics = make_synthetic_study(**sizes)
+    infile_timeseries = os.path.join(directory, 'synthetic_timeseries_data.csv')
+    infile_demographics = os.path.join(directory, 'synthetic_demographic_data.csv')
+    df_timeseries.to_csv(infile_timeseries, index=False)
+    df_demographics.to_csv(infile_demographics, index=False)
+    dataset_key = datasets.register_study(infile_timeseries, infile_demographics, GROUP_BY)
+    tables = datasets.get_study(dataset_key)
+    return tables['timeseries'], tables['metrics'], dataset_key
+
+
+def _call_callback(func, *args, triggered : str='benchmark.n_clicks', num_outputs : int=10,
+                   outputs_list : list=None):
+    """
+    Call a Dash callback function directly, with a minimal callback context
+    (ctx.triggered_id is the component id in `triggered`, and len(ctx.outputs_list) is num_outputs,
+    unless `outputs_list` is given, e.g. for callbacks with pattern-matching outputs).
+    """
+    def call():
+        context_value.set(AttributeDict(triggered_inputs=[{'prop_id':triggered, 'value':1}],
+                                        outputs_list=outputs_list or [{}]*num_outputs,
+                                        inputs_list=[], states_list=[],
+                                        args_grouping=[]))
+        return func(*args)
+    return copy_context().run(call)
+
+
+def make_benchmarks(df_all : pd.DataFrame, df_metrics : pd.DataFrame, dataset_key : str):
+    """
+    Return the benchmarks for a loaded study: name -> function of no arguments.
+    Anything a benchmark needs but doesn't measure is prepared here.
+    """
+    sample_string = df_all.columns[0]
+    props = sorted(df_all['prop name'].unique().tolist())
+    group = GROUP_BY[0]
+    df_facets = df_all[df_all['prop value'].notna()].reset_index(drop=True)
+    cube = stats_cube.build_stats_cube(df_all, GROUP_BY, 'Day')
+    df_summary = stats_cube.summarize(cube, group, props)
+    replicates_fig = utils.make_custom_multifaceted_line_plot(df_facets, x_column='Day', line_group=sample_string,
+                                                              agg_group=group).to_plotly_json()
+    metric_props = sorted(df_metrics['prop name'].unique().tolist())
+    df_metric_facets = df_metrics.dropna(how='any', ignore_index=True, axis=0)
+    df_sorted, sorted_props = utils.sort_bar_plot_data(df_metric_facets, sample_string, metric_props[0], False)
+    samples = sorted(df_metrics[sample_string].unique().tolist())
+    label_table = {'names':['Group A', 'Group B'], 'colors':['#E15759', '#4E79A7']}
+    label_map = {sample : i % 3 - 1 for i, sample in enumerate(samples)} # unlabeled, A, B, unlabeled, ...
+    query = [['', 'Age', '>', '10', ''], ['AND', '(', 'BMI', '>=', '18', ''], ['OR', '', 'Age', 'in top', '5', ')']]
+    sample_options = [layout.make_labeled_option(sample, utils.LIGHT_GRAY) for sample in samples[:utils.MAX_SAMPLE_OPTIONS]]
+
+    def line_plot_callback(display_mode, cold, day_range=None):
+        def run():
+            if cold:
+                figure_cache.clear()
+            return _call_callback(callbacks.update_line_plot, 1, display_mode, 0.02, False, day_range, None, props,
+                                  group, GROUP_BY, dataset_key, None,
+                                  triggered='render-lineplot-button.n_clicks', num_outputs=9)
+        return run
+
+    first_day, last_day = float(df_all['Day'].min()), float(df_all['Day'].max())
+
+    # The style map for mean ± SD is built from a replicates figure first (as the app does).
+    style_map = utils.add_group_to_style_map(group, {}, replicates_fig, df_facets, sample_string, False)
+    datasets.set_cached(dataset_key, 'stats cube', cube)
+    return {
+        'xexpand_MeanAndSD_vs_Day':
+            lambda: utils.xexpand_MeanAndSD_vs_Day(df_summary, group, 0.02),
+        'stats_cube.build_stats_cube':
+            lambda: stats_cube.build_stats_cube(df_all, GROUP_BY, 'Day'),
+        'derived_metrics.compute_derived_metrics':
+            lambda: derived_metrics.compute_derived_metrics(df_all, sample_string, 'Day'),
+        'line plot, replicates':
+            lambda: utils.make_custom_multifaceted_line_plot(df_facets, x_column='Day', line_group=sample_string,
+                                                             agg_group=group),
+        'line plot, mean ± SD':
+            lambda: utils.make_custom_multifaceted_line_plot(df_facets, x_column='Day', line_group=sample_string,
+                                                             agg_group=group, display_meanSD=True, dt=0.02,
+                                                             df_summary=df_summary),
+        'line plot, density':
+            lambda: utils.make_density_line_plot(df_facets, x_column='Day', line_group=sample_string,
+                                                 agg_group=group, df_summary=df_summary),
+        'add_group_to_style_map':
+            lambda: utils.add_group_to_style_map(group, {}, replicates_fig, df_facets, sample_string, False),
+        'bar plot':
+            lambda: utils.make_custom_multifaceted_bar_plot(df_sorted, sorted_props, label_map, label_table,
+                                                            sample_string, False),
+        'bar plot, distribution':
+            lambda: utils.make_binned_bar_plot(df_sorted, sorted_props, label_map, label_table, sample_string),
+        'process_subsetting_query':
+            lambda: utils.process_subsetting_query(query, df_metrics),
+        'callback update_line_plot, replicates (cold)': line_plot_callback(1, cold=True),
+        'callback update_line_plot, replicates (cached)': line_plot_callback(1, cold=False),
+        'callback update_line_plot, mean ± SD (cold)':
+            lambda: (figure_cache.clear(),
+                     _call_callback(callbacks.update_line_plot, 1, 2, 0.02, False, None, style_map, props,
+                                    group, GROUP_BY, dataset_key, None,
+                                    triggered='render-lineplot-button.n_clicks', num_outputs=9)),
+        # Only the rows of the first quarter of the days are plotted (see callbacks._restrict_to_days()).
+        'callback update_line_plot, replicates, first quarter of the days (cold)':
+            line_plot_callback(1, cold=True, day_range=[first_day, first_day + (last_day - first_day)/4]),
+        # The per-facet view draws the facets one at a time, as they scroll into view.
+        'callback render_visible_facets, first facet (cold)':
+            lambda: (figure_cache.clear(),
+                     _call_callback(callbacks.render_visible_facets, props[:1],
+                                    [layout.FACET_GRAPH_PENDING]*len(props),
+                                    {'group':group, 'mode':1, 'spread':0.02}, None, GROUP_BY, dataset_key,
+                                    triggered='lineplot-visible-facets.data',
+                                    outputs_list=[[{'id':{'type':'lineplot-facet-graph', 'index':prop},
+                                                    'property':'figure'} for prop in props], [], {}, {}])),
+        'callback update_barplot':
+            lambda: _call_callback(callbacks.update_barplot, 1, 0, False,
+                                   metric_props[0], 0, utils.BARPLOT_SAMPLES, None, None, sample_options, metric_props,
+                                   label_table, None, label_map, labels.UNLABELED, None, dataset_key, None,
+                                   triggered='render-barplot-button.n_clicks', num_outputs=9),
+    }
+
+
+def measure(func, repeats : int):
+    """
+    Return (best wall time in seconds over `repeats` runs, peak memory in MB during one more run).
+    """
+    func() # warm up (imports, caches that aren't part of what's measured)
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return min(times), peak/2**20
+
+
+def compare(results : dict, baseline : dict, tolerance : float):
+    """
+    Return the regressions of `results` relative to `baseline` (both: name -> {'seconds', 'peak MB'}),
+    as a list of messages.
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result['seconds'] > base['seconds']*(1 + tolerance) \
+                and result['seconds'] - base['seconds'] > MIN_REGRESSION_SECONDS:
+            regressions.append(f"{name}: {result['seconds']*1000:.1f} ms (baseline {base['seconds']*1000:.1f} ms)")
+        if result['peak MB'] > base['peak MB']*(1 + tolerance) \
+                and result['peak MB'] - base['peak MB'] > MIN_REGRESSION_MB:
+            regressions.append(f"{name}: {result['peak MB']:.1f} MB peak (baseline {base['peak MB']:.1f} MB)")
+    return regressions
+
+
+def main(argv : list=None):
+    parser = argparse.ArgumentParser(description='Benchmark the plotting and query hot paths on synthetic data.')
+    parser.add_argument('--scale', choices=SCALES, default='small', help='data set size preset')
+    for size in ['patients', 'days', 'properties', 'groups']:
+        parser.add_argument(f'--{size}', type=int, help=f'override the number of {size} of the preset')
+    parser.add_argument('--repeats', type=int, default=3, help='timed runs per benchmark (the best one counts)')
+    parser.add_argument('--only', nargs='+', help='run only the benchmarks whose names contain one of these')
+    parser.add_argument('--baseline', default=BASELINE_FILE, help='baseline file (JSON)')
+    parser.add_argument('--save-baseline', action='store_true', help='store these results as the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed slowdown or memory growth relative to the baseline (fraction)')
+    parser.add_argument('--write-data', help='also keep the synthetic CSV files in this directory')
+    args = parser.parse_args(argv)
+
+    sizes = dict(SCALES[args.scale])
+    for size in sizes:
+        if getattr(args, size) is not None:
+            sizes[size] = getattr(args, size)
+    # A scale whose sizes were overridden gets its own baseline entry.
+    scale_name = args.scale if sizes == SCALES[args.scale] else \
+        '-'.join(f'{size}{value}' for size, value in sizes.items())
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        directory = args.write_data or tmp_dir
+        os.makedirs(directory, exist_ok=True)
+        df_all, df_metrics, dataset_key = load_synthetic_study(directory, **sizes)
+    print(f"Synthetic study '{scale_name}': {df_all['Patient ID'].nunique()} patients, "
+          f"{len(df_all):,} timeseries rows, {df_all['prop name'].nunique()} properties", flush=True)
+
+    benchmarks = make_benchmarks(df_all, df_metrics, dataset_key)
+    if args.only:
+        benchmarks = {name : func for name, func in benchmarks.items()
+                      if any(part in name for part in args.only)}
+    results = {}
+    width = max(len(name) for name in benchmarks) if benchmarks else 0
+    for name, func in benchmarks.items():
+        seconds, peak = measure(func, args.repeats)
+        results[name] = {'seconds':seconds, 'peak MB':peak}
+        print(f'{name:<{width}}  {seconds*1000:9.1f} ms  {peak:8.1f} MB peak', flush=True)
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            baselines = json.load(f)
+    if args.save_baseline:
+        baselines[scale_name] = {**baselines.get(scale_name, {}), **results}
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(baselines, f, indent=1)
+        print(f"Saved the baseline for '{scale_name}' to {args.baseline}.")
+        return 0
+    if scale_name not in baselines:
+        print(f"No baseline for '{scale_name}' in {args.baseline}; run with --save-baseline to store one.")
+        return 0
+    regressions = compare(results, baselines[scale_name], args.tolerance)
+    for message in regressions:
+        print(f'REGRESSION {message}', file=sys.stderr)
+    if not regressions:
+        print(f'No regressions beyond {args.tolerance:.0%} of the baseline.')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,147 +1,252 @@
 import base64
 import io
+import json
+import math
 import os
+import re
+import uuid
 from textwrap import fill
+from urllib.parse import parse_qs, urlencode, urlsplit, urlunsplit
 
 import pandas as pd
 import numpy as np
-from dash import html, callback, Input, Output, State, no_update, ALL, ctx
+from dash import html, dcc, clientside_callback, Input, Output, State, Patch, no_update, ALL, ctx
 
 import utils
 import layout
+import datasets
+import derived_metrics
+import export
+import figure_cache
+import instrumentation
+import labels
+import payloads
+import render_scheduler
+import sessions
+import stats_cube
+import warmup
+from indexes import DayIndex, SampleSearchIndex
+from instrumentation import callback # dash.callback(), plus timings; see instrumentation.py
+
+# The demo study: timeseries file, demographics file, groupBy options (BUGBUG: Hardcoded for demo. Use a checkbox?).
+# It's registered here, in every server process, so any of them can load it by its data set key.
+DEMO_STUDY = ('assets/fake_timeseries_data.csv', 'assets/fake_demographic_data.csv', ['Treatment', 'Home location'])
+datasets.register_study(*DEMO_STUDY)
 
 #------------- Begin simple error message popup functionality --------------
 #
-@callback(Output('err-modal', 'is_open', allow_duplicate=True),
-          Input('err-msg', 'children'),
-          prevent_initial_call=True) # was: 'initial_duplicate')
-def show_error_message(msg : str):
+# Any callback can trigger a popup error message by sending an error message
+# to Output('err_msg', 'children').
+clientside_callback(
     """
-    Any callback can trigger a popup error message by sending an error message
-    to Output('err_msg', 'children').
-    """
-    return True
+    function(msg) {
+        return true;
+    }
+    """,
+    Output('err-modal', 'is_open', allow_duplicate=True),
+    Input('err-msg', 'children'),
+    prevent_initial_call=True) # was: 'initial_duplicate')
 
 
-@callback(Output('err-modal', 'is_open', allow_duplicate=True),
-          Input('close-err-modal', 'n_clicks'),
-          prevent_initial_call='initial_duplicate')
-def close_error_modal(n_clicks : int):
-    if n_clicks > 0:
-        return False # close the window: 'is_open' = False
-    return no_update
+clientside_callback(
+    """
+    function(n_clicks) {
+        if (n_clicks > 0) {
+            return false; // close the window: 'is_open' = false
+        }
+        return window.dash_clientside.no_update;
+    }
+    """,
+    Output('err-modal', 'is_open', allow_duplicate=True),
+    Input('close-err-modal', 'n_clicks'),
+    prevent_initial_call='initial_duplicate')
 #
 #------------- End simple error message popup functionality ----------------
 
 @callback(Output('lineplot-dataGroups-div', 'hidden'),
-          Output('lineplot-df-melted-dict', 'data'),
           Output('lineplot-facetVars-checklist', 'options'),
           Output('lineplot-facetVars-checklist', 'value'),
           Output('lineplot-groupBy-dropdown', 'options'),
-          Output('metrics-dict', 'data'),
+          Output('lineplot-groupBy-dropdown', 'value'),
+          Output('dataset-key', 'data'),
+          Output('session-id', 'data'),
+          Output('lineplot-dayrange-slider', 'min'),
+          Output('lineplot-dayrange-slider', 'max'),
+          Output('lineplot-dayrange-slider', 'step'),
+          Output('lineplot-dayrange-slider', 'marks'),
+          Output('lineplot-dayrange-slider', 'value'),
           Output('err-msg', 'children', allow_duplicate=True),
           Input('demo-welcome-banner-div', 'title'),
           prevent_initial_call='initial_duplicate') # necessary due to err-msg usage
 def load_fake_demo_data(_):
     """
     Load fake data for the demo. Currently hardcoded. Will replace with interactive data loading.
+    The tables stay on the server; the browser gets the data set key (see _study_tables()).
     """
     num_outputs = len(ctx.outputs_list)
     no_updates = [no_update]*num_outputs
-    infile_timeseries = 'assets/fake_timeseries_data.csv'
-    infile_demographics = 'assets/fake_demographic_data.csv'
-    groupBy_options = ['Treatment', 'Home location'] # BUGBUG: Hardcoded for demo. Use a checkbox?
-    try:
-        df_infile_timeseries = pd.read_csv(infile_timeseries)
-    except FileNotFoundError:
-        err_msg = f"Whoops, file {infile_timeseries} was not found."
-        no_updates[-1] = err_msg
-        return tuple(no_updates)
-    except Exception as e:
-        err_msg = f"Failed to connect to the data source.\nReceived the following exception:\n{e}."
-        no_updates[-1] = err_msg
-        return tuple(no_updates)
+    infile_timeseries, infile_demographics, groupBy_options = DEMO_STUDY
+    dataset_key = datasets.register_study(infile_timeseries, infile_demographics, groupBy_options)
     try:
-        df_infile_demographics = pd.read_csv(infile_demographics)
-    except FileNotFoundError:
-        err_msg = f"Whoops, file {infile_demographics} was not found."
-        no_updates[-1] = err_msg
-        return tuple(no_updates)
-    except Exception as e:
-        err_msg = f"Failed to connect to the data source.\nReceived the following exception:\n{e}."
-        no_updates[-1] = err_msg
+        # Read and melted once per machine; every server process maps the same copy (see shared_datasets.py).
+        df_all, df_metrics = _study_tables(dataset_key)
+    except ValueError as e:
+        no_updates[-1] = str(e)
         return tuple(no_updates)
-    vv_timeseries = list(set(df_infile_timeseries.columns.tolist()) - set(['Patient ID', 'Day'])
-                         - set(groupBy_options)) # "vv_" for "value_vars"
-    df_all = df_infile_timeseries.melt(id_vars=list(set(['Patient ID', 'Day']+groupBy_options)),
-                                       value_vars=vv_timeseries,
-                                       var_name='prop name', value_name='prop value',
-                                       ignore_index=True) # .dropna()
-    df_all['Patient ID'] = df_all['Patient ID'].astype(str)
-    del(df_infile_timeseries)
-    vv_demog = list(set(df_infile_demographics.columns.tolist()) - set(['Patient ID']))
-    df_metrics = df_infile_demographics.melt(id_vars=['Patient ID'],
-                                             value_vars=vv_demog,
-                                             var_name='prop name', value_name='prop value',
-                                             ignore_index=True) # .dropna()
-    del(df_infile_demographics)
-    df_metrics['Patient ID'] = df_metrics['Patient ID'].astype(str)        
-    # groupBy_options = list(set(df_all.columns.tolist()) - set(['Patient ID','Day','prop name','prop value']))
-    for opt in groupBy_options:
-        if opt not in df_all.columns:
-            err_msg = f"Whoops, groupBy option {opt} is not an option."
-            no_updates[-1] = err_msg
-            return tuple(no_updates)
-    lineplot_facet_options = df_all['prop name'].unique().tolist()
-    lineplot_facet_options = [{'label':' '+opt, 'value':opt} for opt in lineplot_facet_options]
-    lineplot_facet_values = [] # initialize to "no items checked"
-    # Put 'Patient ID' into column 0. Other functions will expect it to be there.
-    df_all = df_all[['Patient ID', *list(set(df_all.columns) - set(['Patient ID']))]]
-    df_metrics = df_metrics[['Patient ID', *list(set(df_metrics.columns) - set(['Patient ID']))]]
-    return False, df_all.to_dict('records'), lineplot_facet_options, lineplot_facet_values, groupBy_options, \
-        df_metrics.to_dict('records'), no_update
+    # The controls start out set to the line plot the warm-up builds (see _warm_up_tasks()).
+    lineplot_facet_values, group = _initial_line_plot_settings(df_all, groupBy_options)
+    lineplot_facet_options = [{'label':' '+opt, 'value':opt} for opt in lineplot_facet_values]
+    datasets.get_or_build(dataset_key, 'stats cube',
+                          lambda: stats_cube.build_stats_cube(df_all, groupBy_options, 'Day'))
+    # The line plot can be restricted to a range of days; see _restrict_to_days().
+    day_index = datasets.get_or_build(dataset_key, 'day index', lambda: DayIndex(df_all['Day']))
+    # Build the default plots in the background, so the first clicks on them are cache hits.
+    warmup.start(dataset_key, _warm_up_tasks(df_all, df_metrics, groupBy_options, dataset_key))
+    return False, lineplot_facet_options, lineplot_facet_values, groupBy_options, group, \
+        dataset_key, uuid.uuid4().hex, *_day_range_slider_settings(day_index), no_update
+
+
+def _study_tables(dataset_key : str):
+    """
+    Return the data set's melted timeseries (for the line plot) and metrics (for the bar plot, including
+    the metrics derived from the timeseries; see derived_metrics.py), from the server-side registry.
+    They're loaded in this server process first if necessary (see datasets.get_study()),
+    and never sent to the browser. Treat them as read-only.
+
+    Raises
+    ------
+    ValueError
+       With a message for the user, if the data set can't be loaded.
+    """
+    tables = datasets.get_study(dataset_key)
+    df_all = tables['timeseries']
+    def with_derived_metrics():
+        # Summaries of each timeseries property over time (mean, max, slope, ...) are bar plot metrics too.
+        df_metrics = tables['metrics']
+        df_derived = datasets.get_or_build(dataset_key, 'derived metrics',
+                                           lambda: derived_metrics.compute_derived_metrics(df_all,
+                                                                                           df_metrics.columns[0],
+                                                                                           'Day'))
+        return pd.concat([df_metrics, df_derived[df_metrics.columns]], ignore_index=True)
+    return df_all, datasets.get_or_build(dataset_key, 'bar plot metrics', with_derived_metrics)
+
+
+def _day_range_slider_settings(day_index : DayIndex):
+    """
+    Return the min, max, step, marks, and (initial, i.e. full) value of the line plot's 'days shown' slider.
+    The slider snaps to the days themselves if there are at most utils.MAX_DAY_MARKS of them.
+    """
+    days = day_index.distinct_days()
+    if len(days) == 0:
+        return 0, 1, None, None, [0, 1]
+    low, high = float(days[0]), float(days[-1])
+    if len(days) <= utils.MAX_DAY_MARKS:
+        return low, high, None, {f'{day:g}':f'{day:g}' for day in days.tolist()}, [low, high]
+    step = float(np.diff(days).min())
+    return low, high, step, None, [low, high]
+
+
+def _restrict_to_days(df_in : pd.DataFrame, day_string : str, day_range : list, dataset_key : str):
+    """
+    Return the rows of the melted timeseries data whose day is within day_range ([low, high], inclusive),
+    found with the data set's day index (see indexes.DayIndex), and the range as a tuple;
+    or df_in and None if the range covers all of the days (or is None).
+    """
+    if not day_range:
+        return df_in, None
+    day_index = datasets.get_or_build(dataset_key, 'day index', lambda: DayIndex(df_in[day_string]))
+    bounds = day_index.bounds()
+    low, high = float(min(day_range)), float(max(day_range))
+    if bounds is None or (low <= bounds[0] and high >= bounds[1]):
+        return df_in, None
+    return df_in.iloc[day_index.rows(low, high)].reset_index(drop=True), (low, high)
+
+
 
+def _initial_line_plot_settings(df_all : pd.DataFrame, groupBy_options : list):
+    """
+    Return the facets checked (all of them, in the order of the checklist) and the grouping chosen
+    (the first groupBy option, or None) when a data set is loaded.
+    """
+    return df_all['prop name'].unique().tolist(), (groupBy_options[0] if groupBy_options else None)
+
+
+def _warm_up_tasks(df_all : pd.DataFrame, df_metrics : pd.DataFrame, groupBy_options : list, dataset_key : str):
+    """
+    The tasks (see warmup.py) that build, for a freshly loaded data set, what the user is likely to ask for first,
+    with the controls' initial settings: the line plot of the facets checked at first, grouped as chosen at first
+    (see _initial_line_plot_settings()), showing all replicates and then mean ± SD (with the slider at 0),
+    and the bar plot's sort orders for the facets checked at first
+    (all but the derived metrics; see initialize_barplot_components()), by each of them, in both directions.
+    """
+    tasks = []
+    line_props, group = _initial_line_plot_settings(df_all, groupBy_options)
+    if line_props and group:
+        df_facets = df_all[df_all['prop value'].notna()].reset_index(drop=True)
+        for display_meanSD, name in [(False, 'line plot, replicates'), (True, 'line plot, mean ± SD')]:
+            tasks.append((name, lambda display_meanSD=display_meanSD:
+                          _get_or_build_line_plot(df_all, df_facets, line_props, group, display_meanSD, 0,
+                                                  groupBy_options, dataset_key, 'Day')))
+    bar_props = [prop for prop in df_metrics['prop name'].unique().tolist()
+                 if not derived_metrics.is_derived_metric_name(prop)]
+    if bar_props:
+        def sort_bar_plot():
+            df_facets = df_metrics[df_metrics['prop name'].isin(bar_props)].dropna(how='any', ignore_index=True,
+                                                                                     axis=0)
+            x_column = df_metrics.columns[0]
+            for sorting_key in [x_column, *bar_props]:
+                for ascending in [False, True]:
+                    _get_or_sort_bar_plot_data(df_facets, x_column, bar_props, sorting_key, ascending, dataset_key)
+        tasks.append(('bar plot sort orders', sort_bar_plot))
+    return tasks
 
 
 #---------------Begin initialization and 'initial click' callbacks-----------------
 #
 @callback(Output('barplot-div', 'hidden'),
           Output('err-msg', 'children', allow_duplicate=True),
-          Input('metrics-dict', 'data'),
+          Input('dataset-key', 'data'),
           prevent_initial_call='initial_duplicate')
-def hide_bar_plot(df_as_dict : list):
+def hide_bar_plot(dataset_key : str):
     """
-    This function is called after "metrics" data (demographics or other snapshots in time)
-    has been loaded into a DataFrame. If this data is present and has been loaded,
-    this function "creates" a Div into which a bar plot will be created by "un-hiding" it.
+    This function is called after a data set has been loaded. If it has "metrics" data
+    (demographics or other snapshots in time), this function "creates" a Div
+    into which a bar plot will be created by "un-hiding" it.
     This action then triggers a call to initialize_barplot_components().
     """
-    if not df_as_dict:
+    if not dataset_key:
         return no_update, no_update
-    if len(pd.DataFrame.from_dict(df_as_dict)) == 0:
+    try:
+        _, df_metrics = _study_tables(dataset_key)
+    except ValueError as e:
+        return no_update, str(e)
+    if len(df_metrics) == 0:
         err_msg = "No metrics data was found,\nso the bar plot of metrics will not be shown."
         return no_update, err_msg
     # The bar plot is hidden, so to show it, we return False, thereby "un-hiding" it.
     return False, no_update
 
 
-@callback(Output('sample-to-color-map', 'data', allow_duplicate=True),
-          Output('sample-to-IsDefaultColor-map', 'data', allow_duplicate=True),
+@callback(Output('sample-to-label-map', 'data', allow_duplicate=True),
           Output('samples-dropdown', 'options', allow_duplicate=True),
           Output('sortorder-dropdown', 'options'),
           Output('sortorder-dropdown', 'value'),
           Output('barplot-facetVars-checklist', 'options'),
           Output('barplot-facetVars-checklist', 'value'),
+          Output('barplot-window-slider', 'max'),
+          Output('barplot-window-slider', 'value'),
           Input('barplot-div', 'hidden'),
-          State('metrics-dict', 'data'),
+          State('dataset-key', 'data'),
           prevent_initial_call='initial_duplicate')
-def initialize_barplot_components(_, df_as_dict : list):
+def initialize_barplot_components(_, dataset_key : str):
     """
     Function to initialize the components for a bar plot of "metrics" data.
-    The input DataFrame, received here as a dict, was validated by the loading function.
-    This callback initializes the color maps for the sample names and the contents of the
-    "sort order" dropdown (sort bar plot by age, or by sample name, or...)
-    and the "choose which properties to show as facets" dropdown.
+    The "metrics" DataFrame (see _study_tables()) was validated by the loading function.
+    This callback initializes the map from sample name to label (initially, every sample
+    carries the default label) and the contents of the "sort order" dropdown (sort bar plot by age, or by sample name, or...),
+    the "choose which properties to show as facets" dropdown, and the range of the slider that chooses
+    the window of samples shown in the windowed bar plot.
+    It also builds the server-side search index over the sample names (see search_samples()).
 
     Notes
     -----
@@ -151,35 +256,67 @@ def initialize_barplot_components(_, df_as_dict : list):
     """
     num_outputs = len(ctx.outputs_list)
     no_updates = [no_update]*num_outputs
-    if not df_as_dict:
+    if not dataset_key:
         return tuple(no_updates)
+    try:
+        _, df_metrics = _study_tables(dataset_key)
+    except ValueError:
+        return tuple(no_updates) # reported by hide_bar_plot()
     # Get the initial values for populating the bar plot's accompanying maps and dropdowns.
-    df_metrics = pd.DataFrame.from_dict(df_as_dict)
     sample_id_string = df_metrics.columns[0]
     facet_options = df_metrics['prop name'].unique().tolist()
     sort_options = [sample_id_string, *facet_options]
-    facet_values = [opt for opt in facet_options] # initialize to "all items checked"
+    # Initialize to "all items checked", except for the metrics derived from the timeseries (see derived_metrics.py).
+    facet_values = [opt for opt in facet_options if not derived_metrics.is_derived_metric_name(opt)] \
+        or facet_options
     facet_options = [{'label':' '+opt, 'value':opt} for opt in facet_options]
         
     # Coding hint: If your bar labels (x-axis values) require a custom sort order,
     # add a sort key (lambda function) to the following line.
     the_samples = sorted(df_metrics[sample_id_string].unique().tolist())
     
-    all_gray = [utils.LIGHT_GRAY]*len(the_samples)
-    all_true = [True]*len(the_samples)
-    color_mapping = dict(zip(the_samples, all_gray))
-    is_default = dict(zip(the_samples, all_true)) # whether a sample should be given the default color
-    sample_list = []
-    for sample in the_samples:
-        sample_list.append({'label':html.Span([html.Span('■',
-                                                         style={'color':utils.LIGHT_GRAY,'font-size':36}),
-                                               html.Span(sample, style={'padding-left':6})]),
-                            'value':sample,
-                            # Note: you can use something like 'search':int(sample.split('-')[-1])
-                            # to enable the user to search a long list of samples by something other than
-                            # the alphanumeric beginning of each sample name.
-                            'search':sample})
-    return color_mapping, is_default, sample_list, sort_options, sort_options[-1], facet_options, facet_values
+    label_mapping = dict.fromkeys(the_samples, labels.UNLABELED) # i.e., every sample carries the default label
+    # Searching by something other than the alphanumeric beginning of each sample name
+    # (e.g. by the last part of 'id-7-001234') is handled by the index; see search_samples().
+    datasets.set_cached(dataset_key, 'sample search index', SampleSearchIndex(the_samples))
+    # Very long lists of samples are not sent to the browser in full; the user types to search them.
+    sample_list = [layout.make_labeled_option(sample, utils.LIGHT_GRAY)
+                   for sample in the_samples[:utils.MAX_SAMPLE_OPTIONS]]
+    # The windowed bar plot shows the first utils.BAR_WINDOW_SIZE samples (in sort order) at first.
+    window_max = max(len(the_samples) - 1, 0)
+    window = [0, min(utils.BAR_WINDOW_SIZE - 1, window_max)]
+    return label_mapping, sample_list, sort_options, facet_values[-1], facet_options, facet_values, window_max, window
+
+
+@callback(Output('samples-dropdown', 'options', allow_duplicate=True),
+          Input('samples-dropdown', 'search_value'),
+          State('dataset-key', 'data'),
+          State('sample-to-label-map', 'data'),
+          State('label-table', 'data'),
+          State('default-label', 'data'),
+          prevent_initial_call=True)
+def search_samples(search_value : str, dataset_key : str, label_map : dict, label_table : dict,
+                   default_label : int):
+    """
+    The user typed into the samples dropdown. Look the text up in the server-side
+    search index (prefix, then suffix segment, then substring; see indexes.SampleSearchIndex)
+    and send back only the matching samples, with their current colors.
+
+    If the index isn't available (e.g. this server process didn't build it),
+    it gets rebuilt from the label map, whose keys are the sample names.
+    """
+    if not search_value or not label_map:
+        return no_update
+    index = datasets.get_or_build(dataset_key, 'sample search index',
+                                  lambda: SampleSearchIndex(sorted(label_map)))
+    matches = index.search(search_value, limit=utils.MAX_SAMPLE_OPTIONS)
+    # The dropdown also filters its options in the browser, by the words in each option's 'search' string.
+    # Appending the typed text guarantees that the browser keeps every match the server found
+    # (e.g. substring matches, which the browser's word-based filter would otherwise drop).
+    return [layout.make_labeled_option(sample,
+                                       labels.sample_color(sample, label_map, label_table, default_label),
+                                       search=f'{sample} {search_value}')
+            for sample in matches]
 
 
 @callback(Output('new-cat-modal', 'is_open', allow_duplicate=True),
@@ -216,60 +353,82 @@ def new_label__show_color_picker(n_clicks : int):
           Output('categories-dropdown', 'value', allow_duplicate=True),
           Output('new-cat-modal', 'is_open', allow_duplicate=True),
           Output('samples-dropdown', 'options', allow_duplicate=True),
-          Output('sample-to-color-map', 'data', allow_duplicate=True),
-          Output('default-color', 'data', allow_duplicate=True),
+          Output('label-table', 'data', allow_duplicate=True),
+          Output('default-label', 'data', allow_duplicate=True),
+          Output('label-index-version', 'data', allow_duplicate=True),
+          Output('barplot-label-version', 'data', allow_duplicate=True),
+          Output('err-msg', 'children', allow_duplicate=True),
           Input('new-cat-ok', 'n_clicks'),
           State('new-category-name', 'value'),
           State({'type':'color-displayed', 'index':utils.div_display['new cat']}, 'style'),
           State('categories-dropdown', 'options'),
           State('new-default-cat', 'value'),
           State('samples-dropdown', 'options'),
-          State('sample-to-color-map', 'data'),
-          State('sample-to-IsDefaultColor-map', 'data'),
+          State('sample-to-label-map', 'data'),
+          State('label-table', 'data'),
+          State('default-label', 'data'),
+          State('session-id', 'data'),
+          State('label-index-version', 'data'),
+          State('barplot-label-version', 'data'),
           prevent_initial_call='initial_duplicate')
 def accept_new_label(n_clicks : int, name : str, style : dict, options : list, is_default : bool,
-                     sample_options : list, color_map : dict, isDefaultColor_map : dict):
+                     sample_options : list, label_map : dict, label_table : dict, default_label : int,
+                     session_id : str, label_index_version : int, barplot_label_version : int):
     """
     User clicked 'OK' in the 'create new label' modal.
     
     Because this is a new label (introducing a new color), it hasn't been assigned to any sample.
-    If the user checked the 'make this the default label' box, this means 'find all samples
-    flagged as having the default label, and change their label to this new label (and color).'
+    If the user checked the 'make this the default label' box, this means 'all samples
+    carrying the default label now carry this new label (and color).' Since those samples
+    store "the default label" rather than a particular label, only the default label changes.
+    Otherwise no bar changes, so the bar plot is marked as showing the new labeling version
+    and isn't re-rendered (see update_barplot()).
     """
     num_outputs = len(ctx.outputs_list)
     ret_vals = [no_update]*num_outputs
     if n_clicks > 0:
+        if not name or name in label_table['names']:
+            ret_vals[-1] = f'A label named "{name}" already exists.\nChoose a different name.' if name \
+                else 'Type a name for the new label, or click Cancel.'
+            return tuple(ret_vals)
         new_color = style['background']
-        new_option = {'label':html.Span([html.Span('■',style={'color':new_color,'font-size':36}),
-                                         html.Span(name, style={'padding-left':6})]),
-                      'value':name,
-                      'search':name}
-        options.append(new_option)
+        index = labels.get_label_index(session_id, label_index_version, label_map, label_table, default_label)
+        label_id = index.add_label(name, new_color)
+        options.append(layout.make_labeled_option(name, new_color))
         options_sans_option0 = options[1:]
         ret_vals[0] = options     # the updated label options
         ret_vals[1] = options_sans_option0 # the updated label options, sans the 'click to add new label' option
         ret_vals[2] = None # clear the value in categories_dropdown
         ret_vals[3] = False # close the modal (window)
-        sample_label_changed = False
+        ret_vals[5] = Patch() # append the new label to the label table
+        ret_vals[5]['names'].append(name)
+        ret_vals[5]['colors'].append(new_color)
         if is_default:
-            # Any sample marked as being 'the default' receives this new color.
-            for i in range(len(sample_options)):
-                sample_name = sample_options[i]['label']['props']['children'][1]['props']['children']
-                if True == isDefaultColor_map[sample_name]:
-                    color_map[sample_name] = new_color
-                    sample_options[i]['label'] = html.Span([html.Span('■',
-                                                                      style={'color':new_color,
-                                                                             'font-size':36}),
-                                                            html.Span(sample_name,
-                                                                      style={'padding-left':6})])
-                    sample_label_changed = True
-            ret_vals[6] = new_color # propagate the default color to storage
-        if sample_label_changed:
-            ret_vals[4] = sample_options
-            ret_vals[5] = color_map
+            index.set_default(label_id) # a brand-new label isn't carried by any sample, so there's no diff
+            ret_vals[4] = [layout.make_labeled_option(opt['value'],
+                                                      labels.sample_color(opt['value'], label_map,
+                                                                          index.label_table(), label_id))
+                           for opt in sample_options]
+            ret_vals[6] = label_id
+        else:
+            ret_vals[8] = _barplot_label_version_if_current(barplot_label_version, label_index_version,
+                                                            index.version)
+        labels.set_label_index(session_id, index)
+        ret_vals[7] = index.version
     return tuple(ret_vals)
 
 
+def _barplot_label_version_if_current(barplot_label_version : int, label_index_version : int, new_version : int):
+    """
+    For label changes that are already reflected in the bar plot (or don't affect it):
+    return the new labeling version for dcc.Store(id='barplot-label-version') if the bar plot was
+    up to date before the change, so that update_barplot() doesn't re-render it; otherwise no_update.
+    """
+    if barplot_label_version is not None and barplot_label_version == (label_index_version or 0):
+        return new_version
+    return no_update
+
+
 @callback(Output('new-cat-modal', 'is_open', allow_duplicate=True),
           Output('new-category-name', 'value', allow_duplicate=True),
           Output({'type':'color-displayed', 'index':utils.div_display['new cat']}, 'style', allow_duplicate=True),
@@ -328,10 +487,12 @@ def edit_label__show_color_picker(n_clicks : int):
           State('categories-dropdown', 'value'),
           State('categories-dropdown', 'options'),
           State({'type':'color-displayed', 'index':utils.div_display['edit cat']}, 'style'),
-          State('default-color', 'data'),
+          State('label-table', 'data'),
+          State('default-label', 'data'),
           prevent_initial_call='initial_duplicate')
 def process_edit_cat_modal_OpeningClosing(is_opening : bool, choice : str, label_options : list,
-                                          old_editing_modal_style : dict, default_color : str):
+                                          old_editing_modal_style : dict, label_table : dict,
+                                          default_label : int):
     """
     This callback handles the 'edit existing category' modal when it opens and closes.
     """
@@ -348,7 +509,7 @@ def process_edit_cat_modal_OpeningClosing(is_opening : bool, choice : str, label
             new_editing_modal_style = old_editing_modal_style.copy()
             new_editing_modal_style['background'] = current_color
             new_editing_modal_style['color'] = new_editing_modal_style['background']
-            if current_color == default_color:
+            if choice in label_table['names'] and label_table['names'].index(choice) == default_label:
                 return formatted_choice, choice, new_editing_modal_style, True, True
             return formatted_choice, choice, new_editing_modal_style, False, False
     return no_update, no_update, no_update, no_update, no_update
@@ -359,9 +520,13 @@ def process_edit_cat_modal_OpeningClosing(is_opening : bool, choice : str, label
           Output('categories-dropdown', 'value', allow_duplicate=True),
           Output('edit-cat-modal', 'is_open', allow_duplicate=True),
           Output('samples-dropdown', 'options', allow_duplicate=True),
-          Output('sample-to-color-map', 'data', allow_duplicate=True),
-          Output('sample-to-IsDefaultColor-map', 'data', allow_duplicate=True),
-          Output('default-color', 'data', allow_duplicate=True),
+          Output('label-table', 'data', allow_duplicate=True),
+          Output('sample-to-label-map', 'data', allow_duplicate=True),
+          Output('default-label', 'data', allow_duplicate=True),
+          Output('label-index-version', 'data', allow_duplicate=True),
+          Output('barplot-graph-id', 'figure', allow_duplicate=True),
+          Output('barplot-label-version', 'data', allow_duplicate=True),
+          Output('err-msg', 'children', allow_duplicate=True),
           Input('edit-cat-ok', 'n_clicks'),
           State('edit-category-name', 'value'),
           State({'type':'color-displayed', 'index':utils.div_display['edit cat']}, 'style'),
@@ -369,78 +534,78 @@ def process_edit_cat_modal_OpeningClosing(is_opening : bool, choice : str, label
           State('categories-dropdown', 'value'),
           State('edit-default-cat', 'value'),
           State('samples-dropdown', 'options'),
-          State('sample-to-color-map', 'data'),
-          State('sample-to-IsDefaultColor-map', 'data'),
+          State('sample-to-label-map', 'data'),
+          State('label-table', 'data'),
+          State('default-label', 'data'),
+          State('session-id', 'data'),
+          State('label-index-version', 'data'),
+          State('barplot-trace-map', 'data'),
+          State('barplot-label-version', 'data'),
           prevent_initial_call='initial_duplicate')
 def accept_edited_label(n_clicks : int, new_name : str, style : dict, label_options : list,
                         unedited_name : str, is_default : bool, sample_options : list,
-                        color_map : dict, isDefaultColor_map : dict):
+                        label_map : dict, label_table : dict, default_label : int,
+                        session_id : str, label_index_version : int, trace_map : dict,
+                        barplot_label_version : int):
     """
     User clicked 'OK' in the 'edit existing label' modal
     
     Note: The user's 'edit' can be to only the color or only the color's 'is default' status;
     in these cases, new_name and unedited_choice will be equal. (This is just an "FYI.")
+
+    Samples store label ids, not label names or colors, so a rename or recolor only changes
+    the label table, and the bar plot is patched in place: only the traces listed for this label
+    in dcc.Store(id='barplot-trace-map') get their name and color changed. The bar plot is then marked
+    as showing the new labeling version, so update_barplot() doesn't re-render it.
+    Making the label the default changes which bars carry it, so then the bar plot is re-rendered
+    (once, by update_barplot()) instead of patched.
     """
     num_outputs = len(ctx.outputs_list)
     ret_vals = [no_update]*num_outputs
     if n_clicks > 0:
+        if not new_name or (new_name != unedited_name and new_name in label_table['names']):
+            ret_vals[-1] = f'A label named "{new_name}" already exists.\nChoose a different name.' if new_name \
+                else 'Type a name for this label, or click Cancel.'
+            return tuple(ret_vals)
         ret_vals[2] = None  # clear the value in categories_dropdown
         ret_vals[3] = False # close the modal (window)
         new_color = style['background']
-        new_option = {'label':html.Span([html.Span('■',style={'color':new_color,'font-size':36}),
-                                         html.Span(new_name, style={'padding-left':6})]),
-                      'value':new_name,
-                      'search':new_name}
-        label_option_changed = False # Typically True; will be False if the 'edit' was "notDefaut -> default."
-        # Find this label among the 'options' of the Dropdown of labels and replace it if necessary.
-        for i in range(len(label_options)):
-            if label_options[i]['value'] == unedited_name:
-                unedited_color = label_options[i]['label']['props']['children'][0]['props']['style']['color']
-                if new_name != unedited_name or new_color != unedited_color:
-                    label_options[i] = new_option
-                    label_option_changed = True
-                break
-        sample_option_changed = False
-        color_map_changed = False
-        isDefaultColor_map_changed = False
-        # Traverse the samples (sample = color label + parent ID) and make any necessary updates.
-        for i in range(len(sample_options)):
-            sample_name = sample_options[i]['label']['props']['children'][1]['props']['children']
-            sample_color = sample_options[i]['label']['props']['children'][0]['props']['style']['color']
-            # Make changes if:
-            # 1. The sample has the original (unedited) color and that color has changed.
-            # 2. The sample is flagged as needing the 'default' color and this edit makes new_color the default.
-            # 3. The sample already has the new color and this edit makes new_color the default.
-            #    In this case, change its 'is default' flag to True.
-            if sample_color == unedited_color and unedited_color != new_color: # case 1
-                color_map[sample_name] = new_color
-                sample_options[i]['label']['props']['children'][0]['props']['style']['color'] = new_color
-                color_map_changed = True
-                sample_option_changed = True
-            if is_default:
-                if isDefaultColor_map[sample_name]:
-                    if sample_color != new_color:                              # case 2
-                        color_map[sample_name] = new_color
-                        sample_options[i]['label']['props']['children'][0]['props']['style']['color'] = new_color
-                        color_map_changed = True
-                        sample_option_changed = True
-                    # Otherwise new_color is the default, the sample needs the default color,
-                    # and the sample already has it.
-                elif sample_color == new_color:                                # case 3
-                    isDefaultColor_map[sample_name] = True
-                    isDefaultColor_map_changed = True
-        if label_option_changed:
-            label_options_sans_option0 = label_options[1:]
+        index = labels.get_label_index(session_id, label_index_version, label_map, label_table, default_label)
+        label_id = index.label_id(unedited_name)
+        unedited_color = index.label_colors[label_id]
+        becomes_default = is_default and label_id != index.default_label
+        if new_name != unedited_name or new_color != unedited_color:
+            index.edit_label(label_id, new_name, new_color)
+            label_options[label_id + 1] = layout.make_labeled_option(new_name, new_color) # option 0 is 'add new'
             ret_vals[0] = label_options
-            ret_vals[1] = label_options_sans_option0
-        if sample_option_changed:
-            ret_vals[4] = sample_options
-        if color_map_changed:
-            ret_vals[5] = color_map
-        if isDefaultColor_map_changed:
-            ret_vals[6] = isDefaultColor_map
-        if is_default:
-            ret_vals[7] = new_color # Update even if new_color==unedited_color. Edit could be 'make default' alone.
+            ret_vals[1] = label_options[1:]
+            ret_vals[5] = Patch()
+            ret_vals[5]['names'][label_id] = new_name
+            ret_vals[5]['colors'][label_id] = new_color
+            if not becomes_default:
+                if trace_map and str(label_id) in trace_map:
+                    ret_vals[9] = Patch()
+                    for i in trace_map[str(label_id)]:
+                        ret_vals[9]['data'][i]['name'] = new_name
+                        ret_vals[9]['data'][i]['marker']['color'] = new_color
+                ret_vals[10] = _barplot_label_version_if_current(barplot_label_version, label_index_version,
+                                                                 index.version)
+        if becomes_default:
+            label_diff = index.set_default(label_id)
+            if label_diff:
+                ret_vals[6] = Patch()
+                for sample_name, stored_id in label_diff.items():
+                    ret_vals[6][sample_name] = stored_id
+            label_map.update(label_diff)
+            ret_vals[7] = label_id
+        if index.version != (label_index_version or 0):
+            ret_vals[4] = [layout.make_labeled_option(opt['value'],
+                                                      labels.sample_color(opt['value'], label_map,
+                                                                          index.label_table(),
+                                                                          index.default_label))
+                           for opt in sample_options]
+            labels.set_label_index(session_id, index)
+            ret_vals[8] = index.version
     return tuple(ret_vals)
 
 
@@ -478,121 +643,126 @@ def cancel_edited_label(n_clicks : int, style_to_cancel : dict):
    and close the 'color picker' modal.
 """
 
-@callback(Output('color-choice-string', 'value', allow_duplicate=True),
-          Output('color-choice-string', 'n_submit', allow_duplicate=True),
-          Input({'type':'ColorChoice', 'index':ALL}, 'n_clicks'),
-          State('color-choice-string', 'n_submit'),
-          prevent_initial_call='initial_duplicate')
-def on_color_swatch_click(n_clicks : list, n_submit : int):
-    """
-    Option 1 above:  click a swatch within the grid of swatches.
-    Forwards the hex color string to the Input and mimics the user clicking 'enter'.
-    """
-    if n_clicks and ctx.triggered_id:
-        # ctx.triggered_id is a Dash extension of dict
-        triggered_index = ctx.triggered_id['index']
-        color_chosen = utils.tableau20[triggered_index]
-        return color_chosen, n_submit+1
-    return no_update, no_update
-
+# These run in the browser (they only move strings and styles around),
+# so picking a color doesn't wait for the server.
 
-@callback(Output('color-choice-string', 'value', allow_duplicate=True),
-          Output('color-choice-string', 'n_submit', allow_duplicate=True),
-          Input('color-wheel', 'value'),
-          State('color-choice-string', 'n_submit'),
-          prevent_initial_call='initial_duplicate') 
-def on_color_wheel_click(this_hex_color : str, n_submit : int):
+# Option 1 above:  click a swatch within the grid of swatches.
+# Forwards the hex color string to the Input and mimics the user clicking 'enter'.
+clientside_callback(
     """
-    Option 2 above:  click the "show color wheel" button and choose a color.
-    Forwards the hex color string to the Input and mimics the user clicking 'enter'.
+    function(n_clicks, n_submit) {
+        const triggered = window.dash_clientside.callback_context.triggered;
+        if (!n_clicks || !triggered.length || triggered[0].prop_id === '.') {
+            return [window.dash_clientside.no_update, window.dash_clientside.no_update];
+        }
+        // prop_id is e.g. '{"index":3,"type":"ColorChoice"}.n_clicks'
+        const prop_id = triggered[0].prop_id;
+        const triggered_index = JSON.parse(prop_id.slice(0, prop_id.lastIndexOf('.'))).index;
+        const colors = TABLEAU20;
+        return [colors[triggered_index], n_submit + 1];
+    }
+    """.replace('TABLEAU20', json.dumps(utils.tableau20)),
+    Output('color-choice-string', 'value', allow_duplicate=True),
+    Output('color-choice-string', 'n_submit', allow_duplicate=True),
+    Input({'type':'ColorChoice', 'index':ALL}, 'n_clicks'),
+    State('color-choice-string', 'n_submit'),
+    prevent_initial_call='initial_duplicate')
+
+
+# Option 2 above:  click the "show color wheel" button and choose a color.
+# Forwards the hex color string to the Input and mimics the user clicking 'enter'.
+clientside_callback(
     """
-    return this_hex_color, n_submit+1
-
-
-@callback(Output('final-color-choice', 'style'),
-          Output('color-choice-string', 'value', allow_duplicate=True),
-          Output('err-msg', 'children', allow_duplicate=True),
-          Input('color-choice-string', 'n_submit'),
-          State('color-choice-string', 'value'),
-          State('final-color-choice', 'style'),
-          prevent_initial_call='initial_duplicate')
-def on_hex_color_string_input(n_submit : int, hex_string : str, style : dict):
-    """
-    This can be triggered by option 3 above (user enters a string and clicks 'enter')
-    or by options 1 and 2 automatically "entering the string and clicking 'enter'."
-    """
-    if n_submit > 0:
-        # Validate hex_string before proceeding!
-        # Note: Eric first used try/raise on int_value = int(hex_string[1:], 16),
-        # but the edge cases were annoying. Hence what follows.
-        invalid_hex_string = False
-        if len(hex_string) == 6:
-            hex_string = '#' + hex_string
-        if len(hex_string) != 7 or hex_string[0] != '#':
-            invalid_hex_string = True
-        i = 1
-        while i < 7 and not invalid_hex_string:
-            c = hex_string[i]
-            if c.isalpha():
-                if c.lower() > 'f':
-                    invalid_hex_string = True
-            elif not c.isdigit():
-                invalid_hex_string = True
-            i += 1
-        if invalid_hex_string:
-            err_msg = f'\"{hex_string}\" is not a valid color specification.\n' \
-                +'This must be a 6-digit hexadecimal value, e.g. \"#FF0000\" for \"red.\"'
-            # Reset the hex string and the accompanying Div that displays that color.
-            style['color'] = style['background'] = '#FFFFFF'
-            return style, '#FFFFFF', err_msg
-        style['color'] = style['background'] = hex_string
-        return style, no_update, no_update
-    return no_update, no_update, no_update
-
-
-@callback(Output({'type':'color-displayed', 'index':ALL}, 'style', allow_duplicate=True),
-          Output('color-wheel', 'value', allow_duplicate=True),
-          Output('color-picker', 'is_open', allow_duplicate=True),
-          Input('ok-color-choice', 'n_clicks'),
-          State('final-color-choice', 'style'),
-          State({'type':'color-displayed', 'index':ALL}, 'style'),
-          State('idx-of-parent-modal', 'data'),
-          prevent_initial_call='initial_duplicate')
-def apply_color(n_clicks : int, style_with_color_choice : dict, old_styles : list, idx : int):
+    function(this_hex_color, n_submit) {
+        return [this_hex_color, n_submit + 1];
+    }
+    """,
+    Output('color-choice-string', 'value', allow_duplicate=True),
+    Output('color-choice-string', 'n_submit', allow_duplicate=True),
+    Input('color-wheel', 'value'),
+    State('color-choice-string', 'n_submit'),
+    prevent_initial_call='initial_duplicate')
+
+
+# This can be triggered by option 3 above (user enters a string and clicks 'enter')
+# or by options 1 and 2 automatically "entering the string and clicking 'enter'."
+clientside_callback(
     """
-    Display the chosen color in the parent modal and close the 'color-picker' modal.
-    Also reset the "color wheel" button to white.
-    """
-    output_style_list = [no_update]*len(old_styles)
-    if n_clicks > 0:
-        color_choice = style_with_color_choice['color']
-        new_style = old_styles[idx].copy()
-        new_style['color'] = new_style['background'] = color_choice
-        output_style_list[idx] = new_style
-        return output_style_list, "#FFFFFF", False
-    return output_style_list, "#FFFFFF", no_update
-
-
-@callback(Output('color-picker', 'is_open', allow_duplicate=True),
-          Output('color-wheel', 'value', allow_duplicate=True),
-          Output('lineplot-graph-id', 'clickData', allow_duplicate=True),
-          Input('cancel-color-choice', 'n_clicks'),
-          State('idx-of-parent-modal', 'data'),
-          prevent_initial_call='initial_duplicate')
-def cancel_color_picker(n_clicks : int, idx : int):
+    function(n_submit, hex_string, style) {
+        const no_update = window.dash_clientside.no_update;
+        if (!(n_submit > 0)) {
+            return [no_update, no_update, no_update];
+        }
+        // Validate hex_string before proceeding!
+        hex_string = hex_string || '';
+        if (hex_string.length === 6) {
+            hex_string = '#' + hex_string;
+        }
+        if (!/^#[0-9a-fA-F]{6}$/.test(hex_string)) {
+            const err_msg = '"' + hex_string + '" is not a valid color specification.\\n'
+                + 'This must be a 6-digit hexadecimal value, e.g. "#FF0000" for "red."';
+            // Reset the hex string and the accompanying Div that displays that color.
+            return [Object.assign({}, style, {color: '#FFFFFF', background: '#FFFFFF'}), '#FFFFFF', err_msg];
+        }
+        return [Object.assign({}, style, {color: hex_string, background: hex_string}), no_update, no_update];
+    }
+    """,
+    Output('final-color-choice', 'style'),
+    Output('color-choice-string', 'value', allow_duplicate=True),
+    Output('err-msg', 'children', allow_duplicate=True),
+    Input('color-choice-string', 'n_submit'),
+    State('color-choice-string', 'value'),
+    State('final-color-choice', 'style'),
+    prevent_initial_call='initial_duplicate')
+
+
+# Display the chosen color in the parent modal and close the 'color-picker' modal.
+# Also reset the "color wheel" button to white.
+clientside_callback(
     """
-    This is for the canceling/closing the modal of color options.
-    If the color picker was triggered by the user clicking on a trace in a plot,
-    we reset that plot's clickData so the user can edit that trace by clicking on it.
-    (If we don't reset clickData, repeated clicks on the trace will do nothing.)
+    function(n_clicks, style_with_color_choice, old_styles, idx) {
+        const output_style_list = old_styles.map(function() { return window.dash_clientside.no_update; });
+        if (n_clicks > 0) {
+            const color_choice = style_with_color_choice['color'];
+            output_style_list[idx] = Object.assign({}, old_styles[idx], {color: color_choice, background: color_choice});
+            return [output_style_list, '#FFFFFF', false];
+        }
+        return [output_style_list, '#FFFFFF', window.dash_clientside.no_update];
+    }
+    """,
+    Output({'type':'color-displayed', 'index':ALL}, 'style', allow_duplicate=True),
+    Output('color-wheel', 'value', allow_duplicate=True),
+    Output('color-picker', 'is_open', allow_duplicate=True),
+    Input('ok-color-choice', 'n_clicks'),
+    State('final-color-choice', 'style'),
+    State({'type':'color-displayed', 'index':ALL}, 'style'),
+    State('idx-of-parent-modal', 'data'),
+    prevent_initial_call='initial_duplicate')
+
+
+# This is for the canceling/closing the modal of color options.
+# If the color picker was triggered by the user clicking on a trace in a plot,
+# we reset that plot's clickData so the user can edit that trace by clicking on it.
+# (If we don't reset clickData, repeated clicks on the trace will do nothing.)
+clientside_callback(
     """
-    num_outputs = len(ctx.outputs_list)
-    no_updates = [no_update]*num_outputs
-    if n_clicks > 0:
-        if idx == utils.div_display['line plot']:
-            return False, utils.WHITE, None
-        return False, utils.WHITE, no_update
-    return no_updates
+    function(n_clicks, idx) {
+        const no_update = window.dash_clientside.no_update;
+        if (n_clicks > 0) {
+            if (idx === LINE_PLOT_IDX) {
+                return [false, 'WHITE', null];
+            }
+            return [false, 'WHITE', no_update];
+        }
+        return [no_update, no_update, no_update];
+    }
+    """.replace('LINE_PLOT_IDX', str(utils.div_display['line plot'])).replace('WHITE', utils.WHITE),
+    Output('color-picker', 'is_open', allow_duplicate=True),
+    Output('color-wheel', 'value', allow_duplicate=True),
+    Output('lineplot-graph-id', 'clickData', allow_duplicate=True),
+    Input('cancel-color-choice', 'n_clicks'),
+    State('idx-of-parent-modal', 'data'),
+    prevent_initial_call='initial_duplicate')
 #
 #---------------------End 'color picker' callbacks---------------------------------
 
@@ -614,45 +784,52 @@ def sample_chosen_from_dropdown(choice, samples_options):
     return no_update, no_update
 
 
-@callback(Output('sample-to-color-map', 'data', allow_duplicate=True),
+@callback(Output('sample-to-label-map', 'data', allow_duplicate=True),
           Output('samples-dropdown', 'options', allow_duplicate=True),
           Output('samples-dropdown', 'value', allow_duplicate=True),
           Output('assign-label-modal', 'is_open', allow_duplicate=True),
           Output('label-assignment-dropdown', 'value', allow_duplicate=True),
-          Output('sample-to-IsDefaultColor-map', 'data', allow_duplicate=True),
+          Output('label-index-version', 'data', allow_duplicate=True),
           Input('label-assignment-ok', 'n_clicks'),
           State('labeled-sample', 'children'),
           State('label-assignment-dropdown', 'value'),
-          State('label-assignment-dropdown', 'options'),
           State('samples-dropdown', 'options'),
-          State('sample-to-color-map', 'data'),
-          State('sample-to-IsDefaultColor-map', 'data'),
-          State('default-color', 'data'),
+          State('sample-to-label-map', 'data'),
+          State('label-table', 'data'),
+          State('default-label', 'data'),
+          State('session-id', 'data'),
+          State('label-index-version', 'data'),
           prevent_initial_call='initial_duplicate')
-def assign_label_to_sample(n_clicks : int, sample_to_be_labeled, new_label_str, label_options,
-                           sample_options, color_map, isDefaultColor_map : dict, default_color : str):
+def assign_label_to_sample(n_clicks : int, sample_to_be_labeled, new_label_str, sample_options,
+                           label_map : dict, label_table : dict, default_label : int,
+                           session_id : str, label_index_version : int):
     """
     User clicked 'OK' to assign a label to a sample.
+    Only the changed entry of the sample-to-label map is sent back to the browser.
     """
+    num_outputs = len(ctx.outputs_list)
+    ret_vals = [no_update]*num_outputs
     if n_clicks > 0:
+        ret_vals[2] = None  # clear the value in samples-dropdown
+        ret_vals[3] = False # close the modal (window)
+        ret_vals[4] = None  # clear the value in label-assignment-dropdown
+        if not new_label_str:
+            return tuple(ret_vals)
         sample_name = sample_to_be_labeled['props']['children'][1]['props']['children']
-        for i in range(len(label_options)):
-            if label_options[i]['value'] == new_label_str:
-                new_sample_color = label_options[i]['label']['props']['children'][0]['props']['style']['color']
-                break
-        newly_labeled_sample = html.Span([html.Span('■', style={'color':new_sample_color,'font-size':36}),
-                                          html.Span(sample_name, style={'padding-left':6})])
-        for i in range(len(sample_options)):
-            if sample_options[i]['value'] == sample_name:
-                sample_options[i]['label'] = newly_labeled_sample
-                break
-        color_map[sample_name] = new_sample_color
-        orig_bool_entry = isDefaultColor_map[sample_name]
-        isDefaultColor_map[sample_name] = (new_sample_color == default_color)
-        if isDefaultColor_map[sample_name] != orig_bool_entry:
-            return color_map, sample_options, None, False, None, isDefaultColor_map
-        return color_map, sample_options, None, False, None, no_update
-    return no_update, no_update, no_update, no_update, no_update, no_update
+        index = labels.get_label_index(session_id, label_index_version, label_map, label_table, default_label)
+        label_diff = index.assign([sample_name], index.label_id(new_label_str))
+        if label_diff:
+            ret_vals[0] = Patch()
+            for sample, stored_id in label_diff.items():
+                ret_vals[0][sample] = stored_id
+            label_map.update(label_diff)
+            ret_vals[1] = [layout.make_labeled_option(opt['value'],
+                                                      labels.sample_color(opt['value'], label_map,
+                                                                          label_table, default_label))
+                           for opt in sample_options]
+            labels.set_label_index(session_id, index)
+            ret_vals[5] = index.version
+    return tuple(ret_vals)
 
 
 @callback(Output('assign-label-modal', 'is_open', allow_duplicate=True),
@@ -696,10 +873,10 @@ def show_subset_label_assignment_modal(n_clicks : int, label_options : list):
           Output('err-msg', 'children', allow_duplicate=True),
           Input('subset-label-assignment', 'is_open'),
           State('label-assignment-dropdown', 'options'),
-          State('metrics-dict', 'data'),
+          State('dataset-key', 'data'),
           prevent_initial_call='initial_duplicate')
 def load_subset_label_assignment_modal(is_opening : bool, label_options : list,
-                                       df_as_dicts : list):
+                                       dataset_key : str):
     """
     Function to populate the "subset label assignment" modal when it opens.
 
@@ -709,8 +886,8 @@ def load_subset_label_assignment_modal(is_opening : bool, label_options : list,
        Whether the modal is opening or closing.
     label_options : list
        The 'options' list of available labels, from the dropdown on the dashboard.
-    df_as_dicts : list
-       The "metrics" records, i.e. a list of rows with each row expressed as a dict.
+    dataset_key : str
+       The key of the data set whose "metrics" are queried (see _study_tables()).
 
     Returns
     -------
@@ -720,14 +897,18 @@ def load_subset_label_assignment_modal(is_opening : bool, label_options : list,
     """
     num_outputs = len(ctx.outputs_list)
     no_updates = [no_update]*num_outputs
-    if not is_opening or not label_options or not df_as_dicts:
+    if not is_opening or not label_options or not dataset_key:
+        return tuple(no_updates)
+    try:
+        _, df_in = _study_tables(dataset_key)
+    except ValueError as e:
+        no_updates[-1] = str(e)
         return tuple(no_updates)
     for required_column in ['prop value', 'prop name']:
-        if required_column not in df_as_dicts[0]:
+        if required_column not in df_in.columns:
             err_msg = f"Error: Required column {required_column} was not found in 'metrics'."
             no_updates[-1] = err_msg
             return tuple(no_updates)
-    df_in = pd.DataFrame.from_dict(df_as_dicts)
     non_prop_columns = list(set(df_in.columns.to_list()) - set(['prop name', 'prop value']))
     if len(non_prop_columns) != 1:
         err_msg = f"Found 0 or multiple non-'property' columns in 'metrics' {non_prop_columns}. Expected 1."
@@ -751,23 +932,29 @@ def add_row_to_query(n_clicks : int, rows : list):
 
 
 @callback(Output('samples-dropdown', 'options', allow_duplicate=True),
-          Output('sample-to-color-map', 'data', allow_duplicate=True),
-          Output('sample-to-IsDefaultColor-map', 'data', allow_duplicate=True),
+          Output('sample-to-label-map', 'data', allow_duplicate=True),
           Output('subset-label-assignment', 'is_open', allow_duplicate=True),
+          Output('label-index-version', 'data', allow_duplicate=True),
           Output('err-msg', 'children', allow_duplicate=True),
           Input('subset-label-assignment-ok', 'n_clicks'),
           State('expanding-query-div', 'children'),
-          State('metrics-dict', 'data'),
+          State('dataset-key', 'data'),
           State('label-assignment-dropdown-2', 'value'),
-          State('label-assignment-dropdown-2', 'options'),
           State('samples-dropdown', 'options'),
-          State('sample-to-color-map', 'data'),
-          State('sample-to-IsDefaultColor-map', 'data'),
-          State('default-color', 'data'),
+          State('sample-to-label-map', 'data'),
+          State('label-table', 'data'),
+          State('default-label', 'data'),
+          State('session-id', 'data'),
+          State('label-index-version', 'data'),
           prevent_initial_call=True)
-def do_query(n_clicks : int, rows : list, df_as_dicts : list,
-             new_label_str, label_options, sample_options,
-             color_map, isDefaultColor_map : dict, default_color : str):
+def do_query(n_clicks : int, rows : list, dataset_key : str,
+             new_label_str, sample_options, label_map : dict, label_table : dict, default_label : int,
+             session_id : str, label_index_version : int):
+    """
+    User clicked 'OK' in the 'label a subset' modal. Runs the query and assigns the chosen label
+    to every sample in the result, via the server-side label index (see labels.LabelIndex),
+    and sends back only the changed entries of the sample-to-label map.
+    """
     num_outputs = len(ctx.outputs_list)
     no_updates = [no_update]*num_outputs
     if not n_clicks or not rows:
@@ -776,7 +963,11 @@ def do_query(n_clicks : int, rows : list, df_as_dicts : list,
         err_msg = 'Choose a label from the available options, or click Cancel.'
         no_updates[-1] = err_msg
         return tuple(no_updates)
-    df_in = pd.DataFrame.from_dict(df_as_dicts)
+    try:
+        _, df_in = _study_tables(dataset_key)
+    except ValueError as e:
+        no_updates[-1] = str(e)
+        return tuple(no_updates)
     num_rows = len(rows)
     subset = []
     raw_query = []
@@ -813,39 +1004,23 @@ def do_query(n_clicks : int, rows : list, df_as_dicts : list,
         err_msg = str(e)
         no_updates[-1] = err_msg
         return tuple(no_updates)
-    # Get the color corresponding to new_label_str:
-    for i in range(len(label_options)):
-        if label_options[i]['value'] == new_label_str:
-            new_sample_color = label_options[i]['label']['props']['children'][0]['props']['style']['color']
-            break
-    newColor_is_the_defaultColor = (new_sample_color == default_color)
-    isDefaultColor_map_changed = False
-    color_map_changed = False
-    # Assign the label to all samples in the selected subset and update the color map(s).
-    for i in range(len(sample_options)):
-        sample_name = sample_options[i]['value']
-        if sample_name in subset:
-            old_sample_color = color_map[sample_name]
-            oldColor_was_the_defaultColor = (old_sample_color == default_color)
-            if old_sample_color == new_sample_color:
-                continue
-            newly_labeled_sample = html.Span([html.Span('■', style={'color':new_sample_color,'font-size':36}),
-                                              html.Span(sample_name, style={'padding-left':6})])
-            sample_options[i]['label'] = newly_labeled_sample
-            color_map[sample_name] = new_sample_color
-            color_map_changed = True
-            if newColor_is_the_defaultColor:
-                isDefaultColor_map[sample_name] = True
-                isDefaultColor_map_changed = True
-            elif oldColor_was_the_defaultColor:
-                isDefaultColor_map[sample_name] = False
-                isDefaultColor_map_changed = True
-
-    retvals = [sample_options, no_update, no_update, False, no_update] # False = "close the modal"
-    if color_map_changed:
-        retvals[1] = color_map
-    if isDefaultColor_map_changed:
-        retvals[2] = isDefaultColor_map
+    # Assign the label to all samples in the selected subset in one step,
+    # and get back only the entries of the sample-to-label map that changed.
+    index = labels.get_label_index(session_id, label_index_version, label_map, label_table, default_label)
+    label_diff = index.assign(subset, index.label_id(new_label_str))
+
+    retvals = [no_update, no_update, False, no_update, no_update] # False = "close the modal"
+    if label_diff:
+        label_map.update(label_diff)
+        retvals[0] = [layout.make_labeled_option(opt['value'],
+                                                 labels.sample_color(opt['value'], label_map,
+                                                                     label_table, default_label))
+                      for opt in sample_options]
+        retvals[1] = Patch()
+        for sample, stored_id in label_diff.items():
+            retvals[1][sample] = stored_id
+        labels.set_label_index(session_id, index)
+        retvals[3] = index.version
     return tuple(retvals)
 
 
@@ -864,81 +1039,159 @@ def cancel_subset_label_assignment(n_clicks : int):
 
 #-------------Begin 'interactive plotting options' callbacks-----------------------
 #
-@callback(Output('barplot-graph-id', 'figure'),
+@callback(Output('barplot-graph-id', 'figure', allow_duplicate=True),
           Output('samples-dropdown', 'options', allow_duplicate=True),
           Output('sortorder-dropdown', 'options', allow_duplicate=True),
           Output('sortorder-dropdown', 'value', allow_duplicate=True),
+          Output('barplot-trace-map', 'data'),
+          Output('barplot-label-version', 'data', allow_duplicate=True),
+          Output('barplot-window-slider', 'value', allow_duplicate=True),
+          Output('barplot-window-state', 'data'),
           Output('err-msg', 'children', allow_duplicate=True),
           Input('render-barplot-button', 'n_clicks'),
-          Input('sample-to-color-map', 'data'),
-          Input('label-assignment-dropdown', 'options'),
+          Input('label-index-version', 'data'),
           Input('barPlot-hideXticks-checkbox', 'value'),
           Input('sortorder-dropdown', 'value'),
           Input('sortorder-radioitems', 'value'),
-          State('metrics-dict', 'data'),
+          Input('barplot-mode-radioitems', 'value'),
+          Input('barplot-window-slider', 'value'),
+          Input('barplot-graph-id', 'relayoutData'),
           State('samples-dropdown', 'options'),
           State('barplot-facetVars-checklist', 'value'),
+          State('label-table', 'data'),
+          State('session-id', 'data'),
+          State('sample-to-label-map', 'data'),
+          State('default-label', 'data'),
+          State('barplot-label-version', 'data'),
+          State('dataset-key', 'data'),
+          State('barplot-window-state', 'data'),
           prevent_initial_call='initial_duplicate')
-def update_barplot(n_clicks : int, color_map : dict, list_of_labels : list,
+def update_barplot(n_clicks : int, label_index_version : int,
                    hide_x_ticks : bool, sorting_key : str,
-                   sorting_direction : int, df_as_dict : list, labeled_samples : list,
-                   props_to_plot : list):
+                   sorting_direction : int, barplot_mode : int, window : list, relayout_data : dict,
+                   labeled_samples : list,
+                   props_to_plot : list, label_table : dict, session_id : str,
+                   label_map : dict, default_label : int, barplot_label_version : int, dataset_key : str,
+                   window_state : dict):
     """
     Function to make/update the faceted bar plot.
     This will be called (the plot will be updated) when the user:
-    * sets or changes the map from ID to color (includes actions defining the 'default' label)
-    * assigns a new label to a sample
+    * assigns a label to one or more samples
+    * makes a different label the 'default' label
     * clicks the checkbox to hide or "un-hide" the x-axis tick labels
     * changes the property by which the data should be sorted
     * changes the direction of the sort
+    * chooses another view (one bar per sample, the distribution, or a window of the samples)
+      or moves the window, with the slider or by panning or zooming the windowed bar plot
+
+    The windowed bar plot is paged on the server: the full sort order stays here (see _get_or_sort_bar_plot_data()),
+    and only the bars of the samples in view, plus a margin on each side (see utils.BAR_WINDOW_MARGIN), are sent.
+    Panning or zooming within the bars sent only moves the slider; going beyond them sends the bars around the new view.
+
+    All label changes reach this function through a single versioned labeling state:
+    every label action writes the new labeling version to dcc.Store(id='label-index-version')
+    (along with any changes to the label map, the label table, and the default label),
+    so each action causes at most one call. Label actions that have already patched the bar plot
+    (or don't change it) also write that version to dcc.Store(id='barplot-label-version'),
+    the version the bar plot shows, and then the bar plot isn't re-rendered.
 
     Parameters
     ----------
     n_clicks : int
        The number of times this button has been clicked.
-    color_map : dict
-       A mapping from ID (str) to color (hex str).
-    list_of_labels : list
-       The current list of options in the 'labels' dropdown (color swatch + label name).
+    label_index_version : int
+       The labeling version (see labels.py).
     hide_x_ticks : bool
        Whether to hide the x-axis tick labels.
     sorting_key : str
        The property name (or column, e.g. 'Patient ID') by whose values the bars should be sorted.
     sorting_direction : int
        1 = ascending, 0 = descending
-    df_as_dict : list
-       List of dicts (one per DF row) created by calling "to_dict" on a DataFrame in another callback.
-       Should contain, at minimum, columns [x-axis name], 'prop name', and 'prop value'.
+    barplot_mode : int
+       utils.BARPLOT_SAMPLES (one bar per sample), utils.BARPLOT_HISTOGRAM (the distribution of each property,
+       stacked by label; see utils.make_binned_bar_plot()), or utils.BARPLOT_WINDOW (one bar per sample,
+       for the window of the sorted samples chosen with the slider).
+    window : list of int
+       The first and last positions (in sort order) of the samples shown in the windowed view.
+    relayout_data : dict
+       The bar plot's latest pan/zoom event; only its x-axis ranges are used, in the windowed view.
     labeled_samples : list
        The current list of options in the 'samples' dropdown (color swatch + parent ID).
+       This may be only some of the samples (see search_samples()).
     props_to_plot : list
        The properties to plot (one facet for each) vs. ID ('Patient ID', 'Sample ID', etc.).
+    label_table : dict
+       The names and colors of the labels; see labels.py.
+       Renaming or recoloring a label doesn't call this function; see accept_edited_label().
+    session_id : str
+       The browser session's id. A render is dropped as soon as a newer one starts for the same session
+       (see render_scheduler.py).
+    label_map : dict
+       A mapping from ID (str) to label id (int); see labels.py.
+    default_label : int
+       The id of the default label, or labels.UNLABELED.
+    barplot_label_version : int
+       The labeling version the bar plot currently shows.
+    dataset_key : str
+       The key of this data set in the server-side registry (see datasets.py). Its "metrics" are read
+       from there (see _study_tables()); they contain, at minimum, columns [x-axis name], 'prop name',
+       and 'prop value'. Sort orders are cached per data set (see _get_or_sort_bar_plot_data()).
+    window_state : dict
+       The positions of the samples in view and of those sent in the windowed view:
+       {'shown':[first, last], 'loaded':[first, last]}.
 
     Returns
     -------
-    figure, list (of labeled samples), str (error message)
-       The figure will be displayed and the 'samples' dropdown options will get re-sorted if necessary.
+    figure, list (of labeled samples), list, str (sort options and value),
+    dict (label id -> trace indices), int (labeling version shown), list (the window of samples in view),
+    dict (the window state), str (error message)
+       The figure will be displayed and the 'samples' dropdown options will get re-sorted if necessary
+       (and truncated to the first utils.MAX_SAMPLE_OPTIONS samples in the new order).
        Or a modal window displaying the error message will appear.
 
     Notes
     -----
     If your bar labels (x-axis values, e.g. for 'Patient ID' or 'Sample') require a custom sort order,
-    you will need to add code to this function to handle it. Coding hints are included below.
+    you will need to add code to utils.sort_bar_plot_data() to handle it. Coding hints are included there.
     """
     num_outputs = len(ctx.outputs_list)
     no_updates = [no_update]*num_outputs
-    if not df_as_dict:
+    if not dataset_key:
+        return tuple(no_updates)
+    if ctx.triggered_id == 'label-index-version' and barplot_label_version == (label_index_version or 0):
+        return tuple(no_updates) # the label action already brought the bar plot up to date
+    x_range = None # of the windowed bar plot, when set by a pan or zoom
+    if ctx.triggered_id == 'barplot-graph-id':
+        if barplot_mode != utils.BARPLOT_WINDOW or not window_state:
+            return tuple(no_updates)
+        x_range = _relayout_x_range(relayout_data, window_state['loaded'])
+        if x_range is None:
+            return tuple(no_updates) # e.g. a zoom of the y-axis only
+        window = [math.ceil(x_range[0]), math.floor(x_range[1])]
+        first, last = _clamp_window(window, len(label_map))
+        loaded_first, loaded_last = window_state['loaded']
+        if loaded_first <= first and last <= loaded_last:
+            # The bars in view have already been sent; just keep the slider in step.
+            no_updates[-3] = [first, last]
+            no_updates[-2] = {'shown':[first, last], 'loaded':window_state['loaded']}
+            return tuple(no_updates)
+    # Supersede any render of the bar plot still running for this session.
+    ticket = render_scheduler.begin(session_id, 'bar plot')
+    try:
+        _, df_in = _study_tables(dataset_key)
+    except ValueError as e:
+        no_updates[-1] = str(e)
         return tuple(no_updates)
     for required_column in ['prop value', 'prop name']:
-        if required_column not in df_as_dict[0]:
+        if required_column not in df_in.columns:
             err_msg = f"Cannot make the bar plot; required column {required_column} was not found."
             no_updates[-1] = err_msg
             return tuple(no_updates)
+    window_retvals = (no_update, no_update)
     if ctx.triggered_id == 'render-barplot-button' and n_clicks > 0:
         # Presumably the facets have changed?
         if sorting_key not in props_to_plot:
             sorting_key = props_to_plot[0]
-    df_in = pd.DataFrame.from_dict(df_as_dict)
     non_prop_columns = list(set(df_in.columns.to_list()) - set(['prop name', 'prop value']))
     if len(non_prop_columns) != 1:
         err_msg = f"Found 0 or multiple non-'property' columns in 'metrics' {non_prop_columns}. Expected 1."
@@ -951,10 +1204,8 @@ def update_barplot(n_clicks : int, color_map : dict, list_of_labels : list,
         no_updates[-1] = err_msg
         return tuple(no_updates)
     # At least for now, drop any row with a NaN.
-    df_facets = df_in[[True if prop in props_to_plot \
-                       else False for prop in df_in['prop name']]].dropna(how='any',
-                                                                          ignore_index=True,
-                                                                          axis=0)
+    with instrumentation.phase('filter'):
+        df_facets = df_in[df_in['prop name'].isin(props_to_plot)].dropna(how='any', ignore_index=True, axis=0)
     if len(df_facets)==0:
         err_msg = "Missing data was found for the selected properties.\n"
         err_msg += "Select different properties and click the 'plot' button."
@@ -965,38 +1216,10 @@ def update_barplot(n_clicks : int, color_map : dict, list_of_labels : list,
         no_updates[-1] = err_msg
         return tuple(no_updates)
     ascending = bool(sorting_direction)
-    if x_column == sorting_key:
-        # Coding hint: If your x_column values require a sort order different from
-        # standard string sort order, add code here to implement that.
-        # Hint: If your x_column values have different parts ('part1_part2', 'p1-p2-p3', etc.),
-        # you can add columns to a copy of df_facets, sort on those, and then drop those columns.
-        # E.g.:
-        # df_final = df_facets.copy()
-        # df_final['p1'] = list of 'part1' substrings from your x_column values
-        # df_final['p2'] = ditto for 'part2' substrings
-        # df_final = df_final.sort_values(by=['p1','p2'],
-        #                                 ascending=[ascending,ascending]).drop(['p1','p2'],
-        #                                                                       axis=1).reset_index(drop=True)
-        # It might be best to use an if/else block:
-        # if fancy_sort_needed: fancy_sort else: standard_sort
-        df_final = df_facets.sort_values(by=[x_column], ascending=[ascending])
-        props = df_final['prop name'].unique().tolist()
-    else:
-        props = df_facets['prop name'].unique().tolist() # returned in the order in which they appear at the moment
-        props[props.index(sorting_key)] = props[0]
-        props[0] = sorting_key
-        this_sort_order = dict(zip(props, range(len(props))))
-        df_prelim = df_facets.sort_values(by=['prop value'], ascending=[ascending])
-        # Critically important: Must choose a final 'kind' of sorting that's stable, i.e. that preserves the prelim sort.
-        # According to the pandas docs, the two stable options are 'stable' and 'mergesort'.
-        df_final = df_prelim.sort_values(by=['prop name'], key=lambda z : z.map(this_sort_order), kind='stable')
-    # Currently there's no code in the following call that explicitly raises an exception. But try/except doesn't hurt.
-    try:
-        fig = utils.make_custom_multifaceted_bar_plot(df_final, props, color_map,
-                                                      list_of_labels, x_column, hide_x_ticks)
-    except Exception as e:
-        err_msg = f"Unable to render the bar plot. {e}"
-        no_updates[-1] = err_msg
+    with instrumentation.phase('aggregate'): # i.e. sort
+        df_final, props = _get_or_sort_bar_plot_data(df_facets, x_column, props_to_plot, sorting_key, ascending,
+                                                      dataset_key)
+    if render_scheduler.is_superseded(ticket):
         return tuple(no_updates)
     # Get the x_column values  in the order in which they have now been sorted.
     # Note: When sorting_key is a property name and len(props_to_plot)>1, samples/parents for which that property is absent
@@ -1005,37 +1228,141 @@ def update_barplot(n_clicks : int, color_map : dict, list_of_labels : list,
     sorted_parents = list(dict.fromkeys(df_final[x_column].tolist())) # order is preserved in the keys of a dict for python 3.7+
     # If sorting_key is a property name, samples/parents for which all of props_to_plot are absent
     # will be absent from this list. In this case, we append them here:
-    if len(sorted_parents) != len(labeled_samples):
-        sorted_parents += list(set(df_final[x_column].unique().tolist()) - set(sorted_parents))
-    # Now put the entries in the labeled samples dropdown (one per parent) into this order for ease of use:
-    for i in range(len(sorted_parents)):
-        labeled_samples[i]['value'] = sorted_parents[i]
-        labeled_samples[i]['label']['props']['children'][1]['props']['children'] = sorted_parents[i]
-        labeled_samples[i]['search'] = sorted_parents[i].split('-')[-1]
-        labeled_samples[i]['label']['props']['children'][0]['props']['style']['color'] = color_map[sorted_parents[i]]
+    if len(sorted_parents) != len(label_map):
+        sorted_parents += sorted(set(label_map) - set(sorted_parents))
+    # Currently there's no code in the following calls that explicitly raises an exception. But try/except doesn't hurt.
+    try:
+        with instrumentation.phase('figure build'):
+            resolved_label_map = {sample : labels.resolve_label_id(label_id, default_label)
+                                  for sample, label_id in label_map.items()}
+            if barplot_mode == utils.BARPLOT_HISTOGRAM:
+                # High values first when sorted by a property in descending order, as in the bars per sample.
+                fig = utils.make_binned_bar_plot(df_final, props, resolved_label_map, label_table, x_column,
+                                                 reverse_x=(sorting_key != x_column and not ascending))
+            elif barplot_mode == utils.BARPLOT_WINDOW:
+                first, last = _clamp_window(window, len(sorted_parents))
+                # Send the samples in view and a margin on each side, so that short pans need no new figure.
+                margin = int((last - first + 1)*utils.BAR_WINDOW_MARGIN)
+                loaded = [max(first - margin, 0), min(last + margin, len(sorted_parents) - 1)]
+                sample_positions = {sample : loaded[0] + i
+                                    for i, sample in enumerate(sorted_parents[loaded[0]:loaded[1] + 1])}
+                fig = utils.make_custom_multifaceted_bar_plot(df_final[df_final[x_column].isin(sample_positions)],
+                                                              props, resolved_label_map, label_table, x_column,
+                                                              hide_x_ticks, sample_positions)
+                # Keep the view where the user panned or zoomed to, unless it was too wide (see _clamp_window()).
+                view = [first - 0.5, last + 0.5]
+                if x_range is not None and x_range[1] - x_range[0] <= utils.BAR_WINDOW_MAX_SIZE:
+                    view = list(x_range)
+                fig.update_xaxes(range=view)
+                fig.update_layout(dragmode='pan')
+                window_retvals = ([first, last], {'shown':[first, last], 'loaded':loaded})
+            else:
+                fig = utils.make_custom_multifaceted_bar_plot(df_final, props, resolved_label_map,
+                                                              label_table, x_column, hide_x_ticks)
+    except Exception as e:
+        err_msg = f"Unable to render the bar plot. {e}"
+        no_updates[-1] = err_msg
+        return tuple(no_updates)
+    if render_scheduler.is_superseded(ticket):
+        return tuple(no_updates)
+    with instrumentation.phase('styling'):
+        # Now put the entries in the labeled samples dropdown (one per parent) into this order for ease of use:
+        labeled_samples = [layout.make_labeled_option(sample,
+                                                      labels.label_color(resolved_label_map[sample], label_table))
+                           for sample in sorted_parents[:utils.MAX_SAMPLE_OPTIONS]]
+        # Record which traces draw which label, so that label edits can patch the figure in place.
+        trace_map = {}
+        for i, trace in enumerate(fig.data):
+            trace_map.setdefault(trace.legendgroup, []).append(i)
+        fig = payloads.compact_figure(fig)
     sortorder_retvals = (no_update, no_update)
     if ctx.triggered_id == 'render-barplot-button' and n_clicks > 0:
         # Ensure the sort options match the current set of facets.
         sort_options = [x_column, *df_final['prop name'].unique().tolist()]
         sort_options = [{'label':' '+opt, 'value':opt} for opt in sort_options]
         sortorder_retvals = (sort_options, sorting_key)
-    return fig, labeled_samples, *sortorder_retvals, no_update
+    return fig, labeled_samples, *sortorder_retvals, trace_map, label_index_version or 0, *window_retvals, no_update
 
 
-@callback(Output('lineplot-slider-div', 'hidden'),
-          Input('lineplot-replicates-radioitems', 'value'))
-def hide_lineplot_slider_div(radioitem_value : int):
+def _clamp_window(window : list, num_samples : int):
     """
-    The user can show all replicates or condense them into mean ± SD.
-    In the latter case, a slider provides additional control over the display.
-    This slider should be displayed in the latter case and hidden otherwise.
-    This callback manages this display.
+    Return the first and last positions of the window of samples shown in the windowed bar plot,
+    within the range of positions 0, ..., num_samples-1, and at most utils.BAR_WINDOW_MAX_SIZE samples wide
+    (a wider window is narrowed around its center).
     """
-    if radioitem_value is None:
-        return no_update
-    if radioitem_value != 2:
-        return True
-    return False
+    first, last = window if window else (0, utils.BAR_WINDOW_SIZE - 1)
+    first, last = int(first), int(last)
+    if last - first + 1 > utils.BAR_WINDOW_MAX_SIZE:
+        first = (first + last + 1)//2 - utils.BAR_WINDOW_MAX_SIZE//2
+        last = first + utils.BAR_WINDOW_MAX_SIZE - 1
+    last = min(max(last, 0), max(num_samples - 1, 0))
+    first = min(max(first, 0), last)
+    return first, last
+
+
+def _relayout_x_range(relayout_data : dict, loaded : list):
+    """
+    Return the x-axis range (low, high) set by a pan or zoom of the bar plot (relayoutData), or None if it didn't
+    change the x-axes. Autoscaling (e.g. a double click) shows the bars that were sent, at positions `loaded`.
+    The facets share their x-axis, so any of 'xaxis', 'xaxis2', ... will do.
+    """
+    for key, value in (relayout_data or {}).items():
+        axis, _, attribute = key.partition('.')
+        if not re.fullmatch(r'xaxis\d*', axis):
+            continue
+        if attribute == 'autorange' and value:
+            return loaded[0] - 0.5, loaded[1] + 0.5
+        if attribute == 'range' and isinstance(value, list) and len(value) == 2:
+            return float(min(value)), float(max(value))
+        if attribute == 'range[0]':
+            low, high = value, relayout_data.get(f'{axis}.range[1]')
+            if high is not None:
+                return float(min(low, high)), float(max(low, high))
+    return None
+
+
+def _get_or_sort_bar_plot_data(df_facets : pd.DataFrame, x_column : str, props_to_plot : list, sorting_key : str,
+                               ascending : bool, dataset_key : str):
+    """
+    Return utils.sort_bar_plot_data(df_facets, x_column, sorting_key, ascending), from the cache of sort orders
+    (see figure_cache.py) or sorted and cached. df_facets is the metrics data restricted to props_to_plot, without NaNs.
+    """
+    sort_key = figure_cache.make_sort_key(dataset_key, props_to_plot, sorting_key, ascending)
+    cached = figure_cache.get_sort_order(sort_key)
+    if cached is not None:
+        return cached
+    return figure_cache.put_sort_order(sort_key, *utils.sort_bar_plot_data(df_facets, x_column, sorting_key, ascending))
+
+
+# The slider that chooses the window of samples is only shown in the windowed view of the bar plot.
+clientside_callback(
+    """
+    function(mode) {
+        if (mode === null || mode === undefined) {
+            return window.dash_clientside.no_update;
+        }
+        return mode !== BARPLOT_WINDOW;
+    }
+    """.replace('BARPLOT_WINDOW', str(utils.BARPLOT_WINDOW)),
+    Output('barplot-window-div', 'hidden'),
+    Input('barplot-mode-radioitems', 'value'))
+
+
+# The user can show all replicates or condense them into mean ± SD.
+# In the latter case, a slider provides additional control over the display.
+# This slider should be displayed in the latter case and hidden otherwise.
+# This callback manages this display.
+clientside_callback(
+    """
+    function(radioitem_value) {
+        if (radioitem_value === null || radioitem_value === undefined) {
+            return window.dash_clientside.no_update;
+        }
+        return radioitem_value !== LINEPLOT_MEAN_SD;
+    }
+    """.replace('LINEPLOT_MEAN_SD', str(utils.LINEPLOT_MEAN_SD)),
+    Output('lineplot-slider-div', 'hidden'),
+    Input('lineplot-replicates-radioitems', 'value'))
 
 
 @callback(Output('color-picker', 'is_open', allow_duplicate=True),
@@ -1050,6 +1377,8 @@ def on_lineplot_trace_click(click_data):
     """
     if not click_data:
         return no_update, no_update
+    if 'z' in click_data['points'][0]:
+        return no_update, no_update # a cell of a density heatmap, which has no color of its own
     return True, utils.div_display['line plot']
 
 
@@ -1104,9 +1433,8 @@ def apply_trace_color_choice_to_lineplot(trace_style : dict, click_data : dict,
     if not click_data or not trace_style or not fig:
         return no_update, no_update, no_update
     sample_string = 'Patient ID' # BUGBUG: Hardcoded for demo. Could be 'sample', 'Sample ID', ...
-    one_trace_per_group = False
-    if 2 == radioitem_value: # hacky... declare a list of values in utils?
-        one_trace_per_group = True
+    # The mean ± SD view and the overlays of the density view have one trace per group.
+    one_trace_per_group = radioitem_value in [utils.LINEPLOT_MEAN_SD, utils.LINEPLOT_DENSITY]
     # https://community.plotly.com/t/referencing-updating-trace-by-curve-number/57450/2
     curve_number = click_data['points'][0]['curveNumber']
     # Extract the properties of the clicked trace (group, facet, sample_id) from its 'hovertemplate'.
@@ -1151,6 +1479,8 @@ def apply_trace_color_choice_to_lineplot(trace_style : dict, click_data : dict,
         else:
             # Update one trace per facet and all facets for this entry in the map.
             for c in range(len(fig['data'])):
+                if not utils.is_styled_trace(fig['data'][c]):
+                    continue # a density heatmap
                 hov_str = fig['data'][c]['hovertemplate']
                 curve_data = {}
                 for entry in hov_str.split('<br>'):
@@ -1170,6 +1500,8 @@ def apply_trace_color_choice_to_lineplot(trace_style : dict, click_data : dict,
     else:
         # Update all replicates for this group.
         for c in range(len(fig['data'])):
+            if not utils.is_styled_trace(fig['data'][c]):
+                continue # a density heatmap
             hov_str = fig['data'][c]['hovertemplate']
             curve_data = {}
             for entry in hov_str.split('<br>'):
@@ -1199,18 +1531,28 @@ def apply_trace_color_choice_to_lineplot(trace_style : dict, click_data : dict,
 @callback(Output('lineplot-div', 'hidden', allow_duplicate=True), # allow... may no longer be needed here
           Output('lineplot-graph-id', 'figure', allow_duplicate=True),
           Output('lineplot-style-map', 'data', allow_duplicate=True),
+          Output('lineplot-graph-div', 'hidden'),
+          Output('lineplot-facets-div', 'hidden'),
+          Output('lineplot-facets-div', 'children'),
+          Output('lineplot-visible-facets', 'data'),
+          Output('lineplot-facet-view', 'data'),
           Output('err-msg', 'children', allow_duplicate=True),
           Input('render-lineplot-button', 'n_clicks'),
           Input('lineplot-replicates-radioitems', 'value'),
           Input('lineplot-slider', 'value'),
-          State('lineplot-df-melted-dict', 'data'),
+          Input('lineplot-perFacet-checkbox', 'value'),
+          Input('lineplot-dayrange-slider', 'value'),
           State('lineplot-style-map', 'data'),
           State('lineplot-facetVars-checklist', 'value'),
           State('lineplot-groupBy-dropdown', 'value'),
+          State('lineplot-groupBy-dropdown', 'options'),
+          State('dataset-key', 'data'),
+          State('session-id', 'data'),
           prevent_initial_call='initial_duplicate')
-def update_line_plot(n_clicks : int, radioitem_value : int, slider_value : float,
-                     df_as_dict : list, style_map : dict,
-                     props_to_plot : list, group : str):
+def update_line_plot(n_clicks : int, radioitem_value : int, slider_value : float, per_facet : bool,
+                     day_range : list, style_map : dict,
+                     props_to_plot : list, group : str, groupBy_options : list, dataset_key : str,
+                     session_id : str):
     """
     Make or update the line plot. Builds the "lineplot style map" if it doesn't yet exist.
 
@@ -1219,26 +1561,41 @@ def update_line_plot(n_clicks : int, radioitem_value : int, slider_value : float
     n_clicks : int
        The number of times the render-lineplot-button button has been clicked.
     radioitem_value : int
-       The summary statistic (or none) chosen by the user. 1==show all replicates.
+       The summary statistic (or none) chosen by the user: utils.LINEPLOT_REPLICATES (show all replicates),
+       utils.LINEPLOT_MEAN_SD, or utils.LINEPLOT_DENSITY (see utils.make_density_line_plot()).
     slider_value : float
        The small increment by which points should be spread out horizontally,
        e.g. from four points at Day=2 to points at 1.97, 1.99, 2.01, 2.03.
-    df_as_dict : list of dict
-       The input DataFrame rendered as a list of records via to_dict().
+    per_facet : bool
+       Whether to show each facet as its own graph in a scrolling container (see render_visible_facets())
+       instead of all facets in one figure.
+    day_range : list of float
+       The first and last days to show. Only the rows within this range are plotted and aggregated;
+       they're found with the data set's day index (see _restrict_to_days()).
     style_map : dict
        A map to keep track of color edits made via the user clicking on curves in the plot.
     props_to_plot : list of str
-       The properties in the 'prop name' column of the DataFrame in df_as_dict
+       The properties in the 'prop name' column of the data set's melted timeseries
        to be included in the plot (one facet per property).
     group : str
        The property by which the samples should be grouped (colored, aggregated).
        A common value for this is 'Molecule':  "plot all replicates of molecule M-123
        in green;" "for each molecule, show only the mean ± SD over replicates."
+    groupBy_options : list of str
+       All of the properties by which the samples can be grouped.
+    dataset_key : str
+       The key of this data set in the server-side registry (see datasets.py), from which its melted timeseries
+       are read (see _study_tables()), and where the statistics cube for mean ± SD is kept (see stats_cube.py).
+    session_id : str
+       The browser session's id. A render is dropped as soon as a newer one starts for the same session
+       (see render_scheduler.py).
 
     Returns
     -------
-    bool, figure, dict, str, str
-       "hidden", line plot, style map, "group by" property, error message,
+    bool, figure, dict, bool, bool, list, list, dict, str
+       "hidden", line plot, style map, "hidden" for the single-figure Div, "hidden" for the per-facet Div,
+       the per-facet Div's children (one empty graph per facet), the facets drawn so far in the per-facet view,
+       the per-facet view's settings, error message,
        where "hidden" is the "hidden" attribute of the enclosing Div (i.e., False = "un-hide this Div")
     """
     num_outputs = len(ctx.outputs_list)
@@ -1247,13 +1604,18 @@ def update_line_plot(n_clicks : int, radioitem_value : int, slider_value : float
         # This callback needn't be triggered by a click on the render-lineplot-button,
         # but that button needs to have been clicked at least once before we can render the plot.
         return tuple(no_updates)
-    if not df_as_dict:
+    if not dataset_key:
+        return tuple(no_updates)
+    # Supersede any render of the line plot still running for this session.
+    ticket = render_scheduler.begin(session_id, 'line plot')
+    display_meanSD = utils.LINEPLOT_MEAN_SD == radioitem_value
+    display_density = utils.LINEPLOT_DENSITY == radioitem_value
+    one_trace_per_group = display_meanSD or display_density # the density view's overlays are mean ± SD
+    try:
+        df_in, _ = _study_tables(dataset_key)
+    except ValueError as e:
+        no_updates[-1] = str(e)
         return tuple(no_updates)
-    display_meanSD = False
-    if 2 == radioitem_value: # hacky... declare a list of values in utils?
-        display_meanSD = True
-    one_trace_per_group = display_meanSD
-    df_in = pd.DataFrame.from_dict(df_as_dict)
     if not props_to_plot:
         err_msg = "No properties were selected for the y-axes.\n"
         err_msg += "Select one or more properties and click the 'plot' button."
@@ -1265,72 +1627,614 @@ def update_line_plot(n_clicks : int, radioitem_value : int, slider_value : float
         err_msg += "The available options are in the dropdown menu next to this button."
         no_updates[-1] = err_msg
         return tuple(no_updates)
+    sample_string = df_in.columns[0]
+    day_string = 'Day'
+    for col_name in df_in.columns:
+        if col_name.lower() == 'day':
+            day_string = col_name # use the column title's actual capitalization
+            break
     # At least for now, drop any row with a NaN 'prop value' for a target 'prop name'.
-    df_facets = df_in[[True if prop in props_to_plot \
-                       else False for prop in df_in['prop name']]]
-    df_facets = df_facets[[not pd.isna(x) for x in df_facets['prop value']]].reset_index(drop=True)
+    with instrumentation.phase('filter'):
+        df_window, day_range = _restrict_to_days(df_in, day_string, day_range, dataset_key)
+        df_facets = df_window[df_window['prop name'].isin(props_to_plot)]
+        df_facets = df_facets[df_facets['prop value'].notna()].reset_index(drop=True)
     if len(df_facets)==0:
-        err_msg = "All data is missing (NaN) for the selected properties.\n"
+        err_msg = "All data is missing (NaN) for the selected properties"
+        err_msg += " and days.\n" if day_range is not None else ".\n"
         err_msg += "Select different properties and click the 'plot' button."
         no_updates[-1] = err_msg
         return tuple(no_updates)
+
+    if per_facet:
+        # Lay out an empty graph per facet, in the order of the single figure's facets.
+        # Each is drawn by render_visible_facets() once it scrolls into view,
+        # so the time to the first plot doesn't depend on the number of facets.
+        slots = [layout.make_facet_graph_slot(facet) for facet in pd.unique(df_facets['prop name'])]
+        view = {'group':group, 'mode':radioitem_value, 'spread':slider_value, 'days':day_range}
+        return False, no_update, no_update, True, False, slots, [], view, no_update
+
+    # The base figure (before the style map is applied) may already be cached from an earlier view
+    # (or from the warm-up after loading; see _warm_up_tasks()).
+    fig = _get_or_build_line_plot(df_in, df_facets, props_to_plot, group, display_meanSD, slider_value,
+                                  groupBy_options, dataset_key, day_string, ticket, display_density, day_range)
+    if fig is None or render_scheduler.is_superseded(ticket):
+        return tuple(no_updates)
+
+    # Update (or build) the style map if necessary.
+    with instrumentation.phase('styling'):
+        if style_map is None:
+            style_map = {}
+        updated_style_map = False
+        add_group_to_style_map = True
+        samples_string = 'Sample IDs' # not to be confused with sample_string, which could be 'sample', 'Patient ID', etc.
+        # First, make the facets in the style map match the user's current choices for the facets.
+        # Then, if the current grouping isn't in the map, add it.
+        if samples_string in style_map: # otherwise it's empty
+            updated_style_map = _match_style_map_facets(style_map, props_to_plot, samples_string)
+            if group in style_map:
+                add_group_to_style_map = False
+        if add_group_to_style_map:
+            style_map = utils.add_group_to_style_map(group, style_map, fig, df_facets,
+                                                     sample_string, one_trace_per_group, samples_string)
+            updated_style_map = True
+
+        # Now use the style map.
+        utils.apply_style_map_to_line_plot(fig, style_map, group, sample_string, one_trace_per_group, samples_string)
+    # "False" below means "un-hide the Div enclosing this plot and its controls."
+    # Any per-facet graphs are dropped.
+    return False, fig, style_map if updated_style_map else no_update, False, True, [], no_update, no_update, no_update
+
+
+def _get_or_build_line_plot(df_in : pd.DataFrame, df_facets : pd.DataFrame, props_to_plot : list, group : str,
+                            display_meanSD : bool, slider_value : float, groupBy_options : list,
+                            dataset_key : str, day_string : str, ticket : dict=None, display_density : bool=False,
+                            day_range : tuple=None):
+    """
+    Return the base line plot (before the style map is applied) in dict form, from the figure cache
+    or built and cached. Returns None if the render holding `ticket` was superseded while building it.
+    df_facets is df_in restricted to props_to_plot (and to day_range, (low, high), if given), without NaN values.
+    If display_density is True, it's the density view (see utils.make_density_line_plot()); display_meanSD is ignored.
+    """
+    variant = ('density',) if display_density else ()
+    if day_range is not None:
+        variant = (*variant, 'days', *day_range)
+    fig_key = figure_cache.make_key(dataset_key, props_to_plot, group, display_meanSD and not display_density,
+                                    slider_value, variant=variant)
+    fig = figure_cache.get(fig_key)
+    if fig is not None:
+        return fig
+    df_summary = None
+    if display_meanSD or display_density:
+        # Mean ± SD come from the statistics cube, which is built once per data set
+        # (in load_fake_demo_data(), or here if this server process doesn't have it yet).
+        with instrumentation.phase('aggregate'):
+            cube = datasets.get_or_build(dataset_key, 'stats cube',
+                                         lambda: stats_cube.build_stats_cube(df_in, groupBy_options, day_string))
+            df_summary = stats_cube.summarize(cube, group, props_to_plot, day_range)
+        if ticket is not None and render_scheduler.is_superseded(ticket):
+            return None
+    with instrumentation.phase('figure build'):
+        if display_density:
+            fig = utils.make_density_line_plot(df_facets, x_column=day_string, line_group=df_in.columns[0],
+                                               agg_group=group, df_summary=df_summary)
+        else:
+            fig = utils.make_custom_multifaceted_line_plot(df_facets, x_column=day_string,
+                                                           line_group=df_in.columns[0], agg_group=group,
+                                                           display_meanSD=display_meanSD, dt=slider_value,
+                                                           df_summary=df_summary)
+        return figure_cache.put(fig_key, payloads.compact_figure(fig))
+
+
+def _match_style_map_facets(style_map : dict, props_to_plot : list, samples_string : str='Sample IDs'):
+    """
+    Add the facets being plotted to the (non-empty) style map, and remove those no longer plotted.
+    Returns True if the style map changed.
+    """
+    updated_style_map = False
+    facets_in_style_map = set()
+    for sample in style_map[samples_string]:
+        for group_ in style_map[samples_string][sample]['facets']:
+            for facet in style_map[samples_string][sample]['facets'][group_]:
+                facets_in_style_map.add(facet)
+    for facet in props_to_plot:
+        if facet not in facets_in_style_map:
+            utils.add_facet_to_style_map(style_map, facet, samples_string)
+            updated_style_map = True
+    for facet in facets_in_style_map:
+        if facet not in props_to_plot:
+            utils.remove_facet_from_style_map(style_map, facet, samples_string)
+            updated_style_map = True
+    return updated_style_map
+
+
+@callback(Output({'type':'lineplot-facet-graph', 'index':ALL}, 'figure'),
+          Output({'type':'lineplot-facet-graph', 'index':ALL}, 'className'),
+          Output('lineplot-style-map', 'data', allow_duplicate=True),
+          Output('err-msg', 'children', allow_duplicate=True),
+          Input('lineplot-visible-facets', 'data'),
+          State({'type':'lineplot-facet-graph', 'index':ALL}, 'className'),
+          State('lineplot-facet-view', 'data'),
+          State('lineplot-style-map', 'data'),
+          State('lineplot-groupBy-dropdown', 'options'),
+          State('dataset-key', 'data'),
+          prevent_initial_call=True)
+def render_visible_facets(visible_facets : list, class_names : list, view : dict,
+                          style_map : dict, groupBy_options : list, dataset_key : str):
+    """
+    Draw the graphs of the per-facet view of the line plot (see update_line_plot()) that have
+    scrolled into view and haven't been drawn yet.
+
+    Parameters
+    ----------
+    visible_facets : list of str
+       The facets that have scrolled into view since the per-facet view was laid out;
+       set by the clientside callback below.
+    class_names : list of str
+       The className of each facet's graph; layout.FACET_GRAPH_PENDING if it hasn't been drawn yet.
+    view : dict
+       The settings the per-facet view was laid out with: 'group', 'mode' (the radio item value), 'spread' (the slider value),
+       and 'days' (the range of days shown, or None for all of them).
+    style_map : dict
+       The line plot style map (see utils.add_group_to_style_map()).
+    groupBy_options : list of str
+       All of the properties by which the samples can be grouped.
+    dataset_key : str
+       The key of this data set in the server-side registry (see datasets.py),
+       from which its melted timeseries are read (see _study_tables()).
+
+    Returns
+    -------
+    list, list, dict, str
+       The figure and className of each facet's graph (no_update for those not drawn now),
+       style map, error message
+    """
+    facets = [output['id']['index'] for output in ctx.outputs_list[0]]
+    figures = [no_update]*len(facets)
+    new_class_names = [no_update]*len(facets)
+    to_draw = [i for i, facet in enumerate(facets)
+               if facet in (visible_facets or []) and class_names[i] == layout.FACET_GRAPH_PENDING]
+    if not to_draw or not dataset_key or not view:
+        return figures, new_class_names, no_update, no_update
+    try:
+        df_in, _ = _study_tables(dataset_key)
+    except ValueError as e:
+        return figures, new_class_names, no_update, str(e)
+    group = view['group']
+    display_meanSD = utils.LINEPLOT_MEAN_SD == view['mode']
+    display_density = utils.LINEPLOT_DENSITY == view['mode']
+    one_trace_per_group = display_meanSD or display_density
+    slider_value = view['spread']
     sample_string = df_in.columns[0]
     day_string = 'Day'
     for col_name in df_in.columns:
         if col_name.lower() == 'day':
             day_string = col_name # use the column title's actual capitalization
             break
-
-    fig = utils.make_custom_multifaceted_line_plot(df_facets, x_column=day_string,
-                                                   line_group=sample_string, agg_group=group,
-                                                   display_meanSD=display_meanSD, dt=slider_value)
-
-    # Update (or build) the style map if necessary.
-    if style_map is None:
-        style_map = {}
+    with instrumentation.phase('filter'):
+        df_window, day_range = _restrict_to_days(df_in, day_string, view.get('days'), dataset_key)
+        df_facets = df_window[df_window['prop name'].isin(facets)]
+        df_facets = df_facets[df_facets['prop value'].notna()].reset_index(drop=True)
+    df_summary = None
+    if one_trace_per_group:
+        with instrumentation.phase('aggregate'):
+            cube = datasets.get_or_build(dataset_key, 'stats cube',
+                                         lambda: stats_cube.build_stats_cube(df_in, groupBy_options, day_string))
+            df_summary = stats_cube.summarize(cube, group, facets, day_range)
+    # Colors are assigned to the groups in the order in which they appear among all the facets,
+    # so each group has the same color in every facet (and as in the single figure).
+    group_order = pd.unique((df_summary if one_trace_per_group else df_facets)[group]).tolist()
+
+    style_map = style_map or {}
     updated_style_map = False
-    add_group_to_style_map = True
-    samples_string = 'Sample IDs' # not to be confused with sample_string, which could be 'sample', 'Patient ID', etc.
-    # First, make the facets in the style map match the user's current choices for the facets.
-    # Then, if the current grouping isn't in the map, add it.
-    if samples_string in style_map: # otherwise it's empty
-        facets_in_style_map = set()
-        for sample in style_map[samples_string]:
-            for group_ in style_map[samples_string][sample]['facets']: # 'group_' so we don't overwrite 'group'
-                for facet in style_map[samples_string][sample]['facets'][group_]:
-                    facets_in_style_map.add(facet)
-        for facet in props_to_plot:
-            if facet not in facets_in_style_map:
-                utils.add_facet_to_style_map(style_map, facet, samples_string)
-                updated_style_map = True
-        for facet in facets_in_style_map:
-            if facet not in props_to_plot:
-                utils.remove_facet_from_style_map(style_map, facet, samples_string)
+    samples_string = 'Sample IDs'
+    if samples_string in style_map:
+        updated_style_map = _match_style_map_facets(style_map, facets, samples_string)
+    for i in to_draw:
+        facet = facets[i]
+        df_facet = df_facets[df_facets['prop name'] == facet].reset_index(drop=True)
+        fig_key = figure_cache.make_key(dataset_key, [facet], group, display_meanSD, slider_value,
+                                        variant=('per facet', tuple(group_order), *(['density'] if display_density else []),
+                                                 *(['days', *day_range] if day_range is not None else [])))
+        fig = figure_cache.get(fig_key)
+        if fig is None:
+            with instrumentation.phase('figure build'):
+                facet_summary = None
+                if one_trace_per_group:
+                    facet_summary = df_summary[df_summary['prop name'] == facet].reset_index(drop=True)
+                if display_density:
+                    fig = utils.make_density_line_plot(df_facet, x_column=day_string, line_group=sample_string,
+                                                       agg_group=group, df_summary=facet_summary,
+                                                       group_order=group_order)
+                else:
+                    fig = utils.make_custom_multifaceted_line_plot(df_facet, x_column=day_string,
+                                                                   line_group=sample_string, agg_group=group,
+                                                                   display_meanSD=display_meanSD, dt=slider_value,
+                                                                   df_summary=facet_summary, group_order=group_order)
+                fig.update_layout(height=layout.FACET_GRAPH_HEIGHT)
+                fig = figure_cache.put(fig_key, payloads.compact_figure(fig))
+        with instrumentation.phase('styling'):
+            try:
+                utils.apply_style_map_to_line_plot(fig, style_map, group, sample_string, one_trace_per_group,
+                                                   samples_string)
+            except KeyError:
+                # The style map doesn't cover this grouping (or some of this facet's samples) yet;
+                # add them with the figure's colors.
+                style_map = utils.add_group_to_style_map(group, style_map, fig, df_facet,
+                                                         sample_string, one_trace_per_group, samples_string)
+                utils.apply_style_map_to_line_plot(fig, style_map, group, sample_string, one_trace_per_group,
+                                                   samples_string)
                 updated_style_map = True
-        if group in style_map:
-            add_group_to_style_map = False
-    if add_group_to_style_map:
-        style_map = utils.add_group_to_style_map(group, style_map, fig, df_facets,
-                                                 sample_string, one_trace_per_group, samples_string)
-        updated_style_map = True
-
-    # Now use the style map.
-    for curve_number in range(len(fig['data'])):
-        hov_str = fig['data'][curve_number]['hovertemplate']
-        curve_data = {}
-        for entry in hov_str.split('<br>'):
-            key, value = entry.split('=')
-            curve_data[key] = value
-        group_value = curve_data[group] # e.g., group='Treatment', group_value='Placebo'
-        facet = curve_data['prop name']
-        if one_trace_per_group:
-            fig['data'][curve_number]['line'] = style_map[group][group_value]['facets'][facet]
-        else:
-            sample_id = curve_data[sample_string] # sample_string is 'sample', 'Sample ID', etc.
-            fig['data'][curve_number]['line'] = style_map[samples_string][sample_id]['facets'][group][facet]
-    # "False" below means "un-hide the Div enclosing this plot and its controls."
-    if updated_style_map:
-        return False, fig, style_map, no_update
-    return False, fig, no_update, no_update
+        figures[i] = fig
+        new_class_names[i] = ''
+    return figures, new_class_names, style_map if updated_style_map else no_update, no_update
+
+
+# Report the facets of the per-facet view that scroll into view (or come within 200 pixels of it),
+# so that render_visible_facets() draws them. Each facet is reported once per layout.
+clientside_callback(
+    """
+    function(children) {
+        if (window.lineplotFacetObserver) {
+            window.lineplotFacetObserver.disconnect();
+            window.lineplotFacetObserver = null;
+        }
+        if (!children || !children.length) {
+            return window.dash_clientside.no_update;
+        }
+        // Wait for the new graphs to be in the page.
+        setTimeout(function() {
+            const container = document.getElementById('lineplot-facets-div');
+            if (!container) {
+                return;
+            }
+            const visible = [];
+            const observer = new IntersectionObserver(function(entries) {
+                let changed = false;
+                entries.forEach(function(entry) {
+                    if (entry.isIntersecting) {
+                        visible.push(entry.target.dataset.facet);
+                        observer.unobserve(entry.target);
+                        changed = true;
+                    }
+                });
+                if (changed) {
+                    window.dash_clientside.set_props('lineplot-visible-facets', {data: visible.slice()});
+                }
+            }, {root: container, rootMargin: '200px 0px'});
+            container.querySelectorAll('.lineplot-facet-slot').forEach(function(slot) {
+                observer.observe(slot);
+            });
+            window.lineplotFacetObserver = observer;
+        }, 0);
+        return window.dash_clientside.no_update;
+    }
+    """,
+    Input('lineplot-facets-div', 'children'),
+    prevent_initial_call=True)
 #
 #---------------End 'interactive plotting options' callbacks-----------------------
+
+#-------------------Begin 'export' callbacks---------------------------------------
+#
+@callback(Output('export-download', 'data'),
+          Output('err-msg', 'children', allow_duplicate=True),
+          Input('lineplot-export-button', 'n_clicks'),
+          Input('barplot-export-button', 'n_clicks'),
+          State('lineplot-graph-id', 'figure'),
+          State('barplot-graph-id', 'figure'),
+          State('lineplot-export-format', 'value'),
+          State('barplot-export-format', 'value'),
+          prevent_initial_call=True)
+def export_current_figure(lineplot_clicks : int, barplot_clicks : int, lineplot_fig : dict, barplot_fig : dict,
+                          lineplot_format : str, barplot_format : str):
+    """
+    User clicked 'Download' below the line plot or the bar plot.
+    The figure, as currently displayed (with the user's edits), is rendered on the server (see export.py).
+    """
+    if ctx.triggered_id == 'lineplot-export-button' and lineplot_clicks:
+        fig, fmt, filename = lineplot_fig, lineplot_format, 'line_plot'
+    elif ctx.triggered_id == 'barplot-export-button' and barplot_clicks:
+        fig, fmt, filename = barplot_fig, barplot_format, 'bar_plot'
+    else:
+        return no_update, no_update
+    if not fig or not fig.get('data'):
+        return no_update, 'There is no plot to download yet.'
+    try:
+        image = export.render_figure(fig, fmt)
+    except Exception as e:
+        return no_update, f'Unable to export the plot.\n{e}'
+    return dcc.send_bytes(image, f'{filename}.{fmt}'), no_update
+
+
+def _make_styled_line_plot(df_in : pd.DataFrame, props_to_plot : list, group : str, display_meanSD : bool,
+                           slider_value : float, style_map : dict, groupBy_options : list, dataset_key : str,
+                           display_density : bool=False, day_range : list=None):
+    """
+    Build a line plot the way update_line_plot() does, for exporting. The style map is applied
+    if it has styles for this grouping; otherwise the plot keeps its default colors.
+    """
+    sample_string = df_in.columns[0]
+    day_string = 'Day'
+    for col_name in df_in.columns:
+        if col_name.lower() == 'day':
+            day_string = col_name # use the column title's actual capitalization
+            break
+    df_window, day_range = _restrict_to_days(df_in, day_string, day_range, dataset_key)
+    df_facets = df_window[df_window['prop name'].isin(props_to_plot)]
+    df_facets = df_facets[df_facets['prop value'].notna()].reset_index(drop=True)
+    fig = _get_or_build_line_plot(df_in, df_facets, props_to_plot, group, display_meanSD, slider_value,
+                                  groupBy_options, dataset_key, day_string, display_density=display_density,
+                                  day_range=day_range)
+    if style_map and group in style_map:
+        try:
+            utils.apply_style_map_to_line_plot(fig, style_map, group, sample_string, display_meanSD or display_density)
+        except KeyError:
+            pass # the style map doesn't cover these facets; keep the default colors
+    return fig
+
+
+@callback(Output('export-batch-url', 'data'),
+          Output('err-msg', 'children', allow_duplicate=True),
+          Input('lineplot-export-facets-button', 'n_clicks'),
+          Input('lineplot-export-groupings-button', 'n_clicks'),
+          State('lineplot-style-map', 'data'),
+          State('lineplot-facetVars-checklist', 'value'),
+          State('lineplot-groupBy-dropdown', 'value'),
+          State('lineplot-groupBy-dropdown', 'options'),
+          State('lineplot-replicates-radioitems', 'value'),
+          State('lineplot-slider', 'value'),
+          State('lineplot-dayrange-slider', 'value'),
+          State('lineplot-export-format', 'value'),
+          State('dataset-key', 'data'),
+          prevent_initial_call=True)
+def export_line_plot_batch(facet_clicks : int, grouping_clicks : int, style_map : dict,
+                           props_to_plot : list, group : str, groupBy_options : list, radioitem_value : int,
+                           slider_value : float, day_range : list, fmt : str, dataset_key : str):
+    """
+    User clicked 'Download each y-axis' or 'Download each grouping' below the line plot.
+    Builds one figure per checked property (y-axis), or one per available grouping, and registers
+    them as a batch export; the browser then downloads the zip archive from the returned URL
+    (see the clientside callback below), which is streamed as the images are rendered.
+    """
+    if not dataset_key or not props_to_plot or not group or not (facet_clicks or grouping_clicks):
+        return no_update, no_update
+    try:
+        df_in, _ = _study_tables(dataset_key)
+    except ValueError as e:
+        return no_update, str(e)
+    display_meanSD = utils.LINEPLOT_MEAN_SD == radioitem_value
+    display_density = utils.LINEPLOT_DENSITY == radioitem_value
+    if ctx.triggered_id == 'lineplot-export-facets-button':
+        items = [(facet, _make_styled_line_plot(df_in, [facet], group, display_meanSD, slider_value,
+                                                style_map, groupBy_options, dataset_key, display_density, day_range))
+                 for facet in props_to_plot]
+    else:
+        items = [(group_, _make_styled_line_plot(df_in, props_to_plot, group_, display_meanSD, slider_value,
+                                                 style_map, groupBy_options, dataset_key, display_density, day_range))
+                 for group_ in groupBy_options]
+    try:
+        return export.create_batch(items, fmt), no_update
+    except (ValueError, *export.RENDERER_ERRORS) as e:
+        return no_update, f'Unable to export the plots.\n{e}'
+
+
+# Start the download as soon as the batch is registered.
+clientside_callback(
+    """
+    function(url) {
+        if (url) {
+            const link = document.createElement('a');
+            link.href = url;
+            link.download = 'plots.zip';
+            document.body.appendChild(link);
+            link.click();
+            link.remove();
+        }
+        return window.dash_clientside.no_update;
+    }
+    """,
+    Input('export-batch-url', 'data'),
+    prevent_initial_call=True)
+#
+#---------------------End 'export' callbacks---------------------------------------
+
+#-------------------Begin 'saved session' callbacks--------------------------------
+#
+@callback(Output('session-controls-div', 'hidden'),
+          Input('dataset-key', 'data'))
+def show_session_controls(dataset_key : str):
+    """
+    Sessions can be saved once data has been loaded.
+    """
+    return not dataset_key
+
+
+@callback(Output('session-link', 'value', allow_duplicate=True),
+          Output('err-msg', 'children', allow_duplicate=True),
+          Input('save-session-button', 'n_clicks'),
+          State('url', 'href'),
+          State('dataset-key', 'data'),
+          State('session-id', 'data'),
+          State('label-index-version', 'data'),
+          State('sample-to-label-map', 'data'),
+          State('label-table', 'data'),
+          State('default-label', 'data'),
+          State('lineplot-style-map', 'data'),
+          State('lineplot-facetVars-checklist', 'value'),
+          State('lineplot-groupBy-dropdown', 'value'),
+          State('lineplot-replicates-radioitems', 'value'),
+          State('lineplot-slider', 'value'),
+          State('lineplot-dayrange-slider', 'value'),
+          State('lineplot-applyToFacets-checkbox', 'value'),
+          State('lineplot-oneStylePerReplicate-checkbox', 'value'),
+          State('barplot-facetVars-checklist', 'value'),
+          State('sortorder-dropdown', 'value'),
+          State('sortorder-radioitems', 'value'),
+          State('barPlot-hideXticks-checkbox', 'value'),
+          prevent_initial_call=True)
+def save_session(n_clicks : int, href : str, dataset_key : str, session_id : str, label_index_version : int,
+                 label_map : dict, label_table : dict, default_label : int, style_map : dict,
+                 lineplot_facets : list, group : str, radioitem_value : int, slider_value : float,
+                 day_range : list, apply_across_facets : bool, one_style_per_replicate : bool,
+                 barplot_facets : list, sorting_key : str, sorting_direction : int, hide_x_ticks : bool):
+    """
+    User clicked 'Save session'. The labels, line colors, and plot settings are saved on the server
+    (see sessions.py), and a link that restores them is shown.
+    """
+    if not n_clicks or not dataset_key or not label_map:
+        return no_update, no_update
+    index = labels.get_label_index(session_id, label_index_version, label_map, label_table, default_label)
+    snapshot = {'dataset key':dataset_key,
+                'samples digest':sessions.samples_digest(index.samples),
+                'label table':label_table,
+                'default label':default_label,
+                'label ids':index.sample_label_ids,
+                'style map':style_map,
+                'line plot':{'facets':lineplot_facets or [], 'group':group, 'mode':radioitem_value,
+                             'spread':slider_value, 'days':day_range, 'apply to facets':apply_across_facets,
+                             'one style per replicate':one_style_per_replicate},
+                'bar plot':{'facets':barplot_facets or [], 'sort by':sorting_key,
+                            'ascending':sorting_direction, 'hide x ticks':hide_x_ticks}}
+    try:
+        token = sessions.save_snapshot(snapshot)
+    except OSError as e:
+        return no_update, f'Unable to save the session.\n{e}'
+    scheme, netloc, path, _, _ = urlsplit(href or '/')
+    return urlunsplit((scheme, netloc, path, urlencode({'session':token}), '')), no_update
+
+
+@callback(Output('sample-to-label-map', 'data', allow_duplicate=True),
+          Output('label-table', 'data', allow_duplicate=True),
+          Output('default-label', 'data', allow_duplicate=True),
+          Output('label-index-version', 'data', allow_duplicate=True),
+          Output('categories-dropdown', 'options', allow_duplicate=True),
+          Output('label-assignment-dropdown', 'options', allow_duplicate=True),
+          Output('samples-dropdown', 'options', allow_duplicate=True),
+          Output('lineplot-style-map', 'data', allow_duplicate=True),
+          Output('lineplot-facetVars-checklist', 'value', allow_duplicate=True),
+          Output('lineplot-groupBy-dropdown', 'value', allow_duplicate=True),
+          Output('lineplot-replicates-radioitems', 'value', allow_duplicate=True),
+          Output('lineplot-slider', 'value', allow_duplicate=True),
+          Output('lineplot-applyToFacets-checkbox', 'value', allow_duplicate=True),
+          Output('lineplot-oneStylePerReplicate-checkbox', 'value', allow_duplicate=True),
+          Output('lineplot-dayrange-slider', 'value', allow_duplicate=True),
+          Output('render-lineplot-button', 'n_clicks', allow_duplicate=True),
+          Output('barplot-facetVars-checklist', 'value', allow_duplicate=True),
+          Output('sortorder-dropdown', 'value', allow_duplicate=True),
+          Output('sortorder-radioitems', 'value', allow_duplicate=True),
+          Output('barPlot-hideXticks-checkbox', 'value', allow_duplicate=True),
+          Output('render-barplot-button', 'n_clicks', allow_duplicate=True),
+          Output('session-link', 'value', allow_duplicate=True),
+          Output('err-msg', 'children', allow_duplicate=True),
+          Input('barplot-facetVars-checklist', 'options'),
+          State('url', 'search'),
+          State('url', 'href'),
+          State('dataset-key', 'data'),
+          State('session-id', 'data'),
+          State('label-index-version', 'data'),
+          State('sample-to-label-map', 'data'),
+          State('lineplot-facetVars-checklist', 'options'),
+          State('lineplot-groupBy-dropdown', 'options'),
+          State('sortorder-dropdown', 'options'),
+          State('render-lineplot-button', 'n_clicks'),
+          State('render-barplot-button', 'n_clicks'),
+          prevent_initial_call=True)
+def restore_session(barplot_facet_options : list, search : str, href : str, dataset_key : str, session_id : str,
+                    label_index_version : int, label_map : dict, lineplot_facet_options : list,
+                    groupBy_options : list, sort_options : list, lineplot_clicks : int, barplot_clicks : int):
+    """
+    If the page was opened from a saved-session link (?session=<token>), restore the session
+    once the data has been loaded and the bar plot's components have been initialized
+    (see initialize_barplot_components(), which sets barplot-facetVars-checklist's options).
+
+    The snapshot is looked up once (see sessions.load_snapshot()). The labels go straight into
+    the Stores and into this session's label index; the plots are then re-rendered by "clicking"
+    their 'show plot' buttons, and the line plot's base figure comes from the figure cache
+    if this server process has already built it.
+    """
+    num_outputs = len(ctx.outputs_list)
+    ret_vals = [no_update]*num_outputs
+    token = parse_qs((search or '').lstrip('?')).get('session', [None])[0]
+    if not token or not label_map:
+        return tuple(ret_vals)
+    try:
+        snapshot = sessions.load_snapshot(token)
+    except ValueError as e:
+        ret_vals[-1] = f'Unable to restore the saved session.\n{e}'
+        return tuple(ret_vals)
+    if snapshot.get('dataset key') != dataset_key or snapshot['samples digest'] != sessions.samples_digest(label_map):
+        ret_vals[-1] = 'Unable to restore the saved session.\nIt was saved with a different data set.'
+        return tuple(ret_vals)
+    label_table = snapshot['label table']
+    default_label = snapshot['default label']
+    index = labels.LabelIndex(label_map.keys(), label_table, default_label)
+    index.sample_label_ids = snapshot['label ids'].copy()
+    index.version = (label_index_version or 0) + 1
+    labels.set_label_index(session_id, index)
+    label_options = [utils.ADD_NEW_CATEGORY, *[layout.make_labeled_option(name, color)
+                                               for name, color in zip(label_table['names'], label_table['colors'])]]
+    colors = index.sample_colors()
+    ret_vals[0] = dict(zip(index.samples.tolist(), index.sample_label_ids.tolist()))
+    ret_vals[1] = label_table
+    ret_vals[2] = default_label
+    ret_vals[3] = index.version
+    ret_vals[4] = label_options
+    ret_vals[5] = label_options[1:]
+    ret_vals[6] = [layout.make_labeled_option(sample, color)
+                   for sample, color in zip(index.samples[:utils.MAX_SAMPLE_OPTIONS].tolist(),
+                                            colors[:utils.MAX_SAMPLE_OPTIONS].tolist())]
+    # Settings that refer to facets or groupings no longer in the data set are dropped.
+    lineplot = snapshot['line plot']
+    available_facets = [opt['value'] for opt in lineplot_facet_options or []]
+    lineplot_facets = [facet for facet in lineplot['facets'] if facet in available_facets]
+    ret_vals[7] = snapshot['style map']
+    ret_vals[8] = lineplot_facets
+    ret_vals[10] = lineplot['mode']
+    ret_vals[11] = lineplot['spread']
+    ret_vals[12] = lineplot['apply to facets']
+    ret_vals[13] = lineplot['one style per replicate']
+    if lineplot.get('days'): # sessions saved before the range of days could be chosen show all of them
+        ret_vals[14] = lineplot['days']
+    if lineplot['group'] in (groupBy_options or []):
+        ret_vals[9] = lineplot['group']
+        if lineplot_facets:
+            ret_vals[15] = (lineplot_clicks or 0) + 1 # show the line plot
+    barplot = snapshot['bar plot']
+    available_facets = [opt['value'] for opt in barplot_facet_options or []]
+    barplot_facets = [facet for facet in barplot['facets'] if facet in available_facets]
+    ret_vals[16] = barplot_facets
+    if barplot['sort by'] in [opt['value'] if isinstance(opt, dict) else opt for opt in sort_options or []]:
+        ret_vals[17] = barplot['sort by']
+    ret_vals[18] = barplot['ascending']
+    ret_vals[19] = barplot['hide x ticks']
+    if barplot_facets:
+        ret_vals[20] = (barplot_clicks or 0) + 1 # show the bar plot
+    ret_vals[21] = href
+    return tuple(ret_vals)
+#
+#---------------------End 'saved session' callbacks--------------------------------
+
+#-------------------Begin 'debug panel' callbacks----------------------------------
+#
+@callback(Output('debug-panel-table', 'children'),
+          Input('debug-panel-interval', 'n_intervals'))
+def update_debug_panel(_):
+    """
+    Show the most recent callback calls handled by this server process (see instrumentation.py),
+    with the phases of those that report them. Full statistics are at /metrics.
+    """
+    header = html.Tr([html.Th(text, style={'padding-right':12})
+                      for text in ['callback', 'total', 'phases', 'in (kB)', 'out (kB)']])
+    rows = []
+    for call in instrumentation.recent_calls():
+        if call['callback'] == 'update_debug_panel':
+            continue
+        phases = ', '.join(f'{name} {1000*seconds:.0f}' for name, seconds in call['phases'].items())
+        rows.append(html.Tr([html.Td(call['callback']),
+                             html.Td(f"{1000*call['duration']:.0f}"),
+                             html.Td(phases),
+                             html.Td(f"{call.get('request bytes', 0)/1000:.1f}"),
+                             html.Td(f"{call.get('response bytes', 0)/1000:.1f}")]))
+    return html.Table([header, *rows])
+#
+#---------------------End 'debug panel' callbacks----------------------------------
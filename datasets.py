@@ -0,0 +1,270 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+import shared_datasets
+
+# ------- Begin server-side data set registry ---------------
+#
+# The dcc.Store components hold everything the browser needs, but some structures
+# (search indexes, precomputed statistics, ...) are expensive to build and are only
+# needed on the server. These get built once per data set and kept here,
+# keyed by a short "data set key" that the browser holds in dcc.Store(id='dataset-key').
+#
+# The general form of the registry is:
+#
+# _registry = {'dataset_key1':{'sample search index':SampleSearchIndex(...),
+#                              'some other structure':..., ...},
+#              'dataset_key2':{...}, ...
+#             }
+#
+# NOTE: Each server process (e.g. each gunicorn worker) has its own registry.
+# Every consumer of the registry must therefore be able to rebuild what it needs
+# from the dcc.Store contents (or the study's tables) if a lookup comes back empty.
+#
+# The study's tables themselves aren't sent to the browser: callbacks get them with get_study(),
+# from the data set key. Each process registers the studies it serves (register_study()),
+# so that whichever process a request reaches can load (or memory-map) the study behind a key.
+#
+# Each process keeps at most MAX_DATASETS data sets, evicting the least recently used one
+# (with drop_dataset(), which also releases its shared tables) to make room for another.
+# When a study's files change, it gets a new key (see make_dataset_key()), and register_study()
+# drops the data set under the old key right away.
+MAX_DATASETS = 4
+_registry = OrderedDict() # least recently used first
+_studies = {} # dataset_key -> (infile_timeseries, infile_demographics, groupBy_options)
+_lock = threading.RLock()
+#
+# ------- End server-side data set registry -----------------
+
+
+def make_dataset_key(paths : list):
+    """
+    Function to derive a short, stable key for a data set from the files it was loaded from.
+    The key changes whenever any of the files is modified, so stale cached structures
+    are never served for a freshly edited file.
+
+    Parameters
+    ----------
+    paths : list of str
+       The paths of the files that make up the data set.
+
+    Returns
+    -------
+    str
+       A 16-character hexadecimal key.
+    """
+    h = hashlib.sha1()
+    for path in paths:
+        h.update(os.path.abspath(path).encode())
+        try:
+            stats = os.stat(path)
+            h.update(f'{stats.st_mtime_ns}:{stats.st_size}'.encode())
+        except OSError:
+            pass # the loader will report the missing file; the key just won't reflect it
+    return h.hexdigest()[:16]
+
+
+def get_cached(dataset_key : str, name : str, default=None):
+    """
+    Return the structure stored under `name` for the given data set, or `default`.
+    """
+    if not dataset_key:
+        return default
+    with _lock:
+        if dataset_key not in _registry:
+            return default
+        _registry.move_to_end(dataset_key)
+        return _registry[dataset_key].get(name, default)
+
+
+def _entry(dataset_key : str):
+    """
+    Return the registry entry of a data set, creating it (and evicting the least recently used data sets
+    beyond MAX_DATASETS) if necessary. Called with the registry lock held; returns the evicted keys,
+    which the caller must drop (see drop_dataset()) after releasing the lock.
+    """
+    if dataset_key in _registry:
+        _registry.move_to_end(dataset_key)
+        return _registry[dataset_key], []
+    _registry[dataset_key] = {}
+    evicted = list(_registry)[:max(len(_registry) - MAX_DATASETS, 0)]
+    return _registry[dataset_key], evicted
+
+
+def set_cached(dataset_key : str, name : str, value):
+    """
+    Store `value` under `name` for the given data set, replacing any previous value.
+    """
+    if not dataset_key:
+        return value
+    with _lock:
+        entry, evicted = _entry(dataset_key)
+        entry[name] = value
+    for key in evicted:
+        drop_dataset(key)
+    return value
+
+
+def get_or_build(dataset_key : str, name : str, builder):
+    """
+    Return the structure stored under `name` for the given data set,
+    calling `builder()` to build (and store) it first if it isn't there yet.
+    The registry lock is not held while `builder()` runs, so two requests may
+    occasionally build the same structure; the first one stored wins.
+    """
+    value = get_cached(dataset_key, name)
+    if value is not None:
+        return value
+    value = builder()
+    if not dataset_key:
+        return value
+    with _lock:
+        entry, evicted = _entry(dataset_key)
+        value = entry.setdefault(name, value)
+    for key in evicted:
+        drop_dataset(key)
+    return value
+
+
+def drop_dataset(dataset_key : str):
+    """
+    Forget everything cached for the given data set, and release this process's hold
+    on its shared tables (see load_study_shared()).
+    """
+    with _lock:
+        entry = _registry.pop(dataset_key, None)
+    if entry and 'shared tables' in entry:
+        shared_datasets.release(dataset_key)
+
+
+def register_study(infile_timeseries : str, infile_demographics : str, groupBy_options : list):
+    """
+    Record the files a study is read from (see load_study()) and return its data set key,
+    with which get_study() loads it. If the files were registered before under another key
+    (i.e. they've changed since), the data set under that key is dropped.
+    """
+    dataset_key = make_dataset_key([infile_timeseries, infile_demographics])
+    with _lock:
+        superseded = [key for key, source in _studies.items()
+                      if key != dataset_key and source[:2] == (infile_timeseries, infile_demographics)]
+        for key in superseded:
+            del _studies[key]
+        _studies[dataset_key] = (infile_timeseries, infile_demographics, list(groupBy_options))
+    for key in superseded:
+        drop_dataset(key)
+    return dataset_key
+
+
+def get_study(dataset_key : str):
+    """
+    Return the tables of a study registered with register_study(), loading them in this process
+    if necessary; see load_study_shared().
+
+    Raises
+    ------
+    ValueError
+       If no study is registered under this key (e.g. its files have changed since the key was issued),
+       or as in load_study().
+    """
+    tables = get_cached(dataset_key, 'shared tables')
+    if tables is not None:
+        return tables
+    with _lock:
+        source = _studies.get(dataset_key)
+    if source is None:
+        raise ValueError('This data set is no longer available (its files may have changed).\n'
+                         'Reload the page to load it again.')
+    return load_study_shared(dataset_key, *source)
+
+
+def load_study_shared(dataset_key : str, infile_timeseries : str, infile_demographics : str,
+                      groupBy_options : list):
+    """
+    Same as load_study(), but the melted tables are kept in the cross-process cache
+    (see shared_datasets.py): they're built by whichever server process loads the study first,
+    and memory-mapped by the others. Each process holds the study until it's dropped from this
+    process's registry (see drop_dataset()), or the process exits.
+
+    Returns
+    -------
+    dict
+       'timeseries' and 'metrics' -> the DataFrames returned by load_study(). Treat them as read-only.
+
+    Raises
+    ------
+    ValueError
+       See load_study().
+    """
+    def build():
+        df_all, df_metrics = load_study(infile_timeseries, infile_demographics, groupBy_options)
+        return {'timeseries':df_all, 'metrics':df_metrics}
+    if not dataset_key:
+        return build()
+    tables = get_cached(dataset_key, 'shared tables')
+    if tables is not None:
+        return tables
+    tables = shared_datasets.acquire(dataset_key, build)
+    stored = get_or_build(dataset_key, 'shared tables', lambda: tables)
+    if stored is not tables:
+        shared_datasets.release(dataset_key) # another request acquired it first; hold it only once
+    return stored
+
+
+def load_study(infile_timeseries : str, infile_demographics : str, groupBy_options : list):
+    """
+    Function to read the timeseries and demographics CSV files of a study and melt them into
+    the "long" form used throughout the app: one row per (Patient ID, [Day,] property).
+
+    Parameters
+    ----------
+    infile_timeseries : str
+       CSV with columns 'Patient ID', 'Day', the groupBy_options, and one column per timeseries property.
+    infile_demographics : str
+       CSV with column 'Patient ID' and one column per demographic (non-time-varying) property.
+    groupBy_options : list of str
+       The columns of infile_timeseries by which samples can be grouped, e.g. ['Treatment', 'Home location'].
+
+    Returns
+    -------
+    pd.DataFrame, pd.DataFrame
+       The melted timeseries data (columns 'Patient ID', 'Day', the groupBy_options, 'prop name', 'prop value')
+       and the melted demographics ("metrics"; columns 'Patient ID', 'prop name', 'prop value').
+       'Patient ID' is column 0 of both; other functions expect it to be there.
+
+    Raises
+    ------
+    ValueError
+       With a message for the user, if a file can't be read or lacks a groupBy option.
+    """
+    frames = []
+    for infile in [infile_timeseries, infile_demographics]:
+        try:
+            frames.append(pd.read_csv(infile))
+        except FileNotFoundError:
+            raise ValueError(f"Whoops, file {infile} was not found.")
+        except Exception as e:
+            raise ValueError(f"Failed to connect to the data source.\nReceived the following exception:\n{e}.")
+    df_infile_timeseries, df_infile_demographics = frames
+    for opt in groupBy_options:
+        if opt not in df_infile_timeseries.columns:
+            raise ValueError(f"Whoops, groupBy option {opt} is not an option.")
+    vv_timeseries = list(set(df_infile_timeseries.columns.tolist()) - set(['Patient ID', 'Day'])
+                         - set(groupBy_options)) # "vv_" for "value_vars"
+    df_all = df_infile_timeseries.melt(id_vars=list(set(['Patient ID', 'Day']+groupBy_options)),
+                                       value_vars=vv_timeseries,
+                                       var_name='prop name', value_name='prop value',
+                                       ignore_index=True) # .dropna()
+    df_all['Patient ID'] = df_all['Patient ID'].astype(str)
+    vv_demog = list(set(df_infile_demographics.columns.tolist()) - set(['Patient ID']))
+    df_metrics = df_infile_demographics.melt(id_vars=['Patient ID'],
+                                             value_vars=vv_demog,
+                                             var_name='prop name', value_name='prop value',
+                                             ignore_index=True) # .dropna()
+    df_metrics['Patient ID'] = df_metrics['Patient ID'].astype(str)
+    df_all = df_all[['Patient ID', *list(set(df_all.columns) - set(['Patient ID']))]]
+    df_metrics = df_metrics[['Patient ID', *list(set(df_metrics.columns) - set(['Patient ID']))]]
+    return df_all, df_metrics
@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+
+# ------- Begin derived metrics ---------------
+#
+# Bar plots of summaries over time (e.g. the mean or max of a property over the days of the study)
+# are built from the timeseries data itself: for every sample and timeseries property,
+# compute_derived_metrics() summarizes the values over x_column ('Day') with each of DERIVED_METRICS:
+#
+#   mean, max, min : of the values
+#   last           : the value at the sample's last x_column value
+#   slope          : of the least-squares line through (x_column, value)
+#   AUC            : the area under the curve, by the trapezoidal rule, over x_column
+#
+# The slope and AUC need at least two distinct x_column values; otherwise they're missing (NaN).
+# The result has the form of the melted "metrics" (demographics) table, one row per
+# (sample, derived property), with 'prop name' e.g. 'Coughs (1/hour) (mean)' (see derived_metric_name()),
+# so it's appended to the metrics and can be plotted, sorted, queried, and labeled like any other metric.
+DERIVED_METRICS = ['mean', 'max', 'min', 'last', 'slope', 'AUC']
+#
+# ------- End derived metrics -----------------
+
+
+def derived_metric_name(prop : str, metric : str):
+    """
+    Return the 'prop name' of a derived metric of a timeseries property, e.g. 'Coughs (1/hour) (mean)'.
+    """
+    return f'{prop} ({metric})'
+
+
+def is_derived_metric_name(prop : str):
+    """
+    Return whether a 'prop name' has the form of a derived metric's (see derived_metric_name()).
+    """
+    return any(prop.endswith(f' ({metric})') for metric in DERIVED_METRICS)
+
+
+def compute_derived_metrics(df_in : pd.DataFrame, id_column : str='Patient ID', x_column : str='Day'):
+    """
+    Function to compute the derived metrics (see DERIVED_METRICS) of every sample and timeseries property,
+    in one pass over the melted timeseries data.
+
+    Parameters
+    ----------
+    df_in : pd.DataFrame
+       The melted timeseries data: columns id_column, x_column, 'prop name', and 'prop value'.
+       Rows with a missing (NaN) 'prop value' are ignored.
+    id_column : str, default : 'Patient ID'
+       The name of the column identifying the samples.
+    x_column : str, default : 'Day'
+       The name of the column holding the x-axis data.
+
+    Returns
+    -------
+    pd.DataFrame
+       The derived metrics, melted: columns id_column, 'prop name', 'prop value',
+       ordered by property, then metric (in the order of DERIVED_METRICS), then sample.
+    """
+    df = df_in[[id_column, x_column, 'prop name', 'prop value']].dropna(subset=[x_column, 'prop value'])
+    # Sort and group by integer codes rather than by the (string) names.
+    prop_codes, prop_names = pd.factorize(df['prop name'], sort=True)
+    sample_codes, sample_names = pd.factorize(df[id_column], sort=True)
+    x = df[x_column].to_numpy(dtype=float)
+    order = np.lexsort((x, sample_codes, prop_codes))
+    prop_codes, sample_codes, x = prop_codes[order], sample_codes[order], x[order]
+    y = df['prop value'].to_numpy(dtype=float)[order]
+    # Each row but a sample's first (for a property) closes a trapezoid with the row before it.
+    trapezoid = np.zeros(len(x))
+    if len(x) > 1:
+        same = (prop_codes[1:] == prop_codes[:-1]) & (sample_codes[1:] == sample_codes[:-1])
+        trapezoid[1:] = np.where(same, 0.5*(y[1:] + y[:-1])*(x[1:] - x[:-1]), 0.)
+    terms = pd.DataFrame({'prop':prop_codes, 'sample':sample_codes, 'y':y, 'x':x, 'xx':x*x, 'xy':x*y,
+                          'trapezoid':trapezoid})
+    stats = terms.groupby(['prop', 'sample'], sort=False).agg(
+        n=('y', 'count'), mean=('y', 'mean'), max=('y', 'max'), min=('y', 'min'), last=('y', 'last'),
+        sum_y=('y', 'sum'), sum_x=('x', 'sum'), sum_xx=('xx', 'sum'), sum_xy=('xy', 'sum'),
+        x_min=('x', 'min'), x_max=('x', 'max'), AUC=('trapezoid', 'sum'))
+    # Least squares: slope = (n*Sxy - Sx*Sy)/(n*Sxx - Sx**2). The slope and AUC need two distinct x values.
+    has_spread = stats['x_max'] > stats['x_min']
+    stats['slope'] = ((stats['n']*stats['sum_xy'] - stats['sum_x']*stats['sum_y'])
+                      /(stats['n']*stats['sum_xx'] - stats['sum_x']**2)).where(has_spread)
+    stats['AUC'] = stats['AUC'].where(has_spread)
+    # One row per (property, metric, sample), in that order. The groups (rows of stats) are already
+    # in (property, sample) order, so a stable sort by (property, metric) is all that's needed.
+    num_metrics = len(DERIVED_METRICS)
+    names = np.array([derived_metric_name(prop, metric) for prop in prop_names for metric in DERIVED_METRICS],
+                     dtype=object)
+    name_codes = np.tile(stats.index.get_level_values('prop').to_numpy()*num_metrics, num_metrics) \
+        + np.repeat(np.arange(num_metrics), len(stats))
+    order = np.argsort(name_codes, kind='stable')
+    samples = np.tile(stats.index.get_level_values('sample').to_numpy(), num_metrics)
+    return pd.DataFrame({id_column:np.asarray(sample_names, dtype=object)[samples[order]],
+                         'prop name':names[name_codes[order]],
+                         'prop value':stats[DERIVED_METRICS].to_numpy().T.ravel()[order]})
@@ -0,0 +1,390 @@
+import io
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from flask import Response, abort, request, stream_with_context
+from plotly.io.json import to_json_plotly
+
+import payloads
+
+logger = logging.getLogger(__name__)
+
+# ------- Begin image export ---------------
+#
+# Figures are rendered to PNG/SVG/PDF by Kaleido in a small pool of worker processes,
+# started by the first export (or when the app starts, if the environment variable
+# PLOTTING_PARTNER_EXPORT_WARM_UP=1; see warm_up()). Each worker renders a tiny figure when it starts,
+# so the renderer (and, with Kaleido >= 1.0, its headless browser) is running before it's handed a real figure.
+# If the pool breaks (e.g. a worker is killed), the export fails with one of RENDERER_ERRORS,
+# and the next export starts a new pool.
+#
+# Batch exports are prepared by a callback (which builds the figures) and written, under a random token,
+# to a file in EXPORT_DIR, so that whichever server process (e.g. gunicorn worker) the download reaches
+# can read it. The browser then downloads /export/batch/<token>.zip; that request takes the batch's file
+# (so it's downloaded only once), queues its figures for rendering, and streams the zip archive entry by entry
+# as the renderers finish, rather than assembling it in memory first. An image that fails to render
+# is replaced in the archive by a '.error.txt' entry saying why, so the archive is never cut short.
+# Batches that aren't downloaded within BATCH_EXPIRY_SECONDS, or beyond the newest MAX_PENDING_BATCHES, are deleted.
+#
+# Image sizes (a figure's layout width and height) are kept within [MIN_EXPORT_SIZE, MAX_EXPORT_SIZE] pixels.
+EXPORT_FORMATS = {'png':'image/png', 'svg':'image/svg+xml', 'pdf':'application/pdf'}
+EXPORT_RENDERERS = 2         # worker processes in the renderer pool
+EXPORT_SCALE = 2             # PNG resolution multiplier
+MIN_EXPORT_SIZE = 10
+MAX_EXPORT_SIZE = 4096
+EXPORT_DIR = os.environ.get('PLOTTING_PARTNER_EXPORT_DIR',
+                            os.path.join(tempfile.gettempdir(), 'plotting_partner_exports'))
+MAX_PENDING_BATCHES = 64     # batch exports prepared but not yet downloaded, by all server processes
+BATCH_EXPIRY_SECONDS = 600
+BATCH_URL = '/export/batch/{token}.zip'
+EXPORT_WARM_UP = os.environ.get('PLOTTING_PARTNER_EXPORT_WARM_UP', '0') not in ['', '0']
+RENDERER_ERRORS = (BrokenProcessPool, OSError) # failures of the renderers rather than of the figure
+
+_renderer_pool = None
+_pool_lock = threading.Lock()
+_TOKEN_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+#
+# ------- End image export -----------------
+
+
+def kaleido_available():
+    """
+    Return True if Kaleido (needed for rendering images on the server) is installed.
+    """
+    try:
+        import kaleido # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _warm_up_renderer():
+    """
+    Renderer pool initializer: start Kaleido and render a tiny figure.
+    """
+    import kaleido
+    import plotly.io as pio
+    if hasattr(kaleido, 'start_sync_server'): # Kaleido >= 1.0 keeps one browser running per process
+        kaleido.start_sync_server(silence_warnings=True)
+    pio.to_image({'data':[{'type':'scatter', 'x':[0], 'y':[0]}], 'layout':{}}, format='png', width=10, height=10)
+
+
+def _render(fig : dict, fmt : str, width : int, height : int, scale : float):
+    import plotly.io as pio
+    return pio.to_image(fig, format=fmt, width=width, height=height, scale=scale)
+
+
+def _get_renderer_pool():
+    global _renderer_pool
+    with _pool_lock:
+        if _renderer_pool is None:
+            _renderer_pool = ProcessPoolExecutor(max_workers=EXPORT_RENDERERS,
+                                                 mp_context=multiprocessing.get_context('spawn'),
+                                                 initializer=_warm_up_renderer)
+        return _renderer_pool
+
+
+def _discard_renderer_pool(pool):
+    """
+    Forget a broken renderer pool, so that the next export starts a new one.
+    """
+    global _renderer_pool
+    with _pool_lock:
+        if _renderer_pool is pool:
+            _renderer_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def warm_up():
+    """
+    Start the renderer pool (if Kaleido is installed) so the first export doesn't pay for starting it.
+    """
+    if kaleido_available():
+        pool = _get_renderer_pool()
+        for _ in range(EXPORT_RENDERERS):
+            pool.submit(int) # any task makes the pool start a worker, which runs _warm_up_renderer()
+
+
+def _check_format(fmt : str):
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f'Unsupported image format "{fmt}". Choose one of {", ".join(EXPORT_FORMATS)}.')
+    if not kaleido_available():
+        raise ValueError('Exporting images requires the "kaleido" package,\nwhich is not installed on the server.')
+
+
+def _clamp_size(size):
+    """
+    Return an image width or height (None: the renderer's default) within [MIN_EXPORT_SIZE, MAX_EXPORT_SIZE].
+    """
+    if size is None:
+        return None
+    try:
+        size = int(size)
+    except (TypeError, ValueError):
+        raise ValueError(f'Invalid image size "{size}".')
+    return min(max(size, MIN_EXPORT_SIZE), MAX_EXPORT_SIZE)
+
+
+def submit_render(fig, fmt : str='png', width : int=None, height : int=None, scale : float=EXPORT_SCALE):
+    """
+    Queue a figure for rendering and return a concurrent.futures.Future holding the image bytes.
+
+    Parameters
+    ----------
+    fig : Figure or dict
+       The figure, e.g. the 'figure' property of a dcc.Graph.
+    fmt : str, default : 'png'
+       One of EXPORT_FORMATS.
+    width, height : int, default : None
+       The image size in pixels. None means the figure's own size, or Kaleido's default.
+       Either way, it's kept within [MIN_EXPORT_SIZE, MAX_EXPORT_SIZE].
+    scale : float, default : EXPORT_SCALE
+       Resolution multiplier (PNG only, in effect).
+
+    Raises
+    ------
+    ValueError
+       If the format isn't supported, Kaleido isn't installed, or the size isn't a number.
+    BrokenProcessPool
+       If the renderer pool is broken (it's then replaced by the next export).
+    """
+    _check_format(fmt)
+    if hasattr(fig, 'to_plotly_json'):
+        fig = fig.to_plotly_json()
+    fig = payloads.decode_typed_arrays(fig)
+    layout = fig.get('layout') if isinstance(fig.get('layout'), dict) else {}
+    width = _clamp_size(width or layout.get('width'))
+    height = _clamp_size(height or layout.get('height'))
+    pool = _get_renderer_pool()
+    try:
+        return pool.submit(_render, fig, fmt, width, height, scale)
+    except BrokenProcessPool:
+        _discard_renderer_pool(pool)
+        raise
+
+
+def render_figure(fig, fmt : str='png', **kwargs):
+    """
+    Render a figure and return the image bytes. See submit_render() for the parameters.
+    Raises one of RENDERER_ERRORS if the renderer fails.
+    """
+    pool = _get_renderer_pool()
+    try:
+        return submit_render(fig, fmt, **kwargs).result()
+    except BrokenProcessPool:
+        _discard_renderer_pool(pool)
+        raise
+
+
+def safe_filename(name : str, default : str='figure'):
+    """
+    Turn a facet or group name (e.g. 'Family income (x $1000)') into something usable as a file name,
+    with no path separators and no leading dots; `default` if nothing is left.
+    """
+    return re.sub(r'[^A-Za-z0-9._-]+', '_', str(name)).strip('._') or default
+
+
+def _batch_path(token : str):
+    return os.path.join(EXPORT_DIR, f'{token}.batch.json')
+
+
+def _expire_batches():
+    """
+    Delete the batches (and any leftover temporary files) older than BATCH_EXPIRY_SECONDS,
+    and all but the newest MAX_PENDING_BATCHES batches.
+    """
+    now = time.time()
+    batches = []
+    for name in os.listdir(EXPORT_DIR):
+        path = os.path.join(EXPORT_DIR, name)
+        try:
+            mtime = os.path.getmtime(path)
+            if now - mtime > BATCH_EXPIRY_SECONDS:
+                os.remove(path)
+            elif name.endswith('.batch.json'):
+                batches.append((mtime, path))
+        except FileNotFoundError:
+            pass # taken by a download, or deleted by another process
+    batches.sort()
+    for _, path in batches[:max(len(batches) - MAX_PENDING_BATCHES, 0)]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def create_batch(items : list, fmt : str):
+    """
+    Register a batch export and return the URL from which its zip archive can be downloaded.
+
+    Parameters
+    ----------
+    items : list of (str, figure)
+       (file name without extension, figure) pairs.
+    fmt : str
+       One of EXPORT_FORMATS.
+
+    Returns
+    -------
+    str
+       The download URL. It can be used once.
+
+    Raises
+    ------
+    ValueError
+       If the format isn't supported or Kaleido isn't installed.
+    OSError
+       If the batch can't be written to EXPORT_DIR.
+    """
+    _check_format(fmt)
+    batch = {'format':fmt,
+             'items':[[name, fig.to_plotly_json() if hasattr(fig, 'to_plotly_json') else fig] for name, fig in items]}
+    data = to_json_plotly(batch)
+    token = uuid.uuid4().hex
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    _expire_batches()
+    # Write to a temporary file first, so a download never reads a partial batch.
+    fd, tmp_path = tempfile.mkstemp(dir=EXPORT_DIR, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(tmp_path, _batch_path(token))
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return BATCH_URL.format(token=token)
+
+
+def take_batch(token : str):
+    """
+    Return the batch registered under `token` (see create_batch()) and delete it, so that it's
+    downloaded only once; None if there's no such batch (any more).
+    """
+    if not _TOKEN_PATTERN.match(token):
+        return None
+    # Renaming the file is atomic, so of two concurrent downloads only one gets the batch.
+    taken_path = f'{_batch_path(token)}.{uuid.uuid4().hex}.taken'
+    try:
+        os.rename(_batch_path(token), taken_path)
+    except FileNotFoundError:
+        return None
+    try:
+        with open(taken_path, encoding='utf-8') as f:
+            return json.load(f)
+    finally:
+        os.remove(taken_path)
+
+
+class _ZipStream(io.RawIOBase):
+    """
+    Write-only, unseekable file object that collects what zipfile writes, so it can be sent as it's produced.
+    """
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(futures : list, fmt : str, pool=None):
+    """
+    Generator yielding a zip archive of the rendered figures, piece by piece, from (name, Future) pairs
+    (see submit_render()); each is written as soon as it (and those before it) are done.
+    A figure that fails to render gets a '<name>.<fmt>.error.txt' entry instead. If the download stops
+    early (e.g. the browser goes away), the renders not yet started are cancelled.
+    If `pool` (the renderer pool the figures were submitted to) breaks, it's replaced by the next export.
+    """
+    stream = _ZipStream()
+    used_names = set()
+    try:
+        with zipfile.ZipFile(stream, mode='w', compression=zipfile.ZIP_DEFLATED) as archive:
+            for name, future in futures:
+                filename = f'{safe_filename(name)}.{fmt}'
+                i = 2
+                while filename in used_names:
+                    filename = f'{safe_filename(name)}_{i}.{fmt}'
+                    i += 1
+                used_names.add(filename)
+                try:
+                    image = future.result()
+                except Exception as e: # whatever went wrong, report it in the archive rather than cut it short
+                    logger.warning('Rendering %s for a batch export failed. %s: %s', filename, type(e).__name__, e)
+                    if pool is not None and isinstance(e, BrokenProcessPool):
+                        _discard_renderer_pool(pool)
+                    archive.writestr(f'{filename}.error.txt',
+                                     f'This image could not be rendered ({type(e).__name__}: {e}).\n')
+                else:
+                    # PNG and PDF are already compressed.
+                    archive.writestr(filename, image,
+                                     compress_type=zipfile.ZIP_DEFLATED if fmt == 'svg' else zipfile.ZIP_STORED)
+                yield stream.drain()
+        yield stream.drain() # the archive's central directory
+    finally:
+        for _, future in futures:
+            future.cancel()
+
+
+def register_routes(server):
+    """
+    Add the export endpoints to the Flask server underlying the Dash app:
+
+    POST /export/figure?format=png|svg|pdf   body: a figure (JSON)  ->  the image
+    GET  /export/batch/<token>.zip           a batch registered with create_batch()  ->  zip archive (streamed)
+    """
+    @server.route('/export/figure', methods=['POST'])
+    def export_figure():
+        fmt = request.args.get('format', 'png')
+        fig = request.get_json(silent=True)
+        if not isinstance(fig, dict) or 'data' not in fig:
+            abort(400, 'Expected a figure, i.e. a JSON object with a "data" entry.')
+        try:
+            image = render_figure(fig, fmt)
+        except ValueError as e:
+            abort(400, str(e))
+        except RENDERER_ERRORS as e:
+            abort(503, f'The image renderer failed ({type(e).__name__}: {e}). Try again.')
+        return Response(image, mimetype=EXPORT_FORMATS[fmt],
+                        headers={'Content-Disposition':f'attachment; filename=figure.{fmt}'})
+
+    @server.route('/export/batch/<token>.zip')
+    def export_batch(token):
+        batch = take_batch(token)
+        if batch is None:
+            abort(404, 'This export has expired or was already downloaded.')
+        fmt = batch['format']
+        futures = []
+        try:
+            _check_format(fmt)
+            pool = _get_renderer_pool()
+            for name, fig in batch['items']:
+                futures.append((name, submit_render(fig, fmt)))
+        except (ValueError, *RENDERER_ERRORS) as e:
+            for _, future in futures:
+                future.cancel()
+            if isinstance(e, ValueError):
+                abort(400, str(e))
+            abort(503, f'The image renderer failed ({type(e).__name__}: {e}). Try exporting again.')
+        return Response(stream_with_context(stream_zip(futures, fmt, pool)),
+                        mimetype='application/zip',
+                        headers={'Content-Disposition':'attachment; filename=plots.zip'})
@@ -0,0 +1,133 @@
+import copy
+import threading
+from collections import OrderedDict
+
+MAX_CACHED_FIGURES = 32 # base figures kept in memory per server process
+MAX_CACHED_SORT_ORDERS = 64 # sorted bar plot data sets kept in memory per server process
+
+# ------- Begin figure cache ---------------
+#
+# Line plot figures as returned by utils.make_custom_multifaceted_line_plot(), i.e. before
+# the style map is applied, keyed by the parameters that determine them (see make_key()).
+# Least recently used first; the oldest entries are dropped beyond MAX_CACHED_FIGURES.
+_figures = OrderedDict()
+_lock = threading.Lock()
+_counters = {'hits':0, 'misses':0}
+#
+# ------- End figure cache -----------------
+
+# ------- Begin bar plot sort order cache ---------------
+#
+# The bar plot's data, sorted (utils.sort_bar_plot_data() returns the sorted DataFrame and the facet order),
+# keyed by the data set, the facets, the sort key, and the direction (see make_sort_key()).
+# The bar plot figure itself isn't cached, since it depends on the labels.
+_sort_orders = OrderedDict()
+#
+# ------- End bar plot sort order cache -----------------
+
+
+def make_key(dataset_key : str, props : list, group : str, display_meanSD : bool, slider_value : float,
+             variant : tuple=()):
+    """
+    Function to build the cache key for a line plot. Parameters that don't change the figure
+    are normalized away: the order in which the facets were checked, and the slider value
+    in replicate mode (the slider only spreads out mean ± SD points).
+    `variant` distinguishes figures built differently from the same data
+    (e.g. a single facet of the per-facet view, whose group colors follow the other facets).
+
+    Returns
+    -------
+    tuple, or None
+       None if there's no data set key, in which case the figure isn't cached.
+    """
+    if not dataset_key:
+        return None
+    dt = round(float(slider_value or 0), 6) if display_meanSD else 0.
+    return (dataset_key, tuple(sorted(props)), group, bool(display_meanSD), dt, *variant)
+
+
+def _copy_for_styling(fig_dict : dict):
+    # Styling replaces keys of individual traces (e.g. 'line'), so each trace gets its own dict;
+    # the (potentially large) data arrays inside the traces are shared, not copied.
+    return {'data':[dict(trace) for trace in fig_dict['data']],
+            'layout':copy.deepcopy(fig_dict['layout'])}
+
+
+def get(key : tuple):
+    """
+    Return a copy of the cached figure (a dict with 'data' and 'layout') for this key, or None.
+    Counts a hit or a miss.
+    """
+    with _lock:
+        fig_dict = _figures.get(key) if key is not None else None
+        if fig_dict is None:
+            _counters['misses'] += 1
+            return None
+        _figures.move_to_end(key)
+        _counters['hits'] += 1
+    return _copy_for_styling(fig_dict)
+
+
+def put(key : tuple, fig):
+    """
+    Cache a figure (a plotly Figure or its dict form) and return a copy of it for styling.
+    """
+    fig_dict = fig.to_plotly_json() if hasattr(fig, 'to_plotly_json') else fig
+    if key is not None:
+        with _lock:
+            _figures[key] = fig_dict
+            _figures.move_to_end(key)
+            while len(_figures) > MAX_CACHED_FIGURES:
+                _figures.popitem(last=False)
+    return _copy_for_styling(fig_dict)
+
+
+def make_sort_key(dataset_key : str, props : list, sorting_key : str, ascending : bool):
+    """
+    Function to build the cache key for a sorted bar plot data set. The order in which
+    the facets were checked doesn't matter. Returns None (not cached) if there's no data set key.
+    """
+    if not dataset_key:
+        return None
+    return (dataset_key, tuple(sorted(props)), sorting_key, bool(ascending))
+
+
+def get_sort_order(key : tuple):
+    """
+    Return the cached (sorted DataFrame, facet order) for this key, or None. Don't modify the DataFrame.
+    """
+    with _lock:
+        entry = _sort_orders.get(key) if key is not None else None
+        if entry is not None:
+            _sort_orders.move_to_end(key)
+        return entry
+
+
+def put_sort_order(key : tuple, df_sorted, props : list):
+    """
+    Cache a sorted bar plot data set (see utils.sort_bar_plot_data()) and return it, as (df_sorted, props).
+    """
+    if key is not None:
+        with _lock:
+            _sort_orders[key] = (df_sorted, props)
+            _sort_orders.move_to_end(key)
+            while len(_sort_orders) > MAX_CACHED_SORT_ORDERS:
+                _sort_orders.popitem(last=False)
+    return df_sorted, props
+
+
+def stats():
+    """
+    Return the cache's hit and miss counts and its current size.
+    """
+    with _lock:
+        return {**_counters, 'size':len(_figures)}
+
+
+def clear():
+    """
+    Empty the cache, including the bar plot sort orders (the counters are kept).
+    """
+    with _lock:
+        _figures.clear()
+        _sort_orders.clear()
@@ -0,0 +1,257 @@
+import contextvars
+import functools
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import dash
+import plotly.utils
+from dash.exceptions import PreventUpdate
+from flask import Response, g, has_request_context, request
+
+import figure_cache
+import render_scheduler
+
+# ------- Begin callback instrumentation ---------------
+#
+# Every callback in callbacks.py is registered with callback() below instead of dash.callback(),
+# which records, per callback: the number of calls and errors, the wall time of the call,
+# and the sizes of the request and response (i.e. of everything sent to and from the browser).
+# Within a callback, `with phase('name'):` times a part of the work (see update_line_plot()).
+# For the props in WATCHED_PROPS (the large Stores and the figures), the size of each prop is also
+# recorded, for a random PROP_SIZE_SAMPLE_RATE of the calls, since measuring it means serializing it again.
+#
+# Everything is exposed in Prometheus text format at /metrics (see register_routes()).
+# NOTE: Each server process (e.g. each gunicorn worker) keeps its own numbers,
+# so with several workers, each scrape of /metrics sees one of them.
+#
+# If DEBUG_PANEL is set (environment variable PLOTTING_PARTNER_DEBUG_PANEL=1, or `python app.py --timings`),
+# a table of the most recent calls is shown at the bottom of the page (see layout.debug_panel).
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10.) # seconds
+WATCHED_PROPS = ['lineplot-style-map.data', 'sample-to-label-map.data',
+                 'lineplot-graph-id.figure', 'barplot-graph-id.figure']
+PROP_SIZE_SAMPLE_RATE = 0.1
+MAX_RECENT_CALLS = 50
+DEBUG_PANEL = os.environ.get('PLOTTING_PARTNER_DEBUG_PANEL', '') not in ['', '0']
+
+_metrics = {'calls':{}, 'errors':{}, 'duration':{}, 'phase':{},
+            'request bytes':{}, 'response bytes':{}, 'prop bytes':{}}
+_recent = deque(maxlen=MAX_RECENT_CALLS)
+_lock = threading.Lock()
+_current = contextvars.ContextVar('current_callback', default=None)
+#
+# ------- End callback instrumentation -----------------
+
+
+def _observe(kind : str, labels : tuple, value : float, buckets : tuple=None):
+    """
+    Add an observation to a histogram (if `buckets` is given) or a summary (count and sum).
+    """
+    with _lock:
+        entry = _metrics[kind].get(labels)
+        if entry is None:
+            entry = _metrics[kind][labels] = {'count':0, 'sum':0., 'buckets':[0]*len(buckets or ())}
+        entry['count'] += 1
+        entry['sum'] += value
+        for i, bound in enumerate(buckets or ()):
+            if value <= bound:
+                entry['buckets'][i] += 1
+
+
+def _increment(kind : str, labels : tuple):
+    with _lock:
+        _metrics[kind][labels] = _metrics[kind].get(labels, 0) + 1
+
+
+@contextmanager
+def phase(name : str):
+    """
+    Context manager timing a phase of the callback that is running, e.g.
+
+    with instrumentation.phase('figure build'):
+        fig = ...
+
+    Outside of an instrumented callback, it does nothing.
+    """
+    call = _current.get()
+    if call is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        call['phases'][name] = call['phases'].get(name, 0.) + duration
+        _observe('phase', (call['callback'], name), duration, DURATION_BUCKETS)
+
+
+def callback(*args, **kwargs):
+    """
+    Drop-in replacement for dash.callback() that records timings and sizes (see above).
+    """
+    register = dash.callback(*args, **kwargs)
+    def decorator(func):
+        name = func.__name__
+        @functools.wraps(func)
+        def instrumented(*func_args, **func_kwargs):
+            call = {'callback':name, 'phases':{}}
+            token = _current.set(call)
+            start = time.perf_counter()
+            try:
+                return func(*func_args, **func_kwargs)
+            except PreventUpdate:
+                raise
+            except Exception:
+                _increment('errors', (name,))
+                raise
+            finally:
+                call['duration'] = time.perf_counter() - start
+                _current.reset(token)
+                _increment('calls', (name,))
+                _observe('duration', (name,), call['duration'], DURATION_BUCKETS)
+                if has_request_context():
+                    g.instrumented_call = call # completed in _after_request()
+                else:
+                    _recent.append(call)
+        return register(instrumented)
+    return decorator
+
+
+def _prop_sizes(items : list):
+    """
+    Sizes (bytes of JSON) of the watched props among the inputs or states of a callback request.
+    """
+    sizes = {}
+    for item in items or []:
+        for entry in item if isinstance(item, list) else [item]:
+            if not isinstance(entry.get('id'), str):
+                continue # pattern-matching ids aren't watched
+            prop = f"{entry['id']}.{entry['property']}"
+            if prop in WATCHED_PROPS:
+                sizes[prop] = len(json.dumps(entry.get('value'), cls=plotly.utils.PlotlyJSONEncoder))
+    return sizes
+
+
+def _before_request():
+    if request.path.endswith('_dash-update-component') and random.random() < PROP_SIZE_SAMPLE_RATE:
+        g.measure_props = True
+
+
+def _after_request(response):
+    call = g.pop('instrumented_call', None)
+    if call is None:
+        return response
+    name = call['callback']
+    call['request bytes'] = request.content_length or 0
+    call['response bytes'] = response.calculate_content_length() or 0
+    _observe('request bytes', (name,), call['request bytes'])
+    _observe('response bytes', (name,), call['response bytes'])
+    if g.pop('measure_props', False):
+        body = request.get_json(silent=True) or {}
+        for prop, size in _prop_sizes([*body.get('inputs', []), *body.get('state', [])]).items():
+            _observe('prop bytes', (name, prop, 'in'), size)
+        try:
+            outputs = json.loads(response.get_data()).get('response', {})
+        except ValueError:
+            outputs = {}
+        for id_, props in outputs.items():
+            for prop_name, value in props.items():
+                prop = f'{id_}.{prop_name}'
+                if prop in WATCHED_PROPS:
+                    _observe('prop bytes', (name, prop, 'out'), len(json.dumps(value)))
+    _recent.append(call)
+    return response
+
+
+def recent_calls():
+    """
+    Return the most recent calls (newest first), each a dict with 'callback', 'duration' (s),
+    'phases' (phase -> s), and, for calls made by the browser, 'request bytes' and 'response bytes'.
+    """
+    return list(reversed(_recent))
+
+
+def _escape(value : str):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names : tuple, values : tuple, extra : str=''):
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}'
+
+
+def prometheus_text():
+    """
+    Return all the metrics in the Prometheus text exposition format.
+    """
+    lines = []
+    def counter(metric, help_text, kind, names):
+        lines.extend([f'# HELP {metric} {help_text}', f'# TYPE {metric} counter'])
+        for labels, value in sorted(_metrics[kind].items()):
+            lines.append(f'{metric}{_labels(names, labels)} {value}')
+
+    def histogram(metric, help_text, kind, names, buckets=None):
+        lines.extend([f'# HELP {metric} {help_text}', f"# TYPE {metric} {'histogram' if buckets else 'summary'}"])
+        for labels, entry in sorted(_metrics[kind].items()):
+            for bound, count in zip(buckets or (), entry['buckets']):
+                le = 'le="%g"' % bound
+                lines.append(f'{metric}_bucket{_labels(names, labels, le)} {count}')
+            if buckets:
+                le = 'le="+Inf"'
+                lines.append(f"{metric}_bucket{_labels(names, labels, le)} {entry['count']}")
+            lines.append(f"{metric}_sum{_labels(names, labels)} {entry['sum']}")
+            lines.append(f"{metric}_count{_labels(names, labels)} {entry['count']}")
+
+    with _lock:
+        counter('plotting_partner_callback_calls_total', 'Callback calls.', 'calls', ('callback',))
+        counter('plotting_partner_callback_errors_total', 'Callback calls that raised an exception.',
+                'errors', ('callback',))
+        histogram('plotting_partner_callback_duration_seconds', 'Wall time of callback calls.',
+                  'duration', ('callback',), DURATION_BUCKETS)
+        histogram('plotting_partner_callback_phase_duration_seconds', 'Wall time of phases within callbacks.',
+                  'phase', ('callback', 'phase'), DURATION_BUCKETS)
+        histogram('plotting_partner_callback_request_bytes', 'Size of callback requests from the browser.',
+                  'request bytes', ('callback',))
+        histogram('plotting_partner_callback_response_bytes', 'Size of callback responses to the browser.',
+                  'response bytes', ('callback',))
+        histogram('plotting_partner_callback_prop_bytes',
+                  f'Size of watched props sent to (in) and from (out) callbacks; sampled ({PROP_SIZE_SAMPLE_RATE:g}).',
+                  'prop bytes', ('callback', 'prop', 'direction'))
+    cache = figure_cache.stats()
+    lines.extend(['# HELP plotting_partner_figure_cache_hits_total Line plot figure cache hits.',
+                  '# TYPE plotting_partner_figure_cache_hits_total counter',
+                  f"plotting_partner_figure_cache_hits_total {cache['hits']}",
+                  '# HELP plotting_partner_figure_cache_misses_total Line plot figure cache misses.',
+                  '# TYPE plotting_partner_figure_cache_misses_total counter',
+                  f"plotting_partner_figure_cache_misses_total {cache['misses']}",
+                  '# HELP plotting_partner_figure_cache_size Figures in the line plot figure cache.',
+                  '# TYPE plotting_partner_figure_cache_size gauge',
+                  f"plotting_partner_figure_cache_size {cache['size']}"])
+    renders = render_scheduler.stats()
+    lines.extend(['# HELP plotting_partner_renders_started_total Plot renders started.',
+                  '# TYPE plotting_partner_renders_started_total counter',
+                  f"plotting_partner_renders_started_total {renders['started']}",
+                  '# HELP plotting_partner_renders_superseded_total Plot renders dropped because a newer one started.',
+                  '# TYPE plotting_partner_renders_superseded_total counter',
+                  f"plotting_partner_renders_superseded_total {renders['superseded']}"])
+    return '\n'.join(lines) + '\n'
+
+
+def register_routes(server):
+    """
+    Add GET /metrics (Prometheus text format) to the Flask server underlying the Dash app,
+    and the request hooks that measure callback request and response sizes.
+    """
+    server.before_request(_before_request)
+    server.after_request(_after_request)
+
+    @server.route('/metrics')
+    def metrics():
+        return Response(prometheus_text(), mimetype='text/plain; version=0.0.4')
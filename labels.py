@@ -0,0 +1,269 @@
+import copy
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import utils
+
+# In dcc.Store(id='sample-to-label-map'), UNLABELED means "this sample carries the default label."
+# In dcc.Store(id='default-label'), UNLABELED means "no label is the default,"
+# in which case samples carrying the default label are shown in utils.LIGHT_GRAY.
+UNLABELED = -1
+MAX_CACHED_SESSIONS = 64 # LabelIndex objects kept in memory per server process
+
+# ------- Begin per-session label index cache ---------------
+#
+# One LabelIndex per browser session, most recently used last.
+# The dcc.Store components remain the source of truth: every callback that changes
+# the labeling writes a new value to dcc.Store(id='label-index-version'), and a cached
+# index whose version doesn't match that value gets rebuilt from the Stores.
+# A cached index is never changed in place, since callbacks of the same session can run at once
+# (in threads of the same process): get_label_index() returns a copy, and a callback that changes
+# the labeling caches its changed copy with set_label_index().
+_label_indexes = OrderedDict()
+_lock = threading.Lock()
+#
+# ------- End per-session label index cache -----------------
+
+"""
+   Labels are stored with one level of indirection: each sample stores the id of its label,
+   and each label stores its name and color. The label ids are positions in the lists
+   of the label table:
+
+   label_table = {'names':['label0_name', 'label1_name', ...],
+                  'colors':['label0_color', 'label1_color', ...]}
+
+   sample_to_label_map = {'id1':label_id_or_UNLABELED, 'id2':..., ...}
+
+   So renaming or recoloring a label only touches the label table, no matter how many samples
+   carry the label, and making a label the default only touches dcc.Store(id='default-label')
+   (plus the few samples that carried that label explicitly; see LabelIndex.set_default()).
+"""
+
+def new_label_table():
+    """
+    Return an empty label table.
+    """
+    return {'names':[], 'colors':[]}
+
+
+def resolve_label_id(label_id : int, default_label : int):
+    """
+    Return the id of the label actually carried by a sample whose stored label id is `label_id`.
+    """
+    return default_label if label_id == UNLABELED else label_id
+
+
+def label_color(label_id : int, label_table : dict):
+    """
+    Return the color (hex str) of a label (already resolved; see resolve_label_id()).
+    """
+    if label_id == UNLABELED:
+        return utils.LIGHT_GRAY
+    return label_table['colors'][label_id]
+
+
+def sample_color(sample : str, sample_to_label : dict, label_table : dict, default_label : int):
+    """
+    Return the color (hex str) in which a sample should be displayed.
+    """
+    return label_color(resolve_label_id(sample_to_label[sample], default_label), label_table)
+
+
+class LabelIndex:
+    """
+    Server-side copy of the labeling (the label table plus sample -> label id),
+    kept in numpy arrays so that changes to many samples at once are a handful of array operations.
+
+    Samples are kept in a sorted numpy array, so a subset of samples is located with a single
+    np.searchsorted() call, regardless of the size of the subset.
+
+    Parameters
+    ----------
+    samples : iterable of str
+       The sample IDs (Patient IDs, etc.).
+    label_table : dict, default : None
+       The label table (see above). Defaults to an empty table.
+    default_label : int, default : UNLABELED
+       The id of the default label.
+    """
+    def __init__(self, samples, label_table : dict=None, default_label : int=UNLABELED):
+        if label_table is None:
+            label_table = new_label_table()
+        self.samples = np.array(sorted(str(s) for s in samples), dtype=str)
+        self.sample_label_ids = np.full(len(self.samples), UNLABELED, dtype=np.int32)
+        self.label_names = list(label_table['names'])
+        self.label_colors = list(label_table['colors'])
+        self.default_label = default_label
+        self.version = 0
+
+    @classmethod
+    def from_stores(cls, sample_to_label : dict, label_table : dict, default_label : int):
+        """
+        Build an index from the contents of the dcc.Store components.
+
+        Parameters
+        ----------
+        sample_to_label : dict
+           A mapping from sample ID (str) to label id (int).
+        label_table : dict
+           The label table (see above).
+        default_label : int
+           The id of the default label.
+
+        Returns
+        -------
+        LabelIndex
+        """
+        index = cls(sample_to_label.keys(), label_table, default_label)
+        index.sample_label_ids = np.array([sample_to_label[s] for s in index.samples], dtype=np.int32)
+        return index
+
+    def copy(self):
+        """
+        Return a copy of the index that can be changed without changing this one.
+        The sorted array of samples, which never changes, is shared.
+        """
+        index = copy.copy(self)
+        index.sample_label_ids = self.sample_label_ids.copy()
+        index.label_names = list(self.label_names)
+        index.label_colors = list(self.label_colors)
+        return index
+
+    def label_table(self):
+        """
+        Return the label table (see above) as it currently stands in the index.
+        """
+        return {'names':list(self.label_names), 'colors':list(self.label_colors)}
+
+    def label_id(self, name : str):
+        """
+        Return the id of the label with the given name.
+
+        Raises
+        ------
+        ValueError
+           If there's no label with this name.
+        """
+        return self.label_names.index(name)
+
+    def add_label(self, name : str, color : str):
+        """
+        Define a new label and return its id.
+        """
+        self.label_names.append(name)
+        self.label_colors.append(color)
+        self.version += 1
+        return len(self.label_names) - 1
+
+    def edit_label(self, label_id : int, name : str, color : str):
+        """
+        Rename and/or recolor a label. This doesn't depend on how many samples carry the label.
+        """
+        self.label_names[label_id] = name
+        self.label_colors[label_id] = color
+        self.version += 1
+
+    def sample_colors(self, positions=None):
+        """
+        Return the colors of the samples at `positions` (default: all samples) as a numpy array.
+        """
+        # The palette's last entry is the color of unlabeled samples, so that UNLABELED (-1) indexes it.
+        palette = np.array([*self.label_colors, utils.LIGHT_GRAY], dtype=str)
+        ids = self.sample_label_ids if positions is None else self.sample_label_ids[positions]
+        return palette[np.where(ids == UNLABELED, self.default_label, ids)]
+
+    def positions_of(self, subset):
+        """
+        Return the positions (into self.samples) of the sample IDs in `subset`.
+        IDs that aren't in the index are ignored.
+        """
+        wanted = np.asarray(list(subset), dtype=str)
+        if len(wanted) == 0 or len(self.samples) == 0:
+            return np.array([], dtype=np.intp)
+        positions = np.searchsorted(self.samples, wanted)
+        positions[positions == len(self.samples)] = 0
+        return np.unique(positions[self.samples[positions] == wanted])
+
+    def assign(self, subset, label_id : int):
+        """
+        Assign a label to a subset of the samples.
+        A sample that receives the default label is stored as carrying UNLABELED,
+        so that it follows the default if the default label changes later.
+
+        Parameters
+        ----------
+        subset : iterable of str
+           The IDs of the samples that are to receive the label.
+        label_id : int
+           The id of the label.
+
+        Returns
+        -------
+        dict
+           The changes to make to the sample-to-label map (sample ID -> new label id).
+           Samples whose entries don't change are absent, so the dict is empty if nothing changed.
+           If anything changed, self.version is incremented.
+        """
+        stored_id = UNLABELED if label_id == self.default_label else label_id
+        positions = self.positions_of(subset)
+        positions = positions[self.sample_label_ids[positions] != stored_id]
+        self.sample_label_ids[positions] = stored_id
+        if len(positions) > 0:
+            self.version += 1
+        return dict.fromkeys(self.samples[positions].tolist(), stored_id)
+
+    def set_default(self, label_id : int):
+        """
+        Make a label the default label. Samples carrying the default label (stored as UNLABELED)
+        automatically take on the new default; samples that explicitly carried `label_id`
+        are now stored as carrying the default label too, so they stay with it if the default changes again.
+
+        Returns
+        -------
+        dict
+           The changes to make to the sample-to-label map (sample ID -> UNLABELED).
+           If the default label changed, self.version is incremented.
+        """
+        if label_id == self.default_label:
+            return {}
+        self.default_label = label_id
+        positions = np.flatnonzero(self.sample_label_ids == label_id)
+        self.sample_label_ids[positions] = UNLABELED
+        self.version += 1
+        return dict.fromkeys(self.samples[positions].tolist(), UNLABELED)
+
+
+def get_label_index(session_id : str, version : int, sample_to_label : dict, label_table : dict,
+                    default_label : int):
+    """
+    Return a copy of the LabelIndex for this browser session, rebuilding it from the Stores
+    if it isn't cached in this process or if it's out of date (its version differs from `version`).
+    The arguments after `version` are only used when a rebuild is needed; see LabelIndex.from_stores().
+    Changes to the copy aren't seen by other callbacks until it's cached with set_label_index().
+    """
+    version = version or 0
+    with _lock:
+        index = _label_indexes.get(session_id)
+        if index is not None and index.version == version:
+            _label_indexes.move_to_end(session_id)
+            return index.copy()
+    index = LabelIndex.from_stores(sample_to_label, label_table, default_label)
+    index.version = version
+    return set_label_index(session_id, index).copy()
+
+
+def set_label_index(session_id : str, index : LabelIndex):
+    """
+    Cache a LabelIndex for this browser session (e.g. one changed by a callback, or one restored
+    from a saved session; see sessions.py) and return it. Its version must match the value sent to
+    dcc.Store(id='label-index-version'). The index mustn't be changed once it's cached.
+    """
+    if session_id:
+        with _lock:
+            _label_indexes[session_id] = index
+            _label_indexes.move_to_end(session_id)
+            while len(_label_indexes) > MAX_CACHED_SESSIONS:
+                _label_indexes.popitem(last=False)
+    return index
@@ -1,6 +1,7 @@
 from dash import html, dcc
 import dash_bootstrap_components as dbc
 import utils
+import instrumentation
 
 #        1         2         3         4         5         6         7         8         9         0
 #234567890123456789012345678901234567890123456789012345678901234567890123456789012345678901234567890
@@ -236,6 +237,61 @@ err_msg_modal = dbc.Modal( \
      ],
                            id='err-modal', is_open=False)
 
+# Function for making a dropdown entry consisting of a color swatch followed by a name
+def make_labeled_option(name : str, color : str, search : str=None):
+    """
+    Function for making an entry for the 'options' of a dropdown of samples or labels:
+    a color swatch followed by the sample's (or label's) name.
+
+    Parameters
+    ----------
+    name : str
+       The sample ID or label name. This is also the option's 'value'.
+    color : str
+       The color (hex str) of the swatch.
+    search : str, default : None
+       The string the dropdown searches when the user types into it. Defaults to `name`.
+
+    Returns
+    -------
+    dict
+       A dropdown option with keys 'label', 'value', and 'search'.
+    """
+    return {'label':html.Span([html.Span('■', style={'color':color, 'font-size':36}),
+                               html.Span(name, style={'padding-left':6})]),
+            'value':name,
+            'search':name if search is None else search}
+
+
+# Function for making the placeholder of one facet in the per-facet ("one plot per y-axis") view of the line plot
+FACET_GRAPH_HEIGHT = 360 # pixels
+FACET_GRAPH_PENDING = 'lineplot-facet-pending' # className of a facet graph that hasn't been drawn yet
+
+def make_facet_graph_slot(facet : str):
+    """
+    Function for making the placeholder of one facet in the per-facet view of the line plot:
+    an empty graph of the final height, drawn by callbacks.render_visible_facets()
+    once it has scrolled into view.
+
+    Parameters
+    ----------
+    facet : str
+       The property shown in this facet (a value of the 'prop name' column), e.g. 'WBC (10^9 cells/L)'.
+
+    Returns
+    -------
+    html.Div
+       The Div holding the graph. Its 'data-facet' attribute is read by the
+       clientside callback that watches for facets scrolling into view.
+    """
+    empty_figure = {'data':[], 'layout':{'height':FACET_GRAPH_HEIGHT,
+                                         'xaxis':{'visible':False}, 'yaxis':{'visible':False}}}
+    return html.Div(dcc.Graph(id={'type':'lineplot-facet-graph', 'index':facet},
+                              figure=empty_figure, className=FACET_GRAPH_PENDING,
+                              style={'height':FACET_GRAPH_HEIGHT}),
+                    className='lineplot-facet-slot', **{'data-facet':facet})
+
+
 # Function for appending a row of dropdowns/etc. to the subset label assignment modal
 def make_query_row(input_rows : list, prop_names : list):
     """
@@ -289,23 +345,24 @@ def make_query_row(input_rows : list, prop_names : list):
 
 # Function for adding controls above line plots
 def add_lineplot_controls(radioitems_id : str, slider_id : str, slider_div_id : str,
-                          facets_checkbox_id : str, replicates_checkbox_id : str):
+                          facets_checkbox_id : str, replicates_checkbox_id : str, per_facet_checkbox_id : str,
+                          day_range_slider_id : str):
     return dbc.Container([dbc.Row([
         dbc.Col('', style={'color':'white'}, # was: 'spacer'
                 width=3),
         dbc.Col(html.Div([dbc.Label('show', style={'font-size':'120%'}),
                           dbc.RadioItems(id=radioitems_id,
-                                         options=[{'label':'all replicates', 'value':1},
-                                                  {'label':'mean ± SD', 'value':2},
-                                                  {'label':'any option TBD', 'value':3,
-                                                   'disabled':True}],
-                                         value=1,
+                                         options=[{'label':'all replicates', 'value':utils.LINEPLOT_REPLICATES},
+                                                  {'label':'mean ± SD', 'value':utils.LINEPLOT_MEAN_SD},
+                                                  {'label':'density', 'value':utils.LINEPLOT_DENSITY}],
+                                         value=utils.LINEPLOT_REPLICATES,
                                          style={'font-size':'120%'})]),
                 width=3),
         dbc.Col(html.Div([dbc.Label('Subtly spread the points horizontally',
                                     style={'font-size':'120%'}),
                           dcc.Slider(id=slider_id,
                                      min=0, max=0.08, step=0.01, value=0, marks=None,
+                                     updatemode='mouseup', # i.e. not on every step of a drag
                                      tooltip={'placement':'bottom'})
                           ], id=slider_div_id, hidden=True),
                 width=3),
@@ -316,8 +373,50 @@ def add_lineplot_controls(radioitems_id : str, slider_id : str, slider_div_id :
                  dbc.Checkbox(id=replicates_checkbox_id,
                               label=dcc.Markdown('One style per replicate',
                                                  style={'font-size':'120%'}),
+                              value=False),
+                 dbc.Checkbox(id=per_facet_checkbox_id,
+                              label=dcc.Markdown('One scrolling plot per $y$-axis', mathjax=True,
+                                                 style={'font-size':'120%'}),
                               value=False)],
-                width=3)])])
+                width=3)]),
+        # The range of days shown; its bounds are set when the data is loaded (see callbacks.load_fake_demo_data()).
+        dbc.Row([dbc.Col('', style={'color':'white'}, # spacer
+                         width=3),
+                 dbc.Col(html.Div([dbc.Label('days shown', style={'font-size':'120%'}),
+                                   dcc.RangeSlider(id=day_range_slider_id, min=0, max=1, value=[0, 1],
+                                                   step=None, allowCross=False, updatemode='mouseup',
+                                                   tooltip={'placement':'bottom'})]),
+                         width=6)])])
+
+
+def add_export_controls(format_id : str, button_id : str, batch_button_ids : dict=None):
+    """
+    Row of controls for downloading a plot as an image rendered on the server (see export.py):
+    a choice of format, a 'download' button, and optionally buttons for batch (zip) downloads.
+
+    Parameters
+    ----------
+    format_id : str
+       The id of the RadioItems for choosing PNG, SVG, or PDF.
+    button_id : str
+       The id of the button for downloading the plot as shown.
+    batch_button_ids : dict, default : None
+       Button text (str) -> id (str) of buttons for batch downloads.
+    """
+    batch_buttons = [dbc.Button(text, id=id_, n_clicks=0, outline=True, color='secondary',
+                                style={'margin-left':6})
+                     for text, id_ in (batch_button_ids or {}).items()]
+    return dbc.Container(dbc.Row([
+        dbc.Col('', style={'color':'white'}, # spacer
+                width=3),
+        dbc.Col(dbc.RadioItems(id=format_id,
+                               options=[{'label':fmt.upper(), 'value':fmt} for fmt in ['png', 'svg', 'pdf']],
+                               value='png', inline=True,
+                               style={'font-size':'120%'}),
+                width=2, align='center'),
+        dbc.Col([dbc.Button('Download', id=button_id, n_clicks=0, outline=True, color='secondary'),
+                 *batch_buttons],
+                width=7)]))
 
 
 lineplot_facet_and_groupBy_selector = html.Div( \
@@ -370,7 +469,31 @@ demo_welcome_banner = html.Div([html.Img(src='assets/PPpp.png', style={'height':
                                title=None) # 'title' --> exactly 1 call to callback
 
 
-master_layout = html.Div([new_cat_modal,
+session_controls = html.Div(dbc.Container(dbc.Row([ \
+                                dbc.Col(dbc.Button('Save session', id='save-session-button', n_clicks=0,
+                                                   outline=True, color='secondary'),
+                                        width=2),
+                                dbc.Col(dbc.Input(id='session-link', type='text', readonly=True,
+                                                  placeholder='Save the session to get a link that restores it'),
+                                        width=7),
+                                dbc.Col(html.Div('',style={'color':'white'}), # spacer
+                                        width=3)])),
+                            id='session-controls-div', hidden=True)
+
+
+# Optional table of recent callback timings (see instrumentation.py), refreshed every few seconds.
+debug_panel = html.Div([html.Div(dcc.Markdown('Recent callbacks (server time, ms):'),
+                                 style={'font-family':utils.DEFAULT_FONT_FAMILY,
+                                        'margin-left':utils.OPTIONAL_LEFT_MARGIN}),
+                        html.Div(id='debug-panel-table',
+                                 style={'font-family':'monospace', 'font-size':'90%',
+                                        'margin-left':utils.OPTIONAL_LEFT_MARGIN}),
+                        dcc.Interval(id='debug-panel-interval', interval=3000)],
+                       id='debug-panel-div')
+
+
+master_layout = html.Div([dcc.Location(id='url', refresh=False),
+                          new_cat_modal,
                           edit_cat_modal,
                           assign_label_modal,
                           subset_label_assignment_modal,
@@ -379,6 +502,7 @@ master_layout = html.Div([new_cat_modal,
                           html.Br(),
                           html.Br(),
                           demo_welcome_banner,
+                          session_controls,
                           html.Br(),
                           html.Div(html.Div(dcc.Markdown('Longitudinal plot:'),
                                             style={'font-family':utils.DEFAULT_FONT_FAMILY,
@@ -417,18 +541,37 @@ master_layout = html.Div([new_cat_modal,
                                         slider_div_id='lineplot-slider-div',
                                         facets_checkbox_id='lineplot-applyToFacets-checkbox',
                                         replicates_checkbox_id= \
-                                                        'lineplot-oneStylePerReplicate-checkbox'),
-                                    dcc.Graph(id='lineplot-graph-id')],
+                                                        'lineplot-oneStylePerReplicate-checkbox',
+                                        per_facet_checkbox_id='lineplot-perFacet-checkbox',
+                                        day_range_slider_id='lineplot-dayrange-slider'),
+                                    html.Div(dcc.Graph(id='lineplot-graph-id'), id='lineplot-graph-div'),
+                                    # Per-facet view: one graph per facet (see make_facet_graph_slot()),
+                                    # each drawn only once it scrolls into view.
+                                    html.Div(id='lineplot-facets-div', hidden=True,
+                                             style={'max-height':'80vh', 'overflow-y':'auto'}),
+                                    dcc.Store(id='lineplot-visible-facets', data=[]),
+                                    dcc.Store(id='lineplot-facet-view', data=None),
+                                    add_export_controls('lineplot-export-format', 'lineplot-export-button',
+                                                        {'Download each y-axis (.zip)':'lineplot-export-facets-button',
+                                                         'Download each grouping (.zip)':'lineplot-export-groupings-button'})],
                                    id='lineplot-div', hidden=True),
                           html.Br(),
                           html.Br(),
                           dcc.Store(id='dict-of-DFs', data=None),
-                          dcc.Store(id='lineplot-df-melted-dict', data=None),
+                          dcc.Store(id='dataset-key', data=None),
+                          dcc.Store(id='session-id', data=None),
+                          dcc.Store(id='label-index-version', data=0),
                           dcc.Store(id='lineplot-style-map', data=None),
-                          dcc.Store(id='metrics-dict', data=None),
-                          dcc.Store(id='sample-to-color-map', data=None),
-                          dcc.Store(id='sample-to-IsDefaultColor-map', data=None),
-                          dcc.Store(id='default-color', data=utils.LIGHT_GRAY),
+                          dcc.Store(id='sample-to-label-map', data=None),
+                          dcc.Store(id='label-table', data={'names':[], 'colors':[]}),
+                          dcc.Store(id='default-label', data=-1), # -1 == labels.UNLABELED
+                          dcc.Store(id='export-batch-url', data=None),
+                          dcc.Download(id='export-download'),
+                          dcc.Store(id='barplot-trace-map', data=None),
+                          dcc.Store(id='barplot-label-version', data=None), # the label-index-version the bar plot shows
+                          # In the windowed bar plot, the positions of the samples in view and of those sent
+                          # (see callbacks.update_barplot()): {'shown':[first, last], 'loaded':[first, last]}.
+                          dcc.Store(id='barplot-window-state', data=None),
                           dcc.Store(id='idx-of-parent-modal', data=0),
                           html.Div([html.Div(dcc.Markdown('Demographics plot:'),
                                              style={'font-family':utils.DEFAULT_FONT_FAMILY,
@@ -468,6 +611,8 @@ master_layout = html.Div([new_cat_modal,
                                             dbc.Col(html.Div('',style={'color':'white'}), # was: 'spacer'
                                                     width=8)]),
                                         dbc.Row(html.Div(dcc.Graph(id='barplot-graph-id'))),
+                                        dbc.Row(add_export_controls('barplot-export-format',
+                                                                    'barplot-export-button')),
                                         dbc.Row([ \
                                             dbc.Col('', style={'color':'white'}, # was: 'spacer 1'
                                                     width=3),
@@ -495,10 +640,36 @@ master_layout = html.Div([new_cat_modal,
                                                                            style={'font-size': \
                                                                                   '120%'}),
                                                                   value=False),
-                                                    width=3)])
+                                                    width=3)]),
+                                        dbc.Row([ \
+                                            dbc.Col('', style={'color':'white'}, # was: 'spacer 1'
+                                                    width=3),
+                                            dbc.Col(html.Div([dbc.Label('show', style={'font-size':'120%'}),
+                                                              dbc.RadioItems( \
+                                                                id='barplot-mode-radioitems',
+                                                                options=[{'label':'one bar per patient',
+                                                                          'value':utils.BARPLOT_SAMPLES},
+                                                                         {'label':'distribution (by label)',
+                                                                          'value':utils.BARPLOT_HISTOGRAM},
+                                                                         {'label':'a range of patients',
+                                                                          'value':utils.BARPLOT_WINDOW}],
+                                                                value=utils.BARPLOT_SAMPLES,
+                                                                style={'font-size':'120%'})]),
+                                                    width=3),
+                                            dbc.Col(html.Div([dbc.Label('patients shown (in sort order)',
+                                                                        style={'font-size':'120%'}),
+                                                              dcc.RangeSlider(id='barplot-window-slider',
+                                                                              min=0, max=utils.BAR_WINDOW_SIZE - 1,
+                                                                              step=1, allowCross=False, marks=None,
+                                                                              updatemode='mouseup',
+                                                                              value=[0, utils.BAR_WINDOW_SIZE - 1],
+                                                                              tooltip={'placement':'bottom'})],
+                                                             id='barplot-window-div', hidden=True),
+                                                    width=6)])
                                                 ])],
                                    id='barplot-div', hidden=True),
                           html.Br(),
                           html.Br(),
                           html.Br(),
-                          html.Br()])
+                          html.Br(),
+                          *([debug_panel] if instrumentation.DEBUG_PANEL else [])])
@@ -0,0 +1,194 @@
+import logging
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+
+logger = logging.getLogger(__name__)
+
+# ------- Begin facet-parallel figure building ---------------
+#
+# Below these sizes, building the whole figure in one px.line() call is faster
+# than shipping the facets to other processes.
+PARALLEL_MIN_FACETS = 8
+PARALLEL_MIN_ROWS = 50_000
+MAX_WORKERS = max(1, min(8, (os.cpu_count() or 1) - 1))
+
+# The pool is created on first use and reused. 'spawn' rather than 'fork',
+# because forking a multi-threaded web server can deadlock the child processes.
+_pool = None
+_pool_lock = threading.Lock()
+#
+# ------- End facet-parallel figure building -----------------
+
+
+def should_build_in_parallel(df : pd.DataFrame, facet_column : str='prop name'):
+    """
+    Return True if df is big enough (in rows and facets) to be worth building facet-by-facet
+    in the process pool, and there's more than one core to build it on.
+    """
+    return MAX_WORKERS > 1 and len(df) >= PARALLEL_MIN_ROWS \
+        and df[facet_column].nunique() >= PARALLEL_MIN_FACETS
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=MAX_WORKERS,
+                                        mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def _to_shared_memory(arrays : dict):
+    """
+    Copy numpy arrays into shared memory blocks.
+    Returns the blocks (the caller must close and unlink them) and the specs the workers need to attach.
+    """
+    blocks = []
+    specs = {}
+    for name, array in arrays.items():
+        block = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[:] = array
+        blocks.append(block)
+        specs[name] = (block.name, array.shape, array.dtype.str)
+    return blocks, specs
+
+
+def _build_facet_traces(specs : dict, categories : dict, facet_code : int, columns : dict, plot_options : dict):
+    """
+    Worker function: build the traces of one facet with px.line(), reading the data from shared memory.
+
+    Parameters
+    ----------
+    specs : dict
+       Shared memory specs from _to_shared_memory(), for arrays 'x', 'y', 'facet', 'line group', 'color'.
+    categories : dict
+       For 'facet', 'line group', and 'color', the values that the integer codes in the arrays stand for.
+    facet_code : int
+       The facet to build.
+    columns : dict
+       The DataFrame column names to use for 'x', 'y', 'facet', 'line group', and 'color',
+       so that the traces' hover templates match those of a single px.line() call.
+    plot_options : dict
+       Other keyword arguments for px.line().
+
+    Returns
+    -------
+    list of dict
+       The facet's traces, as plotly JSON-style dicts.
+    """
+    blocks = []
+    arrays = {}
+    try:
+        for name, (block_name, shape, dtype) in specs.items():
+            block = shared_memory.SharedMemory(name=block_name)
+            blocks.append(block)
+            arrays[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+        rows = np.flatnonzero(arrays['facet'] == facet_code)
+        df = pd.DataFrame({columns['x']:arrays['x'][rows],
+                           columns['y']:arrays['y'][rows],
+                           columns['facet']:categories['facet'][facet_code],
+                           columns['line group']:np.asarray(categories['line group'], dtype=object)[arrays['line group'][rows]],
+                           columns['color']:np.asarray(categories['color'], dtype=object)[arrays['color'][rows]]})
+        arrays.clear() # release the views before closing the blocks
+    finally:
+        for block in blocks:
+            block.close()
+    fig = px.line(df, x=columns['x'], y=columns['y'], facet_row=columns['facet'],
+                  line_group=columns['line group'], color=columns['color'], **plot_options)
+    return [trace.to_plotly_json() for trace in fig.data]
+
+
+def make_facet_parallel_line_plot(df_in : pd.DataFrame, x_column : str, line_group : str, agg_group : str,
+                                  color_sequence : list, height : int, group_order : list=None):
+    """
+    Function to build the same figure as
+    px.line(df_in, x=x_column, y='prop value', facet_row='prop name', line_group=line_group,
+            color=agg_group, color_discrete_sequence=color_sequence, height=height,
+            category_orders={agg_group:group_order})
+    by building each facet's traces in a separate process and assembling them.
+
+    The columns the traces need are copied once into shared memory (strings as integer codes),
+    so each worker only receives the names of the shared memory blocks and its facet's code.
+    The layout (subplots, axes, annotations, legend) comes from a px.line() call on one row per facet.
+
+    Returns
+    -------
+    Figure or None
+       None if the process pool isn't usable, a worker failed (this is logged), or x_column isn't numeric,
+       in which case the caller should build the figure directly.
+    """
+    if not pd.api.types.is_numeric_dtype(df_in[x_column]):
+        return None # only numeric arrays go into shared memory
+    facet_codes, facets = pd.factorize(df_in['prop name'])
+    line_codes, line_values = pd.factorize(df_in[line_group])
+    color_codes, color_values = pd.factorize(df_in[agg_group])
+    # Same color assignment as px.line(): the sequence, in the order of group_order,
+    # then of first appearance for groups not in group_order.
+    color_code_values = color_values.tolist()
+    rank = {val : i for i, val in enumerate(group_order or [])}
+    color_values = sorted(color_code_values, key=lambda val : rank.get(val, len(rank))) # stable
+    color_map = {val : color_sequence[i % len(color_sequence)] for i, val in enumerate(color_values)}
+    plot_options = {'color_discrete_map':color_map, 'height':height,
+                    'category_orders':{agg_group:color_values}}
+    columns = {'x':x_column, 'y':'prop value', 'facet':'prop name', 'line group':line_group, 'color':agg_group}
+    categories = {'facet':facets.tolist(), 'line group':line_values.tolist(), 'color':color_code_values}
+    blocks, specs = _to_shared_memory({'x':df_in[x_column].to_numpy(),
+                                       'y':df_in['prop value'].to_numpy(dtype=float),
+                                       'facet':facet_codes.astype(np.int32),
+                                       'line group':line_codes.astype(np.int32),
+                                       'color':color_codes.astype(np.int32)})
+    try:
+        pool = _get_pool()
+        futures = [pool.submit(_build_facet_traces, specs, categories, code, columns, plot_options)
+                   for code in range(len(facets))]
+        traces_per_facet = [future.result() for future in futures]
+    except Exception as e:
+        logger.warning('Building the line plot facet-by-facet failed; building it in one piece instead. %s: %s',
+                       type(e).__name__, e)
+        if isinstance(e, (BrokenProcessPool, OSError)):
+            _reset_pool()
+        return None
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    # Layout skeleton: px.line() on the first row of each facet, in order of appearance.
+    df_skeleton = df_in.drop_duplicates(subset='prop name')
+    fig = px.line(df_skeleton, x=x_column, y='prop value', facet_row='prop name',
+                  line_group=line_group, color=agg_group, **plot_options)
+    facet_axes = {}
+    for trace in fig.data:
+        facet = trace.hovertemplate.split('prop name=')[1].split('<br>')[0]
+        facet_axes[facet] = (trace.xaxis, trace.yaxis)
+    # Order the traces as px.line() would (by color group), showing each group in the legend once.
+    color_order = {str(val) : i for i, val in enumerate(color_values)} # px's legendgroup is str(value)
+    traces = []
+    for facet, facet_traces in zip(facets.tolist(), traces_per_facet):
+        for trace in facet_traces:
+            trace['xaxis'], trace['yaxis'] = facet_axes[facet]
+            traces.append(trace)
+    traces.sort(key=lambda trace : color_order.get(trace['legendgroup'], len(color_order)))
+    in_legend = set()
+    for trace in traces:
+        trace['showlegend'] = trace['legendgroup'] not in in_legend
+        in_legend.add(trace['legendgroup'])
+    fig.data = []
+    fig.add_traces(traces)
+    return fig
@@ -0,0 +1,289 @@
+import base64
+import gzip
+import logging
+import os
+
+import numpy as np
+import plotly.io
+from flask import request
+
+try:
+    from flask_compress import Compress
+except ImportError:
+    Compress = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# ------- Begin payload size control ---------------
+#
+# Callback responses (figures, records) are JSON, and JSON compresses very well (typically 5-10x).
+# Responses are compressed with flask-compress (Brotli or gzip, whichever the browser accepts)
+# if it's installed, and otherwise with gzip by _gzip_response() below.
+#
+# Independently of compression, a callback response larger than PAYLOAD_BUDGET_BYTES (uncompressed)
+# is logged as a warning naming its outputs, so that oversized transfers can be found and fixed.
+# The budget can be set with the environment variable PLOTTING_PARTNER_PAYLOAD_BUDGET (bytes).
+PAYLOAD_BUDGET_BYTES = int(os.environ.get('PLOTTING_PARTNER_PAYLOAD_BUDGET', 5_000_000))
+COMPRESS_MIN_BYTES = 1000    # smaller responses aren't worth compressing
+COMPRESS_LEVEL = 6           # gzip level: 6 is zlib's default tradeoff between speed and size
+COMPRESS_MIMETYPES = ['application/json', 'text/html', 'text/css', 'text/javascript',
+                      'application/javascript', 'image/svg+xml', 'text/plain']
+
+# Figure arrays (see trim_figure_precision()) are rounded to this many significant digits,
+# value by value, so small values in an array with large ones keep their digits;
+# e.g. 5.6000000000000005 is sent as 5.6.
+FIGURE_SIGNIFICANT_DIGITS = 6
+
+# Numeric figure arrays of at least TYPED_ARRAY_MIN_LENGTH values are sent as base64-encoded
+# typed arrays, {'dtype':'f8', 'bdata':'...'} (see encode_typed_arrays()), which Plotly.js reads
+# directly into a typed array instead of parsing a JSON list of numbers. Integer-valued arrays
+# (e.g. days) are sent in the smallest integer type that holds them. Once trimmed to
+# FIGURE_SIGNIFICANT_DIGITS (at most 7, which float32 holds), float arrays are sent as float32,
+# which is about a third smaller than their trimmed JSON text, unless they hold values outside
+# float32's normal range (which it can't hold to that precision); otherwise as float64.
+# The rest of each response is serialized with orjson, if it's installed (see register()).
+TYPED_ARRAY_MIN_LENGTH = 8
+TYPED_ARRAY_KEYS = ['x', 'y', 'z']
+TYPED_ARRAY_ERROR_KEYS = ['array', 'arrayminus'] # of 'error_x' and 'error_y'
+_INTEGER_DTYPES = [np.int8, np.uint8, np.int16, np.uint16, np.int32, np.uint32]
+#
+# ------- End payload size control -----------------
+
+
+def _gzip_response(response):
+    """
+    Flask after_request hook: gzip the response if the browser accepts it and it's worth it.
+    Used when flask-compress isn't installed.
+    """
+    if response.direct_passthrough or response.status_code < 200 or response.status_code >= 300 \
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESS_MIMETYPES \
+            or 'gzip' not in request.headers.get('Accept-Encoding', '').lower():
+        return response
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_BYTES:
+        return response
+    response.set_data(gzip.compress(data, compresslevel=COMPRESS_LEVEL))
+    response.headers['Content-Encoding'] = 'gzip'
+    response.headers['Content-Length'] = str(response.content_length)
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def _check_budget(response):
+    """
+    Flask after_request hook: log callback responses that exceed PAYLOAD_BUDGET_BYTES (uncompressed).
+    """
+    if not request.path.endswith('_dash-update-component') or response.direct_passthrough:
+        return response
+    size = response.calculate_content_length() or 0
+    if size > PAYLOAD_BUDGET_BYTES:
+        outputs = (request.get_json(silent=True) or {}).get('outputs', [])
+        outputs = outputs if isinstance(outputs, list) else [outputs]
+        logger.warning('Callback response of %.2f MB exceeds the payload budget of %.2f MB. Outputs: %s',
+                       size/1e6, PAYLOAD_BUDGET_BYTES/1e6,
+                       ', '.join(f"{output.get('id')}.{output.get('property')}" for output in outputs))
+    return response
+
+
+def register(server):
+    """
+    Set up response compression, the payload budget check, and orjson serialization (if available)
+    for the Flask server underlying the Dash app.
+    Call this before registering any other after_request hooks that read response bodies
+    (Flask runs the hooks in the reverse order of registration, so compression then comes last).
+    """
+    if orjson is not None:
+        # Dash serializes callback responses with plotly.io.json.to_json_plotly().
+        plotly.io.json.config.default_engine = 'orjson'
+    if Compress is not None:
+        server.config.setdefault('COMPRESS_MIMETYPES', COMPRESS_MIMETYPES)
+        server.config.setdefault('COMPRESS_MIN_SIZE', COMPRESS_MIN_BYTES)
+        server.config.setdefault('COMPRESS_LEVEL', COMPRESS_LEVEL)
+        Compress(server)
+    else:
+        server.after_request(_gzip_response)
+    server.after_request(_check_budget)
+
+
+def _is_typed_array(values):
+    return isinstance(values, dict) and 'bdata' in values and 'dtype' in values
+
+
+def _as_array(values):
+    """
+    Return `values` as a numpy array if it's a list, tuple, numpy array, or typed array
+    (see encode_typed_arrays()); otherwise return None.
+    """
+    if _is_typed_array(values):
+        array = np.frombuffer(base64.b64decode(values['bdata']), dtype=np.dtype(values['dtype']).newbyteorder('<'))
+        if values.get('shape'):
+            array = array.reshape([int(n) for n in str(values['shape']).split(',')])
+        return array
+    if isinstance(values, (list, tuple, np.ndarray)) and len(values) > 0:
+        return np.asarray(values)
+    return None
+
+
+def _trim_array(values, digits : int):
+    """
+    Return `values` with each value rounded to `digits` significant digits
+    if it's an array (or list, or typed array) of floats; otherwise return it unchanged.
+    """
+    array = _as_array(values)
+    if array is None or array.dtype.kind != 'f':
+        return values
+    array = array.astype(np.float64) # a copy
+    nonzero = np.isfinite(array) & (array != 0)
+    if not nonzero.any():
+        return values
+    to_trim = array[nonzero]
+    decimals = digits - 1 - np.floor(np.log10(np.abs(to_trim))).astype(int)
+    # Scale by exact powers of ten (10.**n is exact for 0 <= n <= 22, while 10.**-n isn't):
+    # multiply by them where decimals are kept, divide by them where digits left of the point are dropped.
+    scale = 10.**np.abs(decimals)
+    array[nonzero] = np.where(decimals >= 0, np.round(to_trim*scale)/scale, np.round(to_trim/scale)*scale)
+    return array
+
+
+def _fits_float32(array):
+    # Whether float32 holds every finite nonzero value of the array to about 7 significant digits.
+    magnitudes = np.abs(array[np.isfinite(array) & (array != 0)])
+    return len(magnitudes) == 0 or (np.finfo(np.float32).tiny <= magnitudes.min()
+                                    and magnitudes.max() < np.finfo(np.float32).max)
+
+
+def _encode_array(values, float_dtype=np.float64):
+    """
+    Return `values` as a typed array (a dict with 'dtype', 'bdata', and for 2D arrays 'shape')
+    if it's a numeric array of at least TYPED_ARRAY_MIN_LENGTH values; otherwise return it unchanged.
+    Non-integer floats are sent as `float_dtype` (float32 or float64) if it can hold them.
+    """
+    array = _as_array(values)
+    if array is None or array.size < TYPED_ARRAY_MIN_LENGTH or array.dtype.kind not in 'biuf' or array.ndim > 2:
+        return values
+    if array.dtype.kind == 'b':
+        array = array.astype(np.uint8)
+    if array.dtype.kind == 'f' and np.isfinite(array).all() and np.abs(array).max() < 2**31 \
+            and np.array_equal(array, np.round(array)):
+        array = array.astype(np.int64) # e.g. days; sent as integers below
+    if array.dtype.kind in 'iu':
+        low, high = array.min(), array.max()
+        for dtype in _INTEGER_DTYPES:
+            if np.iinfo(dtype).min <= low and high <= np.iinfo(dtype).max:
+                array = array.astype(dtype)
+                break
+        else:
+            array = array.astype(np.float64) # Plotly.js has no 64-bit integer arrays
+    elif float_dtype == np.float32 and _fits_float32(array):
+        array = array.astype(np.float32)
+    elif array.dtype != np.float32:
+        array = array.astype(np.float64)
+    array = np.ascontiguousarray(array, dtype=array.dtype.newbyteorder('<'))
+    typed_array = {'dtype':f'{array.dtype.kind}{array.dtype.itemsize}',
+                   'bdata':base64.b64encode(array.tobytes()).decode()}
+    if array.ndim == 2:
+        typed_array['shape'] = f'{array.shape[0]}, {array.shape[1]}'
+    return typed_array
+
+
+def _decode_array(values):
+    """
+    Inverse of _encode_array(): return a typed array as a list; return anything else unchanged.
+    """
+    if not _is_typed_array(values):
+        return values
+    return _as_array(values).tolist()
+
+
+def _map_trace_arrays(fig : dict, func):
+    # Apply func to each of the data arrays of each trace of the figure, in place.
+    for trace in fig.get('data', []):
+        for key in TYPED_ARRAY_KEYS:
+            if key in trace:
+                trace[key] = func(trace[key])
+        for key in ['error_x', 'error_y']:
+            error = trace.get(key)
+            if isinstance(error, dict):
+                for array_key in TYPED_ARRAY_ERROR_KEYS:
+                    if array_key in error:
+                        error[array_key] = func(error[array_key])
+    return fig
+
+
+def encode_typed_arrays(fig : dict, float_dtype=np.float64):
+    """
+    Replace the numeric data arrays of every trace of a figure (x, y, z, and error bars) by typed arrays,
+    in place. See TYPED_ARRAY_MIN_LENGTH.
+
+    Parameters
+    ----------
+    fig : dict
+       A figure in dict form (e.g. from Figure.to_plotly_json()).
+    float_dtype : numpy dtype, default : np.float64
+       The type in which non-integer floats are sent. np.float32 halves their size,
+       and loses nothing for arrays trimmed to 7 or fewer significant digits (see trim_figure_precision());
+       arrays with values outside float32's normal range are sent as float64 anyway.
+
+    Returns
+    -------
+    dict
+       fig
+    """
+    return _map_trace_arrays(fig, lambda values : _encode_array(values, float_dtype))
+
+
+def decode_typed_arrays(fig : dict):
+    """
+    Return a copy of a figure whose typed arrays (see encode_typed_arrays()) are replaced by lists,
+    e.g. for a figure sent back by the browser that is to be validated by plotly (which,
+    before plotly 6, doesn't accept typed arrays). The figure itself is left unchanged.
+
+    Returns
+    -------
+    dict
+       The copy of the figure (only its traces are copied; the data arrays that aren't typed arrays are shared).
+    """
+    data = []
+    for trace in fig.get('data', []):
+        trace = dict(trace)
+        for key in ['error_x', 'error_y']:
+            if isinstance(trace.get(key), dict):
+                trace[key] = dict(trace[key])
+        data.append(trace)
+    return _map_trace_arrays({**fig, 'data':data}, _decode_array)
+
+
+def trim_figure_precision(fig : dict, digits : int=FIGURE_SIGNIFICANT_DIGITS):
+    """
+    Round the float arrays of every trace of a figure (x, y, z, and error bars) to `digits` significant digits,
+    in place, so the figure's JSON doesn't carry float noise like 5.6000000000000005.
+
+    Parameters
+    ----------
+    fig : dict
+       A figure in dict form (e.g. from Figure.to_plotly_json()).
+    digits : int, default : FIGURE_SIGNIFICANT_DIGITS
+       The number of significant digits to keep, of each value.
+
+    Returns
+    -------
+    dict
+       fig
+    """
+    return _map_trace_arrays(fig, lambda values : _trim_array(values, digits))
+
+
+def compact_figure(fig):
+    """
+    Return a figure (a plotly Figure or its dict form) in dict form, ready to be sent to the browser:
+    its float arrays trimmed (trim_figure_precision()) and its numeric arrays encoded as typed arrays
+    (encode_typed_arrays()).
+    """
+    fig = fig.to_plotly_json() if hasattr(fig, 'to_plotly_json') else fig
+    float_dtype = np.float32 if FIGURE_SIGNIFICANT_DIGITS <= 7 else np.float64
+    return encode_typed_arrays(trim_figure_precision(fig), float_dtype)
@@ -0,0 +1,78 @@
+import threading
+from collections import OrderedDict
+
+# ------- Begin render scheduler ---------------
+#
+# Clicking through the bar plot's sort options or paging through the windowed bar plot sends a request
+# per event, and the browser only shows the response to the newest one (Dash ignores the rest).
+# Without this module, the server would still compute every one of them, in full.
+#
+# Instead, each render takes a ticket (begin()), which carries a generation number that increases
+# with every render of the same plot in the same browser session (see dcc.Store(id='session-id')).
+# A render whose ticket is no longer the newest has been superseded; it stops at the next check
+# (is_superseded()) and returns nothing. Bursts are also thinned out in the browser, so that no request
+# thread waits on them here: the sliders only send their value when released (updatemode='mouseup'; see layout.py).
+#
+# NOTE: Each server process (e.g. each gunicorn worker) keeps its own generation numbers,
+# so with several workers, superseded renders are only dropped when they reach the same process.
+MAX_TRACKED_SESSIONS = 1024 # (session, plot) pairs whose generation numbers are kept, most recent first
+
+# (session_id, plot) -> newest generation number
+_generations = OrderedDict()
+_lock = threading.Lock()
+_counters = {'started':0, 'superseded':0}
+#
+# ------- End render scheduler -----------------
+
+
+def begin(session_id : str, plot : str):
+    """
+    Start a render of `plot` (e.g. 'line plot') for a browser session, superseding any render
+    of the same plot for that session that's still running.
+
+    Parameters
+    ----------
+    session_id : str
+       The browser session's id (dcc.Store(id='session-id')). If None, the render is never superseded.
+    plot : str
+       Which plot is being rendered.
+
+    Returns
+    -------
+    dict
+       The render's ticket, for is_superseded().
+    """
+    key = (session_id, plot)
+    with _lock:
+        _counters['started'] += 1
+        if session_id is None:
+            return {'key':key, 'generation':None}
+        generation = _generations.get(key, 0) + 1
+        _generations[key] = generation
+        _generations.move_to_end(key)
+        while len(_generations) > MAX_TRACKED_SESSIONS:
+            _generations.popitem(last=False)
+    return {'key':key, 'generation':generation}
+
+
+def is_superseded(ticket : dict):
+    """
+    Return True if a newer render of the same plot has started for the same session
+    (and count the render as superseded).
+    """
+    if ticket['generation'] is None:
+        return False
+    with _lock:
+        newest = _generations.get(ticket['key'])
+        superseded = newest is not None and newest != ticket['generation']
+        if superseded:
+            _counters['superseded'] += 1
+    return superseded
+
+
+def stats():
+    """
+    Return the numbers of renders started and of renders dropped because they were superseded.
+    """
+    with _lock:
+        return dict(_counters)
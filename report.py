@@ -0,0 +1,296 @@
+"""
+Headless batch report generation: render many line and bar plots to image files
+plus an HTML index page, without the Dash app.
+
+Usage:
+    python report.py --specs specs.json --outdir report [--format png] [--workers 4]
+                     [--timeseries my_timeseries.csv] [--demographics my_demographics.csv]
+
+The data set defaults to the demo data in assets/.
+
+The specs file is JSON:
+
+{"group_by":["Treatment", "Home location"],       (optional; the columns samples can be grouped by)
+ "plots":[{"type":"line", "name":"coughs_central",
+           "title":"Coughs, Central WA",           (optional; defaults to name)
+           "facets":["Coughs (1/hour)", "Neutrophils (%)"],
+           "group":"Treatment",
+           "mode":"replicates", "mean_sd", or "density",
+           "spread":0.02,                           (optional; mean_sd only, see utils.xexpand_MeanAndSD_vs_Day())
+           "where":{"Home location":"Central WA"}}, (optional; keep only matching timeseries rows)
+          {"type":"bar", "name":"demographics",
+           "facets":["Age", "BMI"],
+           "sort_by":"Age",                         (optional; a facet or the sample column; default: first facet)
+           "ascending":false,                       (optional)
+           "hide_x_ticks":false,                    (optional)
+           "labels":[{"name":"Older", "color":"#E15759", "samples":["100040418", ...]},
+                     {"name":"High BMI", "color":"#4E79A7",
+                      "query":[["", "BMI", ">", "25", ""]]}], (same form as utils.process_subsetting_query())
+           "default_label":"Older",                 (optional; the label of samples not otherwise labeled)
+           "where":{"Treatment":["Placebo"]}},      (optional; keep samples with matching timeseries rows)
+          ...]}
+
+Labels are applied in order, so a sample matching several labels gets the last one.
+Each plot is written to <name>.<format> in the output directory, with characters other than letters, digits,
+'.', '_', and '-' replaced by '_'; a name used again gets a suffix ('coughs_central-2').
+"""
+import argparse
+import html
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import plotly.io as pio
+
+import datasets
+import derived_metrics
+import export
+import labels
+import utils
+
+ASSETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assets')
+DEFAULT_TIMESERIES = os.path.join(ASSETS_DIR, 'fake_timeseries_data.csv')
+DEFAULT_DEMOGRAPHICS = os.path.join(ASSETS_DIR, 'fake_demographic_data.csv')
+DEFAULT_GROUP_BY = ['Treatment', 'Home location']
+REPORT_FORMATS = ['png', 'svg', 'pdf', 'html'] # 'html' = interactive plot; doesn't need Kaleido
+
+# Each worker process loads the data once (see _init_worker()) and keeps it here.
+_data = {}
+
+
+def _init_worker(infile_timeseries : str, infile_demographics : str, group_by : list):
+    df_all, df_metrics = datasets.load_study(infile_timeseries, infile_demographics, group_by)
+    df_derived = derived_metrics.compute_derived_metrics(df_all, df_metrics.columns[0], 'Day')
+    _data['timeseries'] = df_all
+    _data['metrics'] = pd.concat([df_metrics, df_derived[df_metrics.columns]], ignore_index=True)
+    _data['group by'] = group_by
+
+
+def _apply_where(df : pd.DataFrame, where : dict):
+    """
+    Keep the rows of df whose values match `where`: column -> value or list of values.
+    """
+    for column, values in (where or {}).items():
+        if column not in df.columns:
+            raise ValueError(f"Column '{column}' in 'where' was not found in the timeseries data.")
+        if not isinstance(values, list):
+            values = [values]
+        df = df[df[column].isin(values)]
+    return df
+
+
+def make_line_plot(spec : dict, df_all : pd.DataFrame):
+    """
+    Build the line plot described by a plot specification (see above).
+    """
+    group = spec['group']
+    if group not in df_all.columns:
+        raise ValueError(f"Group '{group}' was not found in the timeseries data.")
+    mode = spec.get('mode', 'replicates')
+    if mode not in ['replicates', 'mean_sd', 'density']:
+        raise ValueError(f"Unknown line plot mode '{mode}'. Use 'replicates', 'mean_sd', or 'density'.")
+    df = _apply_where(df_all, spec.get('where'))
+    df_facets = df[df['prop name'].isin(spec['facets'])]
+    df_facets = df_facets[df_facets['prop value'].notna()].reset_index(drop=True)
+    if len(df_facets) == 0:
+        raise ValueError('No data was found for these facets.')
+    if mode == 'density':
+        return utils.make_density_line_plot(df_facets, x_column='Day', line_group=df_all.columns[0], agg_group=group)
+    return utils.make_custom_multifaceted_line_plot(df_facets, x_column='Day', line_group=df_all.columns[0],
+                                                    agg_group=group, display_meanSD=(mode == 'mean_sd'),
+                                                    dt=spec.get('spread', 0))
+
+
+def make_bar_plot(spec : dict, df_metrics : pd.DataFrame, df_all : pd.DataFrame):
+    """
+    Build the bar plot described by a plot specification (see above), including its labels.
+    """
+    x_column = df_metrics.columns[0] # e.g. 'Patient ID'
+    df = df_metrics
+    if spec.get('where'):
+        samples = _apply_where(df_all, spec['where'])[df_all.columns[0]].unique()
+        df = df[df[x_column].isin(samples)]
+    props = spec['facets']
+    df_facets = df[df['prop name'].isin(props)].dropna(how='any', ignore_index=True, axis=0)
+    if len(df_facets) == 0:
+        raise ValueError('No data was found for these facets.')
+    sorting_key = spec.get('sort_by', props[0])
+    if sorting_key != x_column and sorting_key not in df_facets['prop name'].unique():
+        raise ValueError(f"Cannot sort by '{sorting_key}'; it's not one of the facets.")
+    df_final, props = utils.sort_bar_plot_data(df_facets, x_column, sorting_key, spec.get('ascending', False))
+
+    label_table = labels.new_label_table()
+    label_map = dict.fromkeys(df[x_column].unique().tolist(), labels.UNLABELED)
+    for label in spec.get('labels', []):
+        label_table['names'].append(label['name'])
+        label_table['colors'].append(label['color'])
+        label_id = len(label_table['names']) - 1
+        if 'query' in label:
+            subset = utils.process_subsetting_query(label['query'], df)
+        else:
+            subset = label.get('samples', [])
+        for sample in subset:
+            if str(sample) in label_map:
+                label_map[str(sample)] = label_id
+    default_label = labels.UNLABELED
+    if spec.get('default_label'):
+        if spec['default_label'] not in label_table['names']:
+            raise ValueError(f"Default label '{spec['default_label']}' is not one of the labels.")
+        default_label = label_table['names'].index(spec['default_label'])
+    resolved_label_map = {sample : labels.resolve_label_id(label_id, default_label)
+                          for sample, label_id in label_map.items()}
+    return utils.make_custom_multifaceted_bar_plot(df_final, props, resolved_label_map, label_table,
+                                                   x_column, spec.get('hide_x_ticks', False))
+
+
+def file_stems(plots : list):
+    """
+    Return the file name (without extension) of each plot: its 'name', made safe (see export.safe_filename())
+    and unique among the plots by a suffix ('-2', '-3', ...), or '' if nothing usable is left of it.
+    """
+    stems, taken = [], set()
+    for spec in plots:
+        stem = export.safe_filename(spec.get('name', 'plot'), default='')
+        if stem:
+            base, i = stem, 1
+            while stem.lower() in taken:
+                i += 1
+                stem = f'{base}-{i}'
+            taken.add(stem.lower())
+        stems.append(stem)
+    return stems
+
+
+def render_plot(spec : dict, outdir : str, fmt : str, stem : str):
+    """
+    Build one plot and write it to outdir as `stem`.`fmt` (see file_stems()).
+    Runs in a worker process (see _init_worker()).
+
+    Returns
+    -------
+    dict
+       'name', 'title', and either 'file' (the file name within outdir) or 'error' (a message).
+    """
+    name = spec.get('name', 'plot')
+    result = {'name':name, 'title':spec.get('title', name)}
+    try:
+        if not stem:
+            raise ValueError(f"The name '{name}' can't be used as a file name.")
+        if spec.get('type') == 'line':
+            fig = make_line_plot(spec, _data['timeseries'])
+        elif spec.get('type') == 'bar':
+            fig = make_bar_plot(spec, _data['metrics'], _data['timeseries'])
+        else:
+            raise ValueError(f"Unknown plot type '{spec.get('type')}'. Use 'line' or 'bar'.")
+        fig.update_layout(title_text=result['title'])
+        filename = f'{stem}.{fmt}'
+        path = os.path.join(outdir, filename)
+        if fmt == 'html':
+            fig.write_html(path, include_plotlyjs='cdn')
+        else:
+            pio.write_image(fig, path, format=fmt, scale=2 if fmt == 'png' else 1)
+        result['file'] = filename
+    except Exception as e:
+        result['error'] = f'{type(e).__name__}: {e}'
+    return result
+
+
+def write_index(results : list, outdir : str, fmt : str, title : str='Plotting Partner report'):
+    """
+    Write index.html, showing (or linking to) every plot in the order of the specifications.
+    """
+    parts = [f'<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>{html.escape(title)}</title>',
+             f'<style>body{{font-family:{utils.DEFAULT_FONT_FAMILY};margin:2rem}} img,iframe{{max-width:100%}}'
+             '.error{color:#E15759}</style></head><body>',
+             f'<h1>{html.escape(title)}</h1>']
+    for result in results:
+        parts.append(f'<h2 id="{html.escape(result["name"])}">{html.escape(result["title"])}</h2>')
+        if 'error' in result:
+            parts.append(f'<p class="error">Not rendered: {html.escape(result["error"])}</p>')
+            continue
+        src = html.escape(result['file'])
+        if fmt in ['png', 'svg']:
+            parts.append(f'<img src="{src}" alt="{html.escape(result["title"])}">')
+        elif fmt == 'html':
+            parts.append(f'<iframe src="{src}" width="100%" height="600" frameborder="0"></iframe>')
+        else:
+            parts.append(f'<p><a href="{src}">{src}</a></p>')
+    parts.append('</body></html>\n')
+    path = os.path.join(outdir, 'index.html')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(parts))
+    return path
+
+
+def make_report(specs : dict, outdir : str, fmt : str='png', workers : int=None,
+                infile_timeseries : str=DEFAULT_TIMESERIES, infile_demographics : str=DEFAULT_DEMOGRAPHICS):
+    """
+    Render every plot in `specs` (see above) to outdir, in parallel worker processes,
+    and write an HTML index.
+
+    Parameters
+    ----------
+    specs : dict
+       The plot specifications.
+    outdir : str
+       The output directory; created if necessary.
+    fmt : str, default : 'png'
+       One of REPORT_FORMATS.
+    workers : int, default : None
+       The number of worker processes. None means one per core; 1 means "render in this process."
+    infile_timeseries, infile_demographics : str
+       The data set; see datasets.load_study().
+
+    Returns
+    -------
+    list of dict
+       One result per plot; see render_plot().
+    """
+    if fmt not in REPORT_FORMATS:
+        raise ValueError(f"Unsupported format '{fmt}'. Choose one of {', '.join(REPORT_FORMATS)}.")
+    if fmt != 'html' and not export.kaleido_available():
+        raise ValueError(f"Writing {fmt.upper()} files requires the 'kaleido' package. Install it, or use --format html.")
+    os.makedirs(outdir, exist_ok=True)
+    plots = specs.get('plots', [])
+    initargs = (infile_timeseries, infile_demographics, specs.get('group_by', DEFAULT_GROUP_BY))
+    workers = workers or os.cpu_count() or 1
+    _init_worker(*initargs) # load the data here first, so a bad file is reported once, before any work starts
+    stems = file_stems(plots) # here, not in the workers, so two plots can't be given the same file
+    if workers == 1 or len(plots) <= 1:
+        results = [render_plot(spec, outdir, fmt, stem) for spec, stem in zip(plots, stems)]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(plots)),
+                                 initializer=_init_worker, initargs=initargs) as pool:
+            results = list(pool.map(render_plot, plots, [outdir]*len(plots), [fmt]*len(plots), stems))
+    write_index(results, outdir, fmt)
+    return results
+
+
+def main(argv : list=None):
+    parser = argparse.ArgumentParser(description='Render line and bar plots to files, with an HTML index.')
+    parser.add_argument('--specs', help='JSON file of plot specifications (see report.py)', required=True)
+    parser.add_argument('--outdir', help='output directory', default='report')
+    parser.add_argument('--format', help='image format', choices=REPORT_FORMATS, default='png')
+    parser.add_argument('--workers', help='number of worker processes (default: one per core)', type=int)
+    parser.add_argument('--timeseries', help='timeseries CSV file', default=DEFAULT_TIMESERIES)
+    parser.add_argument('--demographics', help='demographics CSV file', default=DEFAULT_DEMOGRAPHICS)
+    args = parser.parse_args(argv)
+    with open(args.specs, encoding='utf-8') as f:
+        specs = json.load(f)
+    try:
+        results = make_report(specs, args.outdir, args.format, args.workers,
+                              args.timeseries, args.demographics)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    failed = [r for r in results if 'error' in r]
+    for r in failed:
+        print(f"{r['name']}: {r['error']}", file=sys.stderr)
+    print(f'Rendered {len(results) - len(failed)} of {len(results)} plots to {args.outdir}.')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
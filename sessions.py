@@ -0,0 +1,265 @@
+import hashlib
+import json
+import os
+import re
+import struct
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+# ------- Begin session snapshots ---------------
+#
+# A snapshot is everything the user has done to the plots (labels, line colors, plot settings),
+# saved on the server under a random token so that the session can be restored from a URL
+# (?session=<token>) after a reload, in another browser, or by a colleague.
+#
+# Snapshots are written as files to SNAPSHOT_DIR, so every server process on the machine
+# (e.g. every gunicorn worker) can read them; the most recently used ones are also kept
+# in memory, decoded, so restoring a session is a single lookup.
+# Snapshots older than SNAPSHOT_EXPIRY_SECONDS, or beyond the newest MAX_SNAPSHOT_FILES, are deleted
+# whenever a snapshot is saved, so a link stops working after a while.
+#
+# File format (all integers little-endian):
+#
+#    b'PPSS'             magic
+#    uint16              format version (SNAPSHOT_VERSION)
+#    uint32              length of the header
+#    header              zlib-compressed JSON (see encode_snapshot())
+#    label ids           zlib-compressed array of each sample's stored label id, in sorted sample order
+#                        (the order of labels.LabelIndex.samples); dtype given in the header
+SNAPSHOT_MAGIC = b'PPSS'
+SNAPSHOT_VERSION = 1
+SNAPSHOT_DIR = os.environ.get('PLOTTING_PARTNER_SESSION_DIR',
+                              os.path.join(tempfile.gettempdir(), 'plotting_partner_sessions'))
+MAX_CACHED_SNAPSHOTS = 64 # decoded snapshots kept in memory per server process
+MAX_SNAPSHOT_FILES = 10000 # snapshots kept in SNAPSHOT_DIR, by all server processes
+SNAPSHOT_EXPIRY_SECONDS = 30*24*60*60
+
+_snapshots = OrderedDict()
+_lock = threading.Lock()
+_PREFIX = struct.Struct('<4sHI')
+_TOKEN_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+#
+# ------- End session snapshots -----------------
+
+"""
+   A snapshot, in its decoded form:
+
+   snapshot = {'dataset key':'0123456789abcdef',    (see datasets.make_dataset_key())
+               'samples digest':'...',              (see samples_digest())
+               'label table':{'names':[...], 'colors':[...]},
+               'default label':label_id_or_UNLABELED,
+               'label ids':np.ndarray,              (one stored label id per sample, in sorted sample order)
+               'style map':{...} or None,           (see utils.add_group_to_style_map())
+               'line plot':{'facets':[...], 'group':'Treatment', 'mode':1, 'spread':0.0, 'days':[0.0, 6.0],
+                            'apply to facets':True, 'one style per replicate':False},
+               'bar plot':{'facets':[...], 'sort by':'Age', 'ascending':0, 'hide x ticks':False}
+              }
+"""
+
+
+def samples_digest(samples):
+    """
+    Return a short digest of the sorted sample IDs, used to check that a snapshot's label ids
+    line up with the samples of the data set it's restored into.
+    """
+    h = hashlib.sha1()
+    for sample in sorted(str(s) for s in samples):
+        h.update(sample.encode())
+        h.update(b'\n')
+    return h.hexdigest()[:16]
+
+
+def _compact_style_map(style_map : dict, samples_string : str='Sample IDs'):
+    """
+    Replace every line style in the style map by its position in a list of the distinct styles.
+    There are typically only a few dozen distinct styles, but one per (sample, grouping, facet).
+    """
+    styles = []
+    positions = {}
+    def intern(style):
+        key = json.dumps(style, sort_keys=True)
+        if key not in positions:
+            positions[key] = len(styles)
+            styles.append(style)
+        return positions[key]
+
+    compact = {}
+    for key, entries in style_map.items():
+        if key == samples_string:
+            compact[key] = {sample : {**entry,
+                                      'facets':{group : {facet : intern(style) for facet, style in facets.items()}
+                                                for group, facets in entry['facets'].items()}}
+                            for sample, entry in entries.items()}
+        else:
+            compact[key] = {value : {**entry,
+                                     'facets':{facet : intern(style) for facet, style in entry['facets'].items()}}
+                            for value, entry in entries.items()}
+    return {'styles':styles, 'map':compact, 'samples string':samples_string}
+
+
+def _expand_style_map(compact : dict):
+    """
+    Inverse of _compact_style_map().
+    """
+    styles = compact['styles']
+    samples_string = compact['samples string']
+    style_map = {}
+    for key, entries in compact['map'].items():
+        if key == samples_string:
+            style_map[key] = {sample : {**entry,
+                                        'facets':{group : {facet : dict(styles[i]) for facet, i in facets.items()}
+                                                  for group, facets in entry['facets'].items()}}
+                              for sample, entry in entries.items()}
+        else:
+            style_map[key] = {value : {**entry,
+                                       'facets':{facet : dict(styles[i]) for facet, i in entry['facets'].items()}}
+                              for value, entry in entries.items()}
+    return style_map
+
+
+def encode_snapshot(snapshot : dict):
+    """
+    Serialize a snapshot (see above) to bytes.
+    The label ids are stored in the smallest integer type that holds them.
+    """
+    label_ids = np.asarray(snapshot['label ids'])
+    dtype = np.int8 if len(snapshot['label table']['names']) < 127 else np.int32
+    header = {key : value for key, value in snapshot.items() if key not in ['label ids', 'style map']}
+    header['style map'] = _compact_style_map(snapshot['style map']) if snapshot.get('style map') else None
+    header['label ids dtype'] = np.dtype(dtype).str
+    header['num samples'] = len(label_ids)
+    header_bytes = zlib.compress(json.dumps(header, separators=(',', ':')).encode())
+    return _PREFIX.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(header_bytes)) + header_bytes \
+        + zlib.compress(label_ids.astype(dtype).tobytes())
+
+
+def decode_snapshot(data : bytes):
+    """
+    Deserialize a snapshot written by encode_snapshot().
+
+    Raises
+    ------
+    ValueError
+       If the data isn't a snapshot, or was written in a format version this code can't read.
+    """
+    if len(data) < _PREFIX.size:
+        raise ValueError('This is not a saved session.')
+    magic, version, header_length = _PREFIX.unpack_from(data)
+    if magic != SNAPSHOT_MAGIC:
+        raise ValueError('This is not a saved session.')
+    if version > SNAPSHOT_VERSION:
+        raise ValueError('This session was saved by a newer version of the app and cannot be restored.')
+    try:
+        start = _PREFIX.size
+        header = json.loads(zlib.decompress(data[start:start + header_length]))
+        label_ids = np.frombuffer(zlib.decompress(data[start + header_length:]),
+                                  dtype=np.dtype(header.pop('label ids dtype')))
+    except (zlib.error, ValueError, KeyError) as e:
+        raise ValueError(f'This saved session is damaged ({e}).')
+    if len(label_ids) != header.pop('num samples'):
+        raise ValueError('This saved session is damaged (wrong number of samples).')
+    header['label ids'] = label_ids.astype(np.int32)
+    if header.get('style map'):
+        header['style map'] = _expand_style_map(header['style map'])
+    return header
+
+
+def _path(token : str):
+    return os.path.join(SNAPSHOT_DIR, f'{token}.ppss')
+
+
+def _remember(token : str, snapshot : dict):
+    with _lock:
+        _snapshots[token] = snapshot
+        _snapshots.move_to_end(token)
+        while len(_snapshots) > MAX_CACHED_SNAPSHOTS:
+            _snapshots.popitem(last=False)
+
+
+def _forget(token : str):
+    with _lock:
+        _snapshots.pop(token, None)
+
+
+def _expire_snapshots():
+    """
+    Delete the snapshots (and any leftover temporary files) older than SNAPSHOT_EXPIRY_SECONDS,
+    and all but the newest MAX_SNAPSHOT_FILES snapshots.
+    """
+    now = time.time()
+    snapshots = []
+    for name in os.listdir(SNAPSHOT_DIR):
+        path = os.path.join(SNAPSHOT_DIR, name)
+        token, extension = os.path.splitext(name)
+        try:
+            mtime = os.path.getmtime(path)
+            if now - mtime > SNAPSHOT_EXPIRY_SECONDS:
+                os.remove(path)
+                _forget(token)
+            elif extension == '.ppss':
+                snapshots.append((mtime, token, path))
+        except FileNotFoundError:
+            pass # deleted by another process
+    snapshots.sort()
+    for _, token, path in snapshots[:max(len(snapshots) - MAX_SNAPSHOT_FILES, 0)]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        _forget(token)
+
+
+def save_snapshot(snapshot : dict):
+    """
+    Write a snapshot (see above) to SNAPSHOT_DIR and return its token.
+    """
+    data = encode_snapshot(snapshot)
+    token = uuid.uuid4().hex
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    # Write to a temporary file first, so other processes never read a partial snapshot.
+    fd, tmp_path = tempfile.mkstemp(dir=SNAPSHOT_DIR, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, _path(token))
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    _expire_snapshots()
+    # Keep what was written, not the caller's snapshot, whose arrays and dicts may be changed later
+    # (e.g. the sample_label_ids of the caller's copy of the session's LabelIndex).
+    _remember(token, decode_snapshot(data))
+    return token
+
+
+def load_snapshot(token : str):
+    """
+    Return the snapshot saved under `token`.
+
+    Raises
+    ------
+    ValueError
+       If there's no such snapshot, or it can't be read (see decode_snapshot()).
+    """
+    if not token or not _TOKEN_PATTERN.match(token):
+        raise ValueError('The link does not refer to a saved session.')
+    with _lock:
+        snapshot = _snapshots.get(token)
+        if snapshot is not None:
+            _snapshots.move_to_end(token)
+            return snapshot
+    try:
+        with open(_path(token), 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        raise ValueError('This saved session was not found on the server. It may have expired or been deleted.')
+    snapshot = decode_snapshot(data)
+    _remember(token, snapshot)
+    return snapshot
@@ -0,0 +1,239 @@
+import atexit
+import os
+import shutil
+import tempfile
+import threading
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+try:
+    import fcntl # not available on Windows, where the app isn't served by gunicorn anyway
+except ImportError:
+    fcntl = None
+
+# ------- Begin shared (cross-process) data set cache ---------------
+#
+# When the app is served by several processes (e.g. `gunicorn -w 4 app:server`), each process
+# would otherwise read and melt the same CSV files and keep its own copy of the result.
+# Instead, the first process to load a data set writes its tables to uncompressed Arrow IPC files
+# under SHARED_DIR/<data set key>/, and every process (including the first) memory-maps them.
+# The operating system then keeps a single copy of the numeric columns in its page cache,
+# shared by all processes. String columns (sample IDs, property names, group values, ...) are
+# written as Arrow dictionary arrays and mapped back as pandas Categoricals: their codes are shared
+# like the numeric columns, and only the (small) dictionaries of distinct strings are copied into
+# Python objects in each process.
+#
+# Reference counting: each process that holds a data set has a file named after its process ID
+# in SHARED_DIR/<data set key>/holders/. When a process releases a data set (see release()) and no
+# live process holds it any more, the data set's files are deleted. Processes that died without
+# releasing are detected (their process ID no longer exists) and don't count.
+# Beyond MAX_SHARED_DATASETS, data sets that no process holds are deleted, oldest first.
+SHARED_DIR = os.environ.get('PLOTTING_PARTNER_SHARED_DIR',
+                            os.path.join(tempfile.gettempdir(), 'plotting_partner_shared'))
+MAX_SHARED_DATASETS = 8
+
+# Data sets held by this process: dataset_key -> {'count':int, 'tables':{name:DataFrame}}
+_held = {}
+_lock = threading.Lock()
+#
+# ------- End shared (cross-process) data set cache -----------------
+
+
+class _DirectoryLock:
+    """
+    Exclusive lock (between processes) on SHARED_DIR, held while data sets are written or deleted.
+    """
+    def __enter__(self):
+        os.makedirs(SHARED_DIR, exist_ok=True)
+        self._file = open(os.path.join(SHARED_DIR, '.lock'), 'a')
+        if fcntl is not None:
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        if fcntl is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._file.close()
+
+
+def _dataset_dir(dataset_key : str):
+    return os.path.join(SHARED_DIR, dataset_key)
+
+
+def _holders_dir(dataset_key : str):
+    return os.path.join(_dataset_dir(dataset_key), 'holders')
+
+
+def _is_alive(pid : int):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True # exists, but belongs to someone else
+    return True
+
+
+def holders(dataset_key : str):
+    """
+    Return the IDs of the live processes holding a data set. Files left by dead processes are removed.
+    """
+    try:
+        names = os.listdir(_holders_dir(dataset_key))
+    except FileNotFoundError:
+        return []
+    pids = []
+    for name in names:
+        if not name.isdigit():
+            continue
+        if _is_alive(int(name)):
+            pids.append(int(name))
+        else:
+            try:
+                os.remove(os.path.join(_holders_dir(dataset_key), name))
+            except FileNotFoundError:
+                pass
+    return pids
+
+
+def _to_arrow(df : pd.DataFrame):
+    """
+    Convert a DataFrame to an Arrow table whose columns can be memory-mapped back without copying:
+    floats keep NaN as a value (rather than becoming Arrow nulls, which would need converting back),
+    and any other column becomes a dictionary array (codes into the column's distinct values, as strings),
+    which maps back to a pandas Categorical whose codes are a view of the file.
+    """
+    columns = {}
+    for column in df.columns:
+        values = df[column]
+        if pd.api.types.is_numeric_dtype(values) and not isinstance(values.dtype, pd.CategoricalDtype):
+            columns[column] = pa.array(values.to_numpy(), from_pandas=False)
+        else:
+            categorical = pd.Categorical(values.astype(object).where(values.notna(), None))
+            categories = [str(category) for category in categorical.categories]
+            codes = categorical.codes
+            columns[column] = pa.DictionaryArray.from_arrays(pa.array(codes, mask=codes < 0),
+                                                             pa.array(categories, type=pa.string()))
+    return pa.table(columns)
+
+
+def _write_table(path : str, df : pd.DataFrame):
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with pa.OSFile(tmp_path, 'wb') as sink:
+        table = _to_arrow(df)
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+
+
+def _map_table(path : str):
+    with pa.memory_map(path, 'r') as source:
+        table = pa.ipc.open_file(source).read_all()
+    # The numeric columns of the DataFrame, and the codes of its Categoricals, are views of the mapped file
+    # (which stays mapped as long as they exist, even if the file is deleted).
+    return table.to_pandas(split_blocks=True, self_destruct=False)
+
+
+def _evict_unheld(keep : str):
+    """
+    Delete the files of data sets no live process holds, oldest first, until at most
+    MAX_SHARED_DATASETS remain. Called with the directory lock held.
+    """
+    keys = [name for name in os.listdir(SHARED_DIR)
+            if name != keep and os.path.isdir(_dataset_dir(name))]
+    if len(keys) < MAX_SHARED_DATASETS:
+        return
+    keys.sort(key=lambda key : os.path.getmtime(_dataset_dir(key)))
+    for key in keys[:len(keys) - MAX_SHARED_DATASETS + 1]:
+        if not holders(key):
+            shutil.rmtree(_dataset_dir(key), ignore_errors=True)
+
+
+def acquire(dataset_key : str, builder):
+    """
+    Return the tables of a data set, memory-mapped from the shared cache,
+    calling `builder()` to build them (and writing them to the cache) if no process has yet.
+    The calling process counts as a holder of the data set until it calls release() as often
+    as it called acquire().
+
+    Parameters
+    ----------
+    dataset_key : str
+       The key of the data set; see datasets.make_dataset_key().
+    builder : callable
+       Returns a dict of table name (str) -> DataFrame.
+
+    Returns
+    -------
+    dict
+       Table name (str) -> DataFrame. Don't modify the DataFrames in place;
+       their numeric columns are read-only views of the shared files.
+    """
+    with _lock:
+        if dataset_key in _held:
+            _held[dataset_key]['count'] += 1
+            return dict(_held[dataset_key]['tables'])
+    directory = _dataset_dir(dataset_key)
+    with _DirectoryLock():
+        if not os.path.exists(os.path.join(directory, 'tables')):
+            tables = builder() # errors propagate, and nothing is written
+            _evict_unheld(keep=dataset_key)
+            os.makedirs(_holders_dir(dataset_key), exist_ok=True)
+            for name, df in tables.items():
+                _write_table(os.path.join(directory, f'{name}.arrow'), df)
+            with open(os.path.join(directory, 'tables'), 'w', encoding='utf-8') as f:
+                f.write('\n'.join(tables))
+        os.makedirs(_holders_dir(dataset_key), exist_ok=True)
+        open(os.path.join(_holders_dir(dataset_key), str(os.getpid())), 'w').close()
+        with open(os.path.join(directory, 'tables'), encoding='utf-8') as f:
+            names = f.read().split('\n')
+        tables = {name : _map_table(os.path.join(directory, f'{name}.arrow')) for name in names}
+    with _lock:
+        entry = _held.setdefault(dataset_key, {'count':0, 'tables':tables})
+        entry['count'] += 1
+        return dict(entry['tables'])
+
+
+def release(dataset_key : str):
+    """
+    Undo one acquire() of a data set by this process. When this process no longer holds it
+    and no other live process does either, the data set's shared files are deleted.
+    """
+    with _lock:
+        entry = _held.get(dataset_key)
+        if entry is None:
+            return
+        entry['count'] -= 1
+        if entry['count'] > 0:
+            return
+        del _held[dataset_key]
+    with _DirectoryLock():
+        try:
+            os.remove(os.path.join(_holders_dir(dataset_key), str(os.getpid())))
+        except FileNotFoundError:
+            pass
+        if not holders(dataset_key):
+            shutil.rmtree(_dataset_dir(dataset_key), ignore_errors=True)
+
+
+@atexit.register
+def _release_all():
+    # A process that exits stops holding its data sets (the files are deleted if it was the last holder).
+    with _lock:
+        keys = list(_held)
+        for key in keys:
+            _held[key]['count'] = 1
+    for key in keys:
+        release(key)
+
+
+def is_shared(df : pd.DataFrame, column : str):
+    """
+    Return True if a column of a DataFrame returned by acquire() is a view of the shared file
+    (rather than a private copy); for a Categorical, if its codes are. Useful for checking a deployment.
+    """
+    values = df[column]
+    values = values.cat.codes.to_numpy() if isinstance(values.dtype, pd.CategoricalDtype) else values.to_numpy()
+    return not values.flags.owndata and not values.flags.writeable and np.issubdtype(values.dtype, np.number)
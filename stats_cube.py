@@ -0,0 +1,222 @@
+import numpy as np
+import pandas as pd
+
+# Multiplier for the half-width of a (normal-approximation) 95% confidence interval.
+Z_95 = 1.959963984540054
+
+"""
+   A "statistics cube" holds, for every grouping the user can choose in the line plot
+   (every option in the 'group by' dropdown), the count, mean, and sum of squared deviations
+   from the mean ('m2') of 'prop value' per (group value, Day, property):
+
+   cube = {'Treatment':DataFrame(index=[Treatment, Day, 'prop name'],
+                                 columns=['count', 'mean', 'm2']),
+           'Home location':DataFrame(...), ...
+          }
+
+   These three numbers are all that's needed for mean, SD, SEM, and confidence intervals,
+   so switching the grouping or the facets only selects rows of the cube;
+   the (melted) timeseries data isn't traversed again.
+   (The sum and sum of squares are count*mean and m2 + count*mean**2.)
+
+   Storing m2 rather than the sum of squares lets cubes built from separate chunks of data
+   be combined exactly (Chan et al.'s parallel form of Welford's algorithm; see StatsCubeBuilder),
+   without the loss of precision that sumsq - sum**2/count suffers when the SD is small
+   relative to the mean.
+
+   The app builds the cube from the study's melted tables, which it has in memory anyway (build_stats_cube()).
+   Feeding a StatsCubeBuilder chunk by chunk (e.g. with build_stats_cube_from_csv()), and merging builders
+   fed by different processes, is for data sets too large to hold in memory; the app doesn't do that yet.
+"""
+
+def _chunk_moments(df : pd.DataFrame, group : str, x_column : str):
+    """
+    Return count/mean/m2 per (group value, x_column value, 'prop name') for one chunk of data.
+    """
+    grouped = df.groupby([group, x_column, 'prop name'], sort=False, observed=True)['prop value']
+    moments = pd.DataFrame({'count':grouped.count(), 'mean':grouped.mean(), 'm2':grouped.var(ddof=0)})
+    moments['m2'] = moments['m2']*moments['count']
+    return moments
+
+
+def _combine_moments(a : pd.DataFrame, b : pd.DataFrame):
+    """
+    Combine two count/mean/m2 DataFrames (Chan et al.). Rows present in only one of them are kept as is.
+    """
+    a, b = a.align(b, join='outer', fill_value=0)
+    count = a['count'] + b['count']
+    delta = b['mean'] - a['mean']
+    combined = pd.DataFrame({'count':count.astype(np.int64),
+                             'mean':a['mean'] + delta*b['count']/count,
+                             'm2':a['m2'] + b['m2'] + delta*delta*a['count']*b['count']/count})
+    return combined
+
+
+class StatsCubeBuilder:
+    """
+    Streaming builder of a statistics cube (see above).
+
+    Feed it the melted timeseries data one chunk at a time with update(); each chunk is reduced to
+    count/mean/m2 per cell right away, so only the (small) cube is held between chunks.
+    Builders fed different parts of a data set (e.g. in different processes) can be combined
+    with merge(); the result is the same, up to rounding, as feeding one builder all of the data,
+    and the means and SDs match those of DataFrame.groupby(...).agg(['mean', 'std']).
+
+    Parameters
+    ----------
+    group_columns : list of str
+       The columns by which the user can group the data (the options in the 'group by' dropdown).
+    x_column : str, default : 'Day'
+       The name of the column holding the x-axis data.
+    """
+    def __init__(self, group_columns : list, x_column : str='Day'):
+        self.group_columns = list(group_columns)
+        self.x_column = x_column
+        self.cube = dict.fromkeys(self.group_columns)
+
+    def update(self, df_chunk : pd.DataFrame):
+        """
+        Add a chunk of melted timeseries data (columns x_column, 'prop name', 'prop value',
+        and every group column). Rows with a missing (NaN) 'prop value' are not counted.
+        Returns self.
+        """
+        df = df_chunk[[*self.group_columns, self.x_column, 'prop name', 'prop value']]
+        df = df.dropna(subset=['prop value'])
+        if len(df) == 0:
+            return self
+        for group in self.group_columns:
+            moments = _chunk_moments(df, group, self.x_column)
+            if self.cube[group] is not None:
+                moments = _combine_moments(self.cube[group], moments)
+            self.cube[group] = moments
+        return self
+
+    def merge(self, other : 'StatsCubeBuilder'):
+        """
+        Fold in the data seen by another builder with the same group columns. Returns self.
+        """
+        for group in self.group_columns:
+            if other.cube.get(group) is None:
+                continue
+            if self.cube[group] is None:
+                self.cube[group] = other.cube[group].copy()
+            else:
+                self.cube[group] = _combine_moments(self.cube[group], other.cube[group])
+        return self
+
+    def result(self):
+        """
+        Return the statistics cube (see above), with each DataFrame sorted by its index.
+        """
+        cube = {}
+        for group in self.group_columns:
+            moments = self.cube[group]
+            if moments is None:
+                index = pd.MultiIndex.from_arrays([[], [], []], names=[group, self.x_column, 'prop name'])
+                moments = pd.DataFrame({'count':[], 'mean':[], 'm2':[]}, index=index)
+            cube[group] = moments.sort_index()
+        return cube
+
+
+def build_stats_cube(df_in : pd.DataFrame, group_columns : list, x_column : str='Day'):
+    """
+    Function to build the statistics cube (see above) for a melted timeseries DataFrame
+    that's already in memory.
+
+    Parameters
+    ----------
+    df_in : pd.DataFrame
+       The melted timeseries data. Contains columns x_column, 'prop name', 'prop value',
+       and every column in group_columns.
+    group_columns : list of str
+       The columns by which the user can group the data (the options in the 'group by' dropdown).
+    x_column : str, default : 'Day'
+       The name of the column holding the x-axis data.
+
+    Returns
+    -------
+    dict
+       A mapping from group column (str) to a DataFrame of count/mean/m2 (see above).
+       Rows with a missing (NaN) 'prop value' are not counted.
+    """
+    return StatsCubeBuilder(group_columns, x_column).update(df_in).result()
+
+
+def build_stats_cube_from_csv(path : str, id_columns : list, group_columns : list, x_column : str='Day',
+                              chunksize : int=100_000):
+    """
+    Function to build the statistics cube directly from a (wide) timeseries CSV file,
+    reading and melting it chunksize rows at a time, so the whole file is never in memory.
+
+    Parameters
+    ----------
+    path : str
+       The CSV file. One row per (sample, Day); one column per property.
+    id_columns : list of str
+       The columns that aren't properties, e.g. ['Patient ID', 'Day', 'Treatment', 'Home location'].
+    group_columns : list of str
+       The columns by which the user can group the data.
+    x_column : str, default : 'Day'
+       The name of the column holding the x-axis data.
+    chunksize : int, default : 100_000
+       The number of CSV rows read at a time.
+
+    Returns
+    -------
+    dict
+       The statistics cube; see build_stats_cube().
+    """
+    builder = StatsCubeBuilder(group_columns, x_column)
+    for chunk in pd.read_csv(path, chunksize=chunksize):
+        value_vars = [col for col in chunk.columns if col not in id_columns]
+        builder.update(chunk.melt(id_vars=id_columns, value_vars=value_vars,
+                                  var_name='prop name', value_name='prop value'))
+    return builder.result()
+
+
+def summarize(cube : dict, group : str, props : list=None, x_range : tuple=None):
+    """
+    Function to compute mean, SD, SEM, and the half-width of a 95% confidence interval
+    per (group value, Day, property) from the statistics cube.
+
+    Parameters
+    ----------
+    cube : dict
+       The statistics cube; see build_stats_cube().
+    group : str
+       The grouping chosen by the user, e.g. 'Treatment'.
+    props : list of str, default : None
+       The properties to include (the facets of the plot). None means "all properties."
+    x_range : tuple of float, default : None
+       The (low, high) x_column values (e.g. days) to include, inclusive. None means "all of them."
+
+    Returns
+    -------
+    pd.DataFrame
+       Columns [group, x_column, 'prop name', 'count', 'mean', 'std', 'sem', 'ci95'], sorted by
+       [group, x_column, 'prop name'] (the order DataFrame.groupby() would produce).
+       'std' is the sample SD (ddof=1) and is 0 where count is 1, as are 'sem' and 'ci95'.
+
+    Raises
+    ------
+    ValueError
+       If the cube doesn't contain the requested grouping.
+    """
+    if group not in cube:
+        raise ValueError(f"No summary statistics were computed for grouping '{group}'.")
+    moments = cube[group]
+    if props is not None:
+        moments = moments[moments.index.get_level_values('prop name').isin(props)]
+    if x_range is not None:
+        x = moments.index.get_level_values(1) # the x_column level
+        moments = moments[(x >= x_range[0]) & (x <= x_range[1])]
+    df = moments.reset_index()
+    count = df['count'].to_numpy(dtype=float)
+    m2 = df['m2'].to_numpy(dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        std = np.where(count > 1, np.sqrt(m2/(count - 1)), 0.)
+    df = df.drop(columns=['m2'])
+    df['std'] = std
+    df['sem'] = std/np.sqrt(count)
+    df['ci95'] = Z_95*df['sem']
+    return df
@@ -0,0 +1,37 @@
+import os
+import sys
+from contextvars import copy_context
+
+import pytest
+from dash._callback_context import context_value
+from dash._utils import AttributeDict
+
+# The app's modules live at the top level of the repository.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app # registers the layout and the callbacks
+
+
+def call_callback(func, *args, triggered : str='test.n_clicks', num_outputs : int=10, outputs_list : list=None):
+    """
+    Call a Dash callback function directly, with a minimal callback context
+    (ctx.triggered_id is the component id in `triggered`, and len(ctx.outputs_list) is num_outputs,
+    unless `outputs_list` is given); see also benchmark._call_callback().
+    """
+    def call():
+        context_value.set(AttributeDict(triggered_inputs=[{'prop_id':triggered, 'value':1}],
+                                        outputs_list=outputs_list or [{}]*num_outputs,
+                                        inputs_list=[], states_list=[], args_grouping=[]))
+        return func(*args)
+    return copy_context().run(call)
+
+
+@pytest.fixture
+def session_dir(tmp_path, monkeypatch):
+    """
+    Save session snapshots to a temporary directory, with an empty in-memory cache.
+    """
+    import sessions
+    monkeypatch.setattr(sessions, 'SNAPSHOT_DIR', str(tmp_path))
+    monkeypatch.setattr(sessions, '_snapshots', type(sessions._snapshots)())
+    return tmp_path
@@ -0,0 +1,29 @@
+import callbacks
+import utils
+
+
+def test_windows_are_clamped_to_the_samples():
+    assert callbacks._clamp_window(None, 10_000) == (0, utils.BAR_WINDOW_SIZE - 1)
+    assert callbacks._clamp_window(None, 50) == (0, 49)
+    assert callbacks._clamp_window([-20, 30], 100) == (0, 30)
+    assert callbacks._clamp_window([90, 130.6], 100) == (90, 99)
+    assert callbacks._clamp_window([150, 180], 100) == (99, 99) # panned past the last sample
+    assert callbacks._clamp_window([5, 10], 0) == (0, 0)
+
+
+def test_a_window_too_wide_is_narrowed_around_its_center(monkeypatch):
+    monkeypatch.setattr(utils, 'BAR_WINDOW_MAX_SIZE', 100)
+    assert callbacks._clamp_window([0, 999], 10_000) == (450, 549)
+    assert callbacks._clamp_window([-500, 499], 10_000) == (0, 49) # the narrowed window still starts at 0
+    assert callbacks._clamp_window([0, 99], 10_000) == (0, 99)
+
+
+def test_pans_and_zooms_of_the_x_axes_give_the_new_range():
+    loaded = [100, 399]
+    assert callbacks._relayout_x_range({'xaxis.autorange':True}, loaded) == (99.5, 399.5)
+    assert callbacks._relayout_x_range({'xaxis2.range':[250, 120.5]}, loaded) == (120.5, 250.)
+    assert callbacks._relayout_x_range({'xaxis3.range[0]':10, 'xaxis3.range[1]':40}, loaded) == (10., 40.)
+    assert callbacks._relayout_x_range({'xaxis.range[0]':10}, loaded) is None
+    assert callbacks._relayout_x_range({'yaxis.range':[0, 5], 'yaxis.autorange':True}, loaded) is None
+    assert callbacks._relayout_x_range({'xaxis.autorange':False, 'dragmode':'pan'}, loaded) is None
+    assert callbacks._relayout_x_range(None, loaded) is None
@@ -0,0 +1,27 @@
+import numpy as np
+import pandas as pd
+
+import utils
+
+
+def test_bin_counts_match_numpy_histogram():
+    rng = np.random.default_rng(0)
+    props = ['Age', 'BMI', 'Constant']
+    samples = [f's{i}' for i in range(200)]
+    df = pd.DataFrame({'sample':samples*3, 'prop name':np.repeat(props, len(samples)),
+                       'prop value':np.concatenate([rng.normal(50, 10, 200), rng.uniform(18, 30, 200), np.full(200, 3.)])})
+    sample_to_label_id = {sample:i % 2 for i, sample in enumerate(samples[:50])} # the rest are unlabeled
+    label_table = {'names':['Even', 'Odd'], 'colors':['#E15759', '#4E79A7']}
+    fig = utils.make_binned_bar_plot(df, props, sample_to_label_id, label_table, 'sample', bins=12)
+
+    for i, prop in enumerate(props):
+        axis = 'y' if i == 0 else f'y{i + 1}'
+        traces = [trace for trace in fig.data if trace.yaxis == axis]
+        assert {trace.legendgroup for trace in traces} == {'-1', '0', '1'}
+        values = df.loc[df['prop name'] == prop, 'prop value'].to_numpy()
+        expected, edges = np.histogram(values, bins=12, range=(values.min(), values.max() if np.ptp(values) else values.min() + 1))
+        np.testing.assert_array_equal(np.sum([trace.y for trace in traces], axis=0), expected)
+        np.testing.assert_allclose(traces[0].x, (edges[:-1] + edges[1:])/2)
+        odd = next(trace for trace in traces if trace.legendgroup == '1')
+        assert odd.y.sum() == 25 and odd.name == 'Odd'
+    assert fig.layout.barmode == 'stack'
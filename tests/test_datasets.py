@@ -0,0 +1,95 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+from dash import no_update
+
+import callbacks
+import datasets
+import shared_datasets
+from conftest import call_callback
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_a_process_that_has_not_loaded_the_study_loads_it_by_key():
+    dataset_key = datasets.register_study(*callbacks.DEMO_STUDY)
+    datasets.drop_dataset(dataset_key) # as in a server process that didn't serve load_fake_demo_data()
+    outputs = call_callback(callbacks.update_line_plot, 1, 1, 0.02, False, None, None, ['Coughs (1/hour)'],
+                            'Treatment', callbacks.DEMO_STUDY[2], dataset_key, None,
+                            triggered='render-lineplot-button.n_clicks', num_outputs=9)
+    assert outputs[-1] is no_update
+    assert outputs[1]['data']
+    assert datasets.get_cached(dataset_key, 'shared tables') is not None
+
+
+def test_an_unknown_key_is_reported():
+    hidden, err_msg = call_callback(callbacks.hide_bar_plot, 'no-such-key', num_outputs=2)
+    assert hidden is no_update
+    assert 'no longer available' in err_msg
+
+
+def test_string_columns_are_shared_as_categoricals(tmp_path, monkeypatch):
+    monkeypatch.setattr(shared_datasets, 'SHARED_DIR', str(tmp_path))
+    df = pd.DataFrame({'Patient ID':['p1', 'p2', 'p1'], 'prop name':['Age', 'Age', 'BMI'], 'prop value':[7., 9., np.nan]})
+    tables = shared_datasets.acquire('study', lambda: {'metrics':df})
+    try:
+        metrics = tables['metrics']
+        assert isinstance(metrics['Patient ID'].dtype, pd.CategoricalDtype)
+        assert all(shared_datasets.is_shared(metrics, column) for column in metrics.columns)
+        pd.testing.assert_frame_equal(metrics.astype(df.dtypes.to_dict()), df)
+    finally:
+        shared_datasets.release('study')
+
+
+HOLDER = """
+import sys
+sys.path.insert(0, {root!r})
+import shared_datasets
+shared_datasets.acquire({key!r}, lambda: None)
+print('held', flush=True)
+sys.stdin.readline()
+shared_datasets.release({key!r})
+"""
+
+
+def test_a_study_is_deleted_when_its_last_holder_releases_it(tmp_path, monkeypatch):
+    monkeypatch.setattr(shared_datasets, 'SHARED_DIR', str(tmp_path))
+    monkeypatch.setattr(datasets, 'MAX_DATASETS', 1)
+    df = pd.DataFrame({'Patient ID':['p1', 'p2'], 'prop name':['Age', 'Age'], 'prop value':[7., 9.]})
+    datasets.get_or_build('study', 'shared tables', lambda: shared_datasets.acquire('study', lambda: {'metrics':df}))
+    # A second server process holds the study too.
+    holder = subprocess.Popen([sys.executable, '-c', HOLDER.format(root=ROOT, key='study')],
+                              stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True,
+                              env={**os.environ, 'PLOTTING_PARTNER_SHARED_DIR':str(tmp_path)})
+    try:
+        assert holder.stdout.readline() == 'held\n'
+        assert sorted(shared_datasets.holders('study')) == sorted([os.getpid(), holder.pid])
+        datasets.set_cached('another study', 'day index', None) # evicts 'study', the least recently used
+        assert datasets.get_cached('study', 'shared tables') is None
+        assert shared_datasets.holders('study') == [holder.pid]
+        assert os.path.exists(os.path.join(str(tmp_path), 'study'))
+    finally:
+        holder.communicate('\n', timeout=30)
+    assert not os.path.exists(os.path.join(str(tmp_path), 'study'))
+    datasets.drop_dataset('another study')
+
+
+def test_a_study_whose_files_changed_is_dropped(tmp_path, monkeypatch):
+    monkeypatch.setattr(shared_datasets, 'SHARED_DIR', str(tmp_path/'shared'))
+    infiles = [str(tmp_path/'timeseries.csv'), str(tmp_path/'demographics.csv')]
+    pd.DataFrame({'Patient ID':[1], 'Day':[0.], 'Coughs':[5], 'Treatment':['A']}).to_csv(infiles[0], index=False)
+    pd.DataFrame({'Patient ID':[1], 'Age':[7]}).to_csv(infiles[1], index=False)
+    old_key = datasets.register_study(*infiles, ['Treatment'])
+    datasets.get_study(old_key)
+    pd.DataFrame({'Patient ID':[1], 'Age':[8]}).to_csv(infiles[1], index=False)
+    os.utime(infiles[1], ns=(0, 0)) # so the key changes even within the file system's timestamp resolution
+    new_key = datasets.register_study(*infiles, ['Treatment'])
+    assert new_key != old_key
+    assert datasets.get_cached(old_key, 'shared tables') is None
+    with pytest.raises(ValueError, match='no longer available'):
+        datasets.get_study(old_key)
+    datasets.drop_dataset(new_key)
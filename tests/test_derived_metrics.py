@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+
+from derived_metrics import DERIVED_METRICS, compute_derived_metrics
+
+
+def derived(df):
+    metrics = compute_derived_metrics(df)
+    return metrics.set_index(['Patient ID', 'prop name'])['prop value']
+
+
+def test_metrics_of_a_known_series():
+    days = [3., 0., 1., 2.] # unsorted, as in the data files
+    df = pd.DataFrame({'Patient ID':'p1', 'Day':days, 'prop name':'Coughs', 'prop value':[2*day + 1 for day in days]})
+    values = derived(df)['p1']
+    assert values['Coughs (mean)'] == 4.
+    assert values['Coughs (max)'] == 7.
+    assert values['Coughs (min)'] == 1.
+    assert values['Coughs (last)'] == 7. # at the last day, not the last row
+    assert np.isclose(values['Coughs (slope)'], 2.)
+    assert np.isclose(values['Coughs (AUC)'], 12.) # (1 + 3)/2 + (3 + 5)/2 + (5 + 7)/2
+
+
+def test_slope_and_auc_are_missing_with_a_single_day():
+    df = pd.DataFrame({'Patient ID':['p1', 'p1', 'p2', 'p2', 'p2'], 'Day':[0., 0., 0., 1., 2.],
+                       'prop name':'Coughs', 'prop value':[4., 6., 1., np.nan, 5.]})
+    values = derived(df)
+    assert values['p1', 'Coughs (mean)'] == 5.
+    assert np.isnan(values['p1', 'Coughs (slope)']) and np.isnan(values['p1', 'Coughs (AUC)'])
+    assert np.isclose(values['p2', 'Coughs (slope)'], 2.) # the NaN at day 1 is ignored
+    assert np.isclose(values['p2', 'Coughs (AUC)'], 6.)
+
+
+def test_rows_are_ordered_by_property_then_metric_then_sample():
+    df = pd.DataFrame({'Patient ID':['p2', 'p1', 'p2', 'p1'], 'Day':[0., 0., 1., 1.],
+                       'prop name':['Temp', 'Coughs', 'Coughs', 'Temp'], 'prop value':[1., 2., 3., 4.]})
+    metrics = compute_derived_metrics(df)
+    expected = [(f'{prop} ({metric})', sample) for prop in ['Coughs', 'Temp']
+                for metric in DERIVED_METRICS for sample in ['p1', 'p2']]
+    assert list(zip(metrics['prop name'], metrics['Patient ID'])) == expected
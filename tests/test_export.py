@@ -0,0 +1,122 @@
+import io
+import os
+import time
+import zipfile
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+import app
+import export
+
+
+class BrokenPool:
+    def submit(self, *args, **kwargs):
+        raise BrokenProcessPool('A child process terminated abruptly.')
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        pass
+
+
+class FakePool:
+    """
+    Renders a figure to the bytes of its title and size, or fails for a figure titled 'fail'.
+    """
+    def __init__(self):
+        self.futures = []
+
+    def submit(self, render, fig, fmt, width, height, scale):
+        future = Future()
+        title = fig['layout'].get('title', '')
+        if title == 'fail':
+            future.set_exception(ValueError('Invalid figure'))
+        else:
+            future.set_result(f'{title} {width}x{height}'.encode())
+        self.futures.append(future)
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        pass
+
+
+def _figure(title, **layout):
+    return {'data':[{'type':'bar', 'x':[1], 'y':[2]}], 'layout':{'title':title, **layout}}
+
+
+@pytest.fixture
+def renderer(monkeypatch, tmp_path):
+    monkeypatch.setattr(export, 'kaleido_available', lambda: True)
+    monkeypatch.setattr(export, 'EXPORT_DIR', str(tmp_path))
+    pool = FakePool()
+    monkeypatch.setattr(export, '_renderer_pool', pool)
+    yield pool
+    export._renderer_pool = None
+
+
+def test_a_broken_renderer_is_reported_and_replaced(renderer):
+    export._renderer_pool = BrokenPool()
+    response = app.server.test_client().post('/export/figure?format=png', json=_figure('a'))
+    assert response.status_code == 503
+    assert b'BrokenProcessPool' in response.data
+    assert export._renderer_pool is None # the next export starts a new pool
+    url = export.create_batch([('a', _figure('a'))], 'png')
+    export._renderer_pool = BrokenPool()
+    assert app.server.test_client().get(url).status_code == 503
+
+
+def test_a_batch_is_downloaded_once_from_any_process(renderer, monkeypatch):
+    url = export.create_batch([('Coughs (1/hour)', _figure('a')), ('BMI', _figure('b', width=300, height=200))], 'png')
+    # Nothing is kept in this process's memory: any server process can serve the download.
+    monkeypatch.setattr(export, '_renderer_pool', FakePool())
+    response = app.server.test_client().get(url)
+    assert response.status_code == 200
+    with zipfile.ZipFile(io.BytesIO(response.data)) as archive:
+        assert archive.namelist() == ['Coughs_1_hour.png', 'BMI.png']
+        assert archive.read('BMI.png') == b'b 300x200'
+    assert app.server.test_client().get(url).status_code == 404
+
+
+def test_a_failed_render_is_reported_in_the_archive(renderer):
+    url = export.create_batch([('a', _figure('a')), ('b', _figure('fail')), ('c', _figure('c'))], 'png')
+    response = app.server.test_client().get(url)
+    with zipfile.ZipFile(io.BytesIO(response.data)) as archive:
+        assert archive.testzip() is None
+        assert archive.namelist() == ['a.png', 'b.png.error.txt', 'c.png']
+        assert b'Invalid figure' in archive.read('b.png.error.txt')
+
+
+def test_an_abandoned_download_cancels_its_renders():
+    futures = [('a', Future()), ('b', Future())]
+    futures[0][1].set_result(b'a')
+    stream = export.stream_zip(futures, 'png')
+    next(stream)
+    stream.close()
+    assert futures[1][1].cancelled()
+
+
+def test_image_sizes_are_clamped(renderer):
+    response = app.server.test_client().post('/export/figure?format=png', json=_figure('a', width=10**6, height=1))
+    assert response.data == f'a {export.MAX_EXPORT_SIZE}x{export.MIN_EXPORT_SIZE}'.encode()
+    response = app.server.test_client().post('/export/figure?format=png', json=_figure('a', width='wide'))
+    assert response.status_code == 400
+
+
+def test_old_batches_expire(renderer, monkeypatch):
+    monkeypatch.setattr(export, 'MAX_PENDING_BATCHES', 2)
+    urls = []
+    for age in [30, 20, 10]: # seconds
+        urls.append(export.create_batch([('a', _figure('a'))], 'png'))
+        path = export._batch_path(urls[-1].split('/')[-1][:-len('.zip')])
+        os.utime(path, (time.time() - age,)*2)
+    export.create_batch([('a', _figure('a'))], 'png')
+    assert app.server.test_client().get(urls[0]).status_code == 404
+    assert app.server.test_client().get(urls[2]).status_code == 200
+
+
+def test_batches_expire_after_a_while(renderer):
+    url = export.create_batch([('a', _figure('a'))], 'png')
+    path = export._batch_path(url.split('/')[-1][:-len('.zip')])
+    os.utime(path, (time.time() - export.BATCH_EXPIRY_SECONDS - 1,)*2)
+    export.create_batch([('a', _figure('a'))], 'png')
+    assert not os.path.exists(path)
@@ -0,0 +1,38 @@
+import figure_cache
+
+
+def test_keys_ignore_what_does_not_change_the_figure():
+    key = figure_cache.make_key('data set', ['b', 'a'], 'Treatment', False, 0.03)
+    assert key == figure_cache.make_key('data set', ['a', 'b'], 'Treatment', False, 0.) # facet order, replicate slider
+    assert figure_cache.make_key('data set', ['a'], 'Treatment', True, 0.03) != \
+        figure_cache.make_key('data set', ['a'], 'Treatment', True, 0.)
+    assert figure_cache.make_key('data set', ['a'], 'Treatment', False, 0., variant=('density',)) != \
+        figure_cache.make_key('data set', ['a'], 'Treatment', False, 0.)
+    assert figure_cache.make_key(None, ['a'], 'Treatment', False, 0.) is None
+
+
+def test_least_recently_used_figures_are_dropped(monkeypatch):
+    monkeypatch.setattr(figure_cache, 'MAX_CACHED_FIGURES', 2)
+    figure_cache.clear()
+    for name in ['a', 'b']:
+        figure_cache.put((name,), {'data':[{'name':name}], 'layout':{}})
+    assert figure_cache.get(('a',)) is not None # 'a' is now more recently used than 'b'
+    figure_cache.put(('c',), {'data':[], 'layout':{}})
+    assert figure_cache.get(('b',)) is None
+    assert figure_cache.get(('a',)) is not None
+    assert figure_cache.stats()['size'] == 2
+    figure_cache.clear()
+
+
+def test_styling_a_copy_leaves_the_cached_figure_alone():
+    figure_cache.clear()
+    data = [1., 2.]
+    figure_cache.put(('a',), {'data':[{'line':{'color':'red'}, 'y':data}], 'layout':{'title':{'text':'A'}}})
+    fig = figure_cache.get(('a',))
+    fig['data'][0]['line'] = {'color':'blue'}
+    fig['layout']['title']['text'] = 'B'
+    cached = figure_cache.get(('a',))
+    assert cached['data'][0]['line'] == {'color':'red'}
+    assert cached['layout']['title']['text'] == 'A'
+    assert cached['data'][0]['y'] is data # the data arrays are shared, not copied
+    figure_cache.clear()
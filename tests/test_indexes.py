@@ -0,0 +1,51 @@
+import numpy as np
+
+from indexes import DayIndex, SampleSearchIndex
+
+SAMPLES = ['300665589', 'id-7-001234', 'ID-12-3006', 'xyz-0012', '166554']
+
+
+def test_prefix_segment_and_substring_hits():
+    index = SampleSearchIndex(SAMPLES)
+    assert index.prefix('3006') == [0]
+    assert sorted(index.prefix('id-')) == [1, 2] # case-insensitive
+    assert sorted(index.suffix_segment('0012')) == [1, 3] # a later segment begins with it
+    assert index.suffix_segment('id') == [] # the first segment is a prefix, not a segment
+    assert index.substring('6655') == [0, 4]
+
+
+def test_search_orders_prefix_then_segment_then_substring_hits():
+    index = SampleSearchIndex(SAMPLES)
+    # '3006' begins sample 0, is a segment of sample 2; '0012' is a segment of samples 1 and 3.
+    assert index.search(' 3006 ') == ['300665589', 'ID-12-3006']
+    assert index.search('0012') == ['id-7-001234', 'xyz-0012']
+    assert index.search('1') == ['166554', 'ID-12-3006', 'id-7-001234', 'xyz-0012'] # prefix, segment, substrings
+    assert index.search('12', limit=1) == ['ID-12-3006']
+    assert index.search('') == SAMPLES
+    assert index.search('nothing like it') == []
+
+
+def test_every_substring_hit_is_found_once():
+    rng = np.random.default_rng(0)
+    samples = [''.join(rng.choice(list('0123'), size=6)) for _ in range(500)]
+    index = SampleSearchIndex(samples)
+    for text in ['0', '12', '333', '0123']:
+        expected = [i for i, sample in enumerate(samples) if text in sample]
+        assert index.substring(text, limit=len(samples)) == expected
+
+
+def test_day_index_rows_match_a_scan():
+    days = np.array([3., 0.5, np.nan, 0.5, 2., 0., 3., 1.5])
+    index = DayIndex(days)
+    assert index.bounds() == (0., 3.)
+    assert index.distinct_days().tolist() == [0., 0.5, 1.5, 2., 3.]
+    for low, high in [(0.5, 2.), (0.6, 1.9), (None, 0.5), (2., None), (None, None), (4., 5.), (2.5, 1.)]:
+        expected = np.flatnonzero((days >= (-np.inf if low is None else low))
+                                  & (days <= (np.inf if high is None else high)))
+        assert index.rows(low, high).tolist() == expected.tolist()
+
+
+def test_a_day_index_without_days():
+    index = DayIndex([np.nan, np.nan])
+    assert index.bounds() is None
+    assert index.rows(0., 1.).tolist() == []
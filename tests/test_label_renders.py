@@ -0,0 +1,126 @@
+import uuid
+
+import pytest
+from dash import no_update
+
+import callbacks
+import labels
+import utils
+from conftest import call_callback
+
+
+class BarPlotSession:
+    """
+    The labeling Stores of one browser session, and the bar plot renders they cause:
+    as in the browser, update_barplot() is called once each time dcc.Store(id='label-index-version') changes.
+    """
+    def __init__(self):
+        self.dataset_key = call_callback(callbacks.load_fake_demo_data, None, num_outputs=13)[5]
+        outputs = call_callback(callbacks.initialize_barplot_components, False, self.dataset_key, num_outputs=8)
+        self.label_map, self.sample_options, self.props = outputs[0], outputs[1], outputs[5][:2]
+        self.label_options = [utils.ADD_NEW_CATEGORY]
+        self.label_table = labels.new_label_table()
+        self.default_label = labels.UNLABELED
+        self.session_id = uuid.uuid4().hex
+        self.version = None
+        self.barplot_version = None
+        self.trace_map = None
+        self.renders = 0
+        self.render('render-barplot-button')
+
+    def render(self, triggered : str):
+        outputs = call_callback(callbacks.update_barplot, 1, self.version, False, self.props[0], 1,
+                                utils.BARPLOT_SAMPLES, [0, 9], None, self.sample_options, self.props,
+                                self.label_table, self.session_id, self.label_map, self.default_label,
+                                self.barplot_version, self.dataset_key, None,
+                                triggered=f'{triggered}.n_clicks', num_outputs=9)
+        assert outputs[-1] is no_update
+        if outputs[0] is not no_update:
+            self.renders += 1
+            self.trace_map, self.barplot_version = outputs[4], outputs[5]
+
+    def apply(self, new_version, barplot_version):
+        """
+        Take in a label action's new labeling version (and the bar plot's, if it set it),
+        refresh the other labeling Stores from the server-side index, and run update_barplot() if the version changed.
+        """
+        if barplot_version is not no_update:
+            self.barplot_version = barplot_version
+        if new_version is no_update or new_version == self.version:
+            return
+        self.version = new_version
+        index = labels.get_label_index(self.session_id, self.version, self.label_map, self.label_table,
+                                       self.default_label)
+        self.label_map = dict(zip(index.samples.tolist(), index.sample_label_ids.tolist()))
+        self.label_table = index.label_table()
+        self.default_label = index.default_label
+        self.render('label-index-version')
+
+    def new_label(self, name : str, color : str, is_default : bool=False):
+        outputs = call_callback(callbacks.accept_new_label, 1, name, {'background':color}, self.label_options,
+                                is_default, self.sample_options, self.label_map, self.label_table,
+                                self.default_label, self.session_id, self.version, self.barplot_version,
+                                num_outputs=10)
+        self.label_options = outputs[0]
+        self.apply(outputs[7], outputs[8])
+
+    def edit_label(self, name : str, new_name : str, color : str, is_default : bool=False):
+        outputs = call_callback(callbacks.accept_edited_label, 1, new_name, {'background':color},
+                                self.label_options, name, is_default, self.sample_options, self.label_map,
+                                self.label_table, self.default_label, self.session_id, self.version,
+                                self.trace_map, self.barplot_version, num_outputs=12)
+        if outputs[0] is not no_update:
+            self.label_options = outputs[0]
+        self.apply(outputs[8], outputs[10])
+
+    def assign(self, sample : str, name : str):
+        chosen = {'props':{'children':[{}, {'props':{'children':sample}}]}}
+        outputs = call_callback(callbacks.assign_label_to_sample, 1, chosen, name, self.sample_options,
+                                self.label_map, self.label_table, self.default_label, self.session_id, self.version,
+                                num_outputs=6)
+        self.apply(outputs[5], no_update)
+
+
+@pytest.fixture
+def session():
+    return BarPlotSession()
+
+
+def test_the_first_render(session):
+    assert session.renders == 1
+    assert session.barplot_version == 0
+
+
+@pytest.mark.parametrize('action, renders', [
+    (lambda s: s.new_label('Older', '#E15759'), 0),                  # no bar carries it yet
+    (lambda s: s.new_label('Older', '#E15759', is_default=True), 1), # every bar now carries it
+])
+def test_new_label(session, action, renders):
+    action(session)
+    assert session.renders == 1 + renders
+    assert session.barplot_version == session.version > 0
+
+
+def test_assign_renders_once_per_assignment(session):
+    session.new_label('Older', '#E15759')
+    samples = list(session.label_map)
+    session.assign(samples[0], 'Older')
+    assert session.renders == 2
+    session.assign(samples[1], 'Older')
+    assert session.renders == 3
+    session.assign(samples[1], 'Older') # no change, so no new version
+    assert session.renders == 3
+    assert session.barplot_version == session.version == 3
+    assert session.label_map[samples[1]] == session.label_table['names'].index('Older')
+
+
+def test_edit_label(session):
+    session.new_label('Older', '#E15759')
+    session.assign(next(iter(session.label_map)), 'Older')
+    session.new_label('High BMI', '#4E79A7')
+    assert session.renders == 2
+    session.edit_label('Older', 'Oldest', '#59A14F') # patched in place, not re-rendered
+    assert session.renders == 2
+    session.edit_label('High BMI', 'High BMI', '#4E79A7', is_default=True) # changes the unlabeled bars
+    assert session.renders == 3
+    assert session.barplot_version == session.version
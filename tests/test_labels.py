@@ -0,0 +1,75 @@
+import labels
+import utils
+from labels import UNLABELED, LabelIndex
+
+SAMPLES = ['s3', 's1', 's2', 's4']
+
+
+def test_assign_a_label_to_a_subset():
+    index = LabelIndex(SAMPLES)
+    older = index.add_label('Older', '#E15759')
+    assert index.positions_of(['s2', 'nobody', 's4']).tolist() == [1, 3] # unknown IDs are ignored
+    assert index.assign(['s2', 's4', 'nobody'], older) == {'s2':older, 's4':older}
+    version = index.version
+    assert index.assign(['s2'], older) == {} # no change, no new version
+    assert index.version == version
+
+
+def test_reassign_a_label():
+    index = LabelIndex(SAMPLES)
+    older, younger = index.add_label('Older', '#E15759'), index.add_label('Younger', '#4E79A7')
+    index.assign(['s1', 's2'], older)
+    assert index.assign(['s2', 's3'], younger) == {'s2':younger, 's3':younger}
+    assert dict(zip(index.samples.tolist(), index.sample_label_ids.tolist())) == \
+        {'s1':older, 's2':younger, 's3':younger, 's4':UNLABELED}
+
+
+def test_the_default_label():
+    index = LabelIndex(SAMPLES)
+    older, younger = index.add_label('Older', '#E15759'), index.add_label('Younger', '#4E79A7')
+    index.assign(['s1', 's2'], older)
+    # Samples that carried the new default explicitly are stored as carrying the default.
+    assert index.set_default(older) == {'s1':UNLABELED, 's2':UNLABELED}
+    assert index.set_default(older) == {}
+    assert index.assign(['s3'], older) == {} # s3 already carries the default
+    assert index.sample_colors().tolist() == ['#E15759']*4
+    # They all follow the default when it changes.
+    index.set_default(younger)
+    assert index.sample_colors().tolist() == ['#4E79A7']*4
+
+
+def test_sample_colors_follow_label_edits():
+    index = LabelIndex(SAMPLES)
+    older = index.add_label('Older', '#E15759')
+    index.assign(['s2'], older)
+    assert index.sample_colors().tolist() == [utils.LIGHT_GRAY, '#E15759', utils.LIGHT_GRAY,
+                                              utils.LIGHT_GRAY]
+    ids = index.sample_label_ids.copy()
+    index.edit_label(older, 'Oldest', '#59A14F') # touches the label table only
+    assert index.sample_label_ids.tolist() == ids.tolist()
+    assert index.sample_colors([1, 3]).tolist() == ['#59A14F', utils.LIGHT_GRAY]
+    assert index.label_table() == {'names':['Oldest'], 'colors':['#59A14F']}
+    assert labels.sample_color('s2', {'s2':older}, index.label_table(), UNLABELED) == '#59A14F'
+
+
+def test_from_stores_round_trip():
+    label_table = {'names':['Older', 'Younger'], 'colors':['#E15759', '#4E79A7']}
+    sample_to_label = {'s3':1, 's1':UNLABELED, 's2':0, 's4':UNLABELED}
+    index = LabelIndex.from_stores(sample_to_label, label_table, 1)
+    assert dict(zip(index.samples.tolist(), index.sample_label_ids.tolist())) == sample_to_label
+    assert index.sample_colors().tolist() == ['#4E79A7', '#E15759', '#4E79A7', '#4E79A7']
+
+
+def test_a_cached_index_changes_only_when_a_changed_copy_is_cached():
+    label_map = dict.fromkeys(SAMPLES, UNLABELED)
+    index = labels.get_label_index('session-copies', 0, label_map, labels.new_label_table(), UNLABELED)
+    older = index.add_label('Older', '#E15759')
+    index.assign(['s1'], older)
+    # Another callback of the session, still at version 0, sees the cached index unchanged.
+    unchanged = labels.get_label_index('session-copies', 0, {}, labels.new_label_table(), UNLABELED)
+    assert unchanged.label_names == [] and (unchanged.sample_label_ids == UNLABELED).all()
+    labels.set_label_index('session-copies', index)
+    changed = labels.get_label_index('session-copies', index.version, {}, labels.new_label_table(), UNLABELED)
+    assert changed is not index
+    assert changed.label_table() == {'names':['Older'], 'colors':['#E15759']}
+    assert changed.sample_colors(changed.positions_of(['s1'])).tolist() == ['#E15759']
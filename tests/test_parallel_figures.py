@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+import plotly.express as px
+
+import parallel_figures
+
+
+def _timeseries(num_samples : int=6, num_days : int=4, props=('A', 'B', 'C')):
+    rng = np.random.default_rng(0)
+    rows = [(f'id{i}', ['Placebo', 'Low dose', 'High dose'][i % 3], day, prop, rng.normal())
+            for prop in props for i in range(num_samples) for day in range(num_days)]
+    return pd.DataFrame(rows, columns=['Patient ID', 'Treatment', 'Day', 'prop name', 'prop value'])
+
+
+def _legend(fig):
+    return [(trace.name, trace.line.color) for trace in fig.data if trace.showlegend]
+
+
+def test_group_order_is_honored():
+    df = _timeseries()
+    group_order = ['High dose', 'Placebo', 'Low dose']
+    colors = px.colors.qualitative.T10
+    fig = parallel_figures.make_facet_parallel_line_plot(df, 'Day', 'Patient ID', 'Treatment', colors, 540,
+                                                         group_order)
+    expected = px.line(df, x='Day', y='prop value', facet_row='prop name', line_group='Patient ID',
+                       color='Treatment', color_discrete_sequence=colors, height=540,
+                       category_orders={'Treatment':group_order})
+    assert _legend(fig) == _legend(expected)
+    assert [trace.legendgroup for trace in fig.data] == [trace.legendgroup for trace in expected.data]
+
+
+def test_a_failing_worker_falls_back_to_the_serial_build(monkeypatch, caplog):
+    class FailingPool:
+        def submit(self, *args, **kwargs):
+            raise RuntimeError('worker failed')
+    monkeypatch.setattr(parallel_figures, '_get_pool', FailingPool)
+    fig = parallel_figures.make_facet_parallel_line_plot(_timeseries(), 'Day', 'Patient ID', 'Treatment',
+                                                         px.colors.qualitative.T10, 540)
+    assert fig is None
+    assert 'RuntimeError: worker failed' in caplog.text
@@ -0,0 +1,21 @@
+import numpy as np
+
+import payloads
+
+
+def test_compact_figure_keeps_the_digits_of_small_values_next_to_large_ones():
+    y = np.array([1.5e6, 1.234567891, 0.000123456789, -3.33333333e-5, 5.6000000000000005, 0., 42., 7.25e-3])
+    x = np.arange(len(y), dtype=float)
+    fig = payloads.compact_figure({'data':[{'type':'scatter', 'x':x.tolist(), 'y':y.tolist()}], 'layout':{}})
+    assert fig['data'][0]['y']['dtype'] == 'f4'
+    decoded = np.array(payloads.decode_typed_arrays(fig)['data'][0]['y'])
+    np.testing.assert_allclose(decoded, y, rtol=10.**(1 - payloads.FIGURE_SIGNIFICANT_DIGITS))
+    assert payloads.decode_typed_arrays(fig)['data'][0]['x'] == x.tolist()
+
+
+def test_values_outside_the_float32_range_are_sent_as_float64():
+    y = np.array([1e-42, 2.5, 3.75e40, 1.0, 0.5, 0.25, 0.125, 3.1])
+    fig = payloads.compact_figure({'data':[{'type':'scatter', 'y':y.tolist()}], 'layout':{}})
+    assert fig['data'][0]['y']['dtype'] == 'f8'
+    decoded = np.array(payloads.decode_typed_arrays(fig)['data'][0]['y'])
+    np.testing.assert_allclose(decoded, y, rtol=10.**(1 - payloads.FIGURE_SIGNIFICANT_DIGITS))
@@ -0,0 +1,20 @@
+import os
+
+import report
+
+
+def test_file_stems_are_safe_and_unique():
+    plots = [{'name':'../escape'}, {'name':'coughs'}, {'name':'Coughs'}, {'name':'coughs'}, {'name':'/..'}]
+    assert report.file_stems(plots) == ['escape', 'coughs', 'Coughs-2', 'coughs-3', '']
+
+
+def test_report_writes_every_plot_inside_outdir(tmp_path):
+    outdir = tmp_path / 'report'
+    plot = {'type':'line', 'facets':['Coughs (1/hour)'], 'group':'Treatment', 'mode':'mean_sd'}
+    specs = {'plots':[dict(plot, name='../escape'), dict(plot, name='same'), dict(plot, name='same'),
+                      dict(plot, name='..')]}
+    results = report.make_report(specs, str(outdir), fmt='html', workers=1)
+    assert [r.get('file') for r in results] == ['escape.html', 'same.html', 'same-2.html', None]
+    assert 'error' in results[3]
+    assert sorted(os.listdir(outdir)) == ['escape.html', 'index.html', 'same-2.html', 'same.html']
+    assert not (tmp_path / 'escape.html').exists()
@@ -0,0 +1,63 @@
+import os
+import time
+
+import numpy as np
+import pytest
+from dash import no_update
+
+import callbacks
+import labels
+import sessions
+from conftest import call_callback
+
+
+def _save_session(session_id, label_map, version=0):
+    link, err_msg = call_callback(callbacks.save_session, 1, 'http://localhost/', 'dataset-key', session_id, version,
+                                  label_map, labels.new_label_table(), labels.UNLABELED, None,
+                                  [], 'Treatment', 1, 0, [0, 6], True, False, [], 'Age', 0, False,
+                                  triggered='save-session-button.n_clicks', num_outputs=2)
+    assert err_msg is no_update
+    return link.split('session=')[1]
+
+
+def test_labels_changed_after_a_save_are_not_restored(session_dir):
+    label_map = dict.fromkeys(['a', 'b', 'c'], labels.UNLABELED)
+    token = _save_session('session-1', label_map)
+    # Label two samples afterwards, as a label action would, through a copy of the session's LabelIndex.
+    index = labels.get_label_index('session-1', 0, label_map, labels.new_label_table(), labels.UNLABELED)
+    index.add_label('A', '#E15759')
+    index.assign(['a', 'b'], 0)
+    assert index.sample_label_ids.tolist() == [0, 0, labels.UNLABELED]
+
+    saved = sessions.load_snapshot(token)['label ids'] # from this process's memory
+    assert np.asarray(saved).tolist() == [labels.UNLABELED]*3
+    sessions._snapshots.clear()
+    saved = sessions.load_snapshot(token)['label ids'] # from the file
+    assert np.asarray(saved).tolist() == [labels.UNLABELED]*3
+
+
+def test_old_and_surplus_snapshots_are_deleted(session_dir, monkeypatch):
+    monkeypatch.setattr(sessions, 'MAX_SNAPSHOT_FILES', 2)
+    label_map = dict.fromkeys(['a', 'b'], labels.UNLABELED)
+    tokens = [_save_session('session-2', label_map) for _ in range(2)]
+    now = time.time()
+    os.utime(session_dir/f'{tokens[0]}.ppss', (now - sessions.SNAPSHOT_EXPIRY_SECONDS - 1,)*2)
+    (session_dir/'leftover.tmp').write_bytes(b'')
+    os.utime(session_dir/'leftover.tmp', (now - sessions.SNAPSHOT_EXPIRY_SECONDS - 1,)*2)
+    os.utime(session_dir/f'{tokens[1]}.ppss', (now - 10,)*2)
+    tokens += [_save_session('session-2', label_map) for _ in range(2)]
+    # The expired snapshot and the oldest of the remaining three are gone, from disk and from memory.
+    assert sorted(os.listdir(session_dir)) == sorted(f'{token}.ppss' for token in tokens[2:])
+    for token in tokens[:2]:
+        with pytest.raises(ValueError, match='not found'):
+            sessions.load_snapshot(token)
+    assert sessions.load_snapshot(tokens[3])['dataset key'] == 'dataset-key'
+
+
+def test_a_snapshot_of_another_data_set_is_not_restored(session_dir):
+    label_map = dict.fromkeys(['a', 'b'], labels.UNLABELED)
+    token = _save_session('session-3', label_map)
+    outputs = call_callback(callbacks.restore_session, [], f'?session={token}', 'http://localhost/',
+                            'another-dataset-key', 'session-3', 0, label_map, [], [], [], 0, 0, num_outputs=23)
+    assert all(output is no_update for output in outputs[:-1])
+    assert 'different data set' in outputs[-1]
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import stats_cube
+
+GROUPS = ['Treatment', 'Home location']
+
+
+@pytest.fixture
+def df_all():
+    rng = np.random.default_rng(0)
+    n = 600
+    df = pd.DataFrame({'Patient ID':rng.integers(20, size=n).astype(str),
+                       'Day':rng.integers(4, size=n)/2,
+                       'Treatment':rng.choice(['Placebo', '10mg'], size=n),
+                       'Home location':rng.choice(['North', 'South', 'East'], size=n),
+                       'prop name':rng.choice(['Coughs', 'WBC'], size=n),
+                       'prop value':1e4 + rng.normal(0, 1, size=n)}) # a small SD relative to the mean
+    df.loc[rng.random(n) < 0.05, 'prop value'] = np.nan
+    return df
+
+
+def test_summarize_matches_groupby(df_all):
+    summary = stats_cube.summarize(stats_cube.build_stats_cube(df_all, GROUPS), 'Treatment')
+    expected = df_all.groupby(['Treatment', 'Day', 'prop name'])['prop value'].agg(['count', 'mean', 'std'])
+    expected = expected[expected['count'] > 0].reset_index()
+    np.testing.assert_array_equal(summary['count'], expected['count'])
+    np.testing.assert_allclose(summary['mean'], expected['mean'], rtol=1e-12)
+    np.testing.assert_allclose(summary['std'], expected['std'].fillna(0.), rtol=1e-9)
+
+
+def test_merged_chunks_match_one_pass(df_all):
+    one_pass = stats_cube.build_stats_cube(df_all, GROUPS)
+    builders = [stats_cube.StatsCubeBuilder(GROUPS).update(chunk) for chunk in (df_all[:200], df_all[200:450], df_all[450:])]
+    merged = builders[0].merge(builders[1]).merge(builders[2]).result()
+    for group in GROUPS:
+        pd.testing.assert_frame_equal(merged[group], one_pass[group], check_exact=False, rtol=1e-9)
+
+
+def test_the_cube_can_be_built_from_the_csv_file_in_chunks(df_all, tmp_path):
+    wide = df_all.dropna().drop_duplicates(['Patient ID', 'Day', 'prop name']) \
+        .pivot(index=['Patient ID', 'Day', *GROUPS], columns='prop name', values='prop value').reset_index()
+    wide = wide.drop_duplicates(['Patient ID', 'Day'])
+    path = tmp_path/'timeseries.csv'
+    wide.to_csv(path, index=False)
+    df_melted = wide.melt(id_vars=['Patient ID', 'Day', *GROUPS], var_name='prop name', value_name='prop value')
+    from_csv = stats_cube.build_stats_cube_from_csv(path, ['Patient ID', 'Day', *GROUPS], GROUPS, chunksize=7)
+    for group, moments in stats_cube.build_stats_cube(df_melted, GROUPS).items():
+        pd.testing.assert_frame_equal(from_csv[group], moments, check_exact=False, rtol=1e-9, check_index_type=False)
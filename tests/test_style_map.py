@@ -0,0 +1,20 @@
+import pandas as pd
+
+import stats_cube
+import utils
+
+
+def test_mean_sd_traces_style_every_sample_of_their_group():
+    # One trace per group: each trace's style is recorded for all of the group's samples.
+    # The group values are numeric, so they're matched to the traces (whose hover text is a string) as strings.
+    df = pd.DataFrame({'Patient ID':['a', 'a', 'b', 'b', 'c', 'c'], 'Day':[0., 1.]*3, 'Dose (mg)':[0, 0, 0, 0, 10, 10],
+                       'prop name':['Coughs']*6, 'prop value':[1., 2., 3., 4., 5., 6.]})
+    df_summary = stats_cube.summarize(stats_cube.build_stats_cube(df, ['Dose (mg)']), 'Dose (mg)')
+    fig = utils.make_custom_multifaceted_line_plot(df, x_column='Day', line_group='Patient ID', agg_group='Dose (mg)',
+                                                   display_meanSD=True, dt=0., df_summary=df_summary).to_plotly_json()
+    style_map = utils.add_group_to_style_map('Dose (mg)', {}, fig, df, 'Patient ID', True)
+    assert {value : sorted(set(entry['Sample IDs'])) for value, entry in style_map['Dose (mg)'].items()} == \
+        {'0':['a', 'b'], '10':['c']}
+    assert style_map['Sample IDs']['a']['Dose (mg)'] == '0'
+    assert style_map['Sample IDs']['a']['facets']['Dose (mg)']['Coughs'] == \
+        style_map['Dose (mg)']['0']['facets']['Coughs']
@@ -0,0 +1,29 @@
+import pytest
+from dash import no_update
+
+import callbacks
+import figure_cache
+import utils
+from conftest import call_callback
+
+
+def _fail(*args, **kwargs):
+    raise AssertionError('The figure was built rather than found in the cache.')
+
+
+@pytest.mark.parametrize('mode', [utils.LINEPLOT_REPLICATES, utils.LINEPLOT_MEAN_SD])
+def test_the_first_render_finds_the_warmed_figure(mode, monkeypatch):
+    figure_cache.clear()
+    outputs = call_callback(callbacks.load_fake_demo_data, None, num_outputs=13)
+    assert outputs[-1] is no_update
+    facets, group_options, group, dataset_key, day_range = outputs[2], outputs[3], outputs[4], outputs[5], outputs[-2]
+    df_all, df_metrics = callbacks._study_tables(dataset_key)
+    for _, task in callbacks._warm_up_tasks(df_all, df_metrics, group_options, dataset_key):
+        task() # as warmup.start() does, in the background
+    monkeypatch.setattr(utils, 'make_custom_multifaceted_line_plot', _fail)
+    # The controls' initial settings (see layout.add_lineplot_controls()), after a click on 'show plot'.
+    outputs = call_callback(callbacks.update_line_plot, 1, mode, 0, False, day_range, None, facets, group,
+                            group_options, dataset_key, 'a session',
+                            triggered='render-lineplot-button.n_clicks', num_outputs=9)
+    assert outputs[-1] is no_update
+    assert outputs[1]['data']
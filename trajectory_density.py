@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+
+# ------- Begin trajectory density ---------------
+#
+# With thousands of samples, one line per sample (replicate mode) can neither be read nor drawn.
+# The density view of the line plot (see utils.make_density_line_plot()) shows instead, per facet,
+# how many trajectories pass through each cell of a grid of DENSITY_X_BINS x DENSITY_Y_BINS cells
+# (x_column x 'prop value'), as a heatmap. Between two measurements, a trajectory is a straight line,
+# so it is counted in every column its line crosses, at the value interpolated at the column's center;
+# each trajectory therefore counts at most once per column.
+# The size of the figure, and the time to draw it, depend on the grid, not on the number of samples.
+DENSITY_X_BINS = 200
+DENSITY_Y_BINS = 120
+#
+# ------- End trajectory density -----------------
+
+
+def _bin_edges(values : np.ndarray, value_range : tuple):
+    low, high = value_range if value_range is not None else (np.nanmin(values), np.nanmax(values))
+    if high <= low: # a single value: give it a bin of width 1 around it
+        low, high = low - 0.5, high + 0.5
+    return float(low), float(high)
+
+
+def bin_trajectories(df : pd.DataFrame, x_column : str, line_group : str, x_bins : int=DENSITY_X_BINS,
+                     y_bins : int=DENSITY_Y_BINS, x_range : tuple=None, y_range : tuple=None):
+    """
+    Function to count the trajectories (one per line_group value) passing through each cell of a 2D grid.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+       The data of one facet: columns x_column, line_group, and 'prop value'. Rows with NaNs are ignored.
+    x_column : str
+       The name of the column holding the x-axis data, e.g. 'Day'.
+    line_group : str
+       The name of the column identifying the trajectories, e.g. 'Patient ID'.
+    x_bins, y_bins : int, default : DENSITY_X_BINS, DENSITY_Y_BINS
+       The number of columns and rows of the grid.
+    x_range, y_range : tuple of float, default : None
+       The (low, high) extent of the grid. None means the extent of the data.
+
+    Returns
+    -------
+    np.ndarray, np.ndarray, np.ndarray
+       The counts (shape (y_bins, x_bins), the rows being the y bins, as for a heatmap's 'z'),
+       and the centers of the x bins and of the y bins.
+    """
+    df = df[[line_group, x_column, 'prop value']].dropna()
+    df = df.sort_values([line_group, x_column], kind='stable')
+    trajectory = pd.factorize(df[line_group])[0]
+    x = df[x_column].to_numpy(dtype=float)
+    y = df['prop value'].to_numpy(dtype=float)
+    counts = np.zeros(y_bins*x_bins, dtype=np.int64)
+    if len(x) == 0:
+        x_low, x_high = x_range if x_range is not None else (0., 1.)
+        y_low, y_high = y_range if y_range is not None else (0., 1.)
+    else:
+        x_low, x_high = _bin_edges(x, x_range)
+        y_low, y_high = _bin_edges(y, y_range)
+    dx = (x_high - x_low)/x_bins
+    dy = (y_high - y_low)/y_bins
+    x_centers = x_low + (np.arange(x_bins) + 0.5)*dx
+    y_centers = y_low + (np.arange(y_bins) + 0.5)*dy
+    if len(x) == 0:
+        return counts.reshape(y_bins, x_bins), x_centers, y_centers
+
+    def add(columns, values):
+        nonlocal counts
+        rows = np.clip(np.floor((values - y_low)/dy).astype(np.int64), 0, y_bins - 1)
+        counts += np.bincount(rows*x_bins + columns, minlength=len(counts))
+
+    # Segments between consecutive measurements of the same trajectory. Each covers the columns
+    # whose centers lie in [x0, x1); the last point of each trajectory is added below.
+    same = trajectory[1:] == trajectory[:-1]
+    x0, x1 = x[:-1][same], x[1:][same]
+    y0, y1 = y[:-1][same], y[1:][same]
+    first_column = np.clip(np.ceil((x0 - x_low)/dx - 0.5).astype(np.int64), 0, x_bins)
+    end_column = np.clip(np.ceil((x1 - x_low)/dx - 0.5).astype(np.int64), 0, x_bins)
+    num_columns = np.maximum(end_column - first_column, 0)
+    segment = np.repeat(np.arange(len(x0)), num_columns)
+    offsets = np.arange(len(segment)) - np.repeat(np.cumsum(num_columns) - num_columns, num_columns)
+    columns = first_column[segment] + offsets
+    t = (x_centers[columns] - x0[segment])/(x1 - x0)[segment]
+    add(columns, y0[segment] + t*(y1 - y0)[segment])
+
+    # The last point of each trajectory, unless its column's center was already covered by a segment
+    # (trajectories with a single point are always counted).
+    last = np.append(~same, True)
+    first = np.insert(~same, 0, True)
+    columns = np.clip(np.floor((x[last] - x_low)/dx).astype(np.int64), 0, x_bins - 1)
+    keep = first[last] | (x_centers[columns] >= x[last])
+    add(columns[keep], y[last][keep])
+    return counts.reshape(y_bins, x_bins), x_centers, y_centers
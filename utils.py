@@ -3,9 +3,14 @@ from textwrap import wrap, fill
 
 import plotly.express as px
 import plotly.graph_objects as go
+from plotly.subplots import make_subplots
 import pandas as pd
 import numpy as np
 
+import parallel_figures
+import stats_cube
+import trajectory_density
+
 # ------- Begin utility declarations ------------------------
 #
 # Set of 20 contrasting colors used by Tableau
@@ -26,6 +31,33 @@ DEFAULT_YLABEL_FONT_SIZE = 12 # plotly's default y-axis font size
 DEFAULT_MAX_YLABEL_LEN = 14 # empirically determined by Eric
 ERR_MSG_LINE_LEN = 40
 OPTIONAL_LEFT_MARGIN = '3rem' # for use as left padding, e.g. style = {'margin-left': OPTIONAL_LEFT_MARGIN}
+MAX_SAMPLE_OPTIONS = 500 # longest list of samples sent to the samples dropdown; typing searches the rest
+
+# Values of the line plot's 'show' radio items (see layout.add_lineplot_controls()).
+LINEPLOT_REPLICATES = 1
+LINEPLOT_MEAN_SD = 2
+LINEPLOT_DENSITY = 3
+# The density view's heatmaps: white where no trajectory passes, darkening with the count,
+# so that the colored per-group overlays stand out.
+DENSITY_COLORSCALE = [[0, WHITE], [0.05, '#E6E6E6'], [1, '#3C3C3C']]
+
+# The line plot's 'days shown' slider snaps to the distinct days if there are at most MAX_DAY_MARKS of them;
+# otherwise it moves in steps of the smallest gap between days, without marks.
+MAX_DAY_MARKS = 25
+
+# Values of the bar plot's 'show' radio items (see layout.py): one bar per sample, the distribution of
+# each property (a histogram stacked by label; see make_binned_bar_plot()), or one bar per sample
+# for a window of the sorted samples only (see make_custom_multifaceted_bar_plot()'s sample_positions).
+BARPLOT_SAMPLES = 1
+BARPLOT_HISTOGRAM = 2
+BARPLOT_WINDOW = 3
+BAR_HISTOGRAM_BINS = 40
+BAR_WINDOW_SIZE = 200 # samples shown at first in the windowed bar plot
+# In the windowed bar plot, the server sends the bars of the samples in view plus BAR_WINDOW_MARGIN times
+# as many on each side, so that panning a little doesn't need a new figure; at most BAR_WINDOW_MAX_SIZE
+# samples are in view at once (zooming out further shows the BAR_WINDOW_MAX_SIZE around the center).
+BAR_WINDOW_MARGIN = 0.5
+BAR_WINDOW_MAX_SIZE = 2000
 
 # Lookup table for "index" values of 'color_displayed' Div elements
 # that receive a color string from the color picker.
@@ -163,12 +195,65 @@ def linewrap_ylabel(ylabel : str, num_facets : int):
     return ylabel, ylabel_font_size
 
 
-def make_custom_multifaceted_bar_plot(df_in : pd.DataFrame, props : list, custom_color_mapping : dict,
-                                      label_list : list, x_column : str, hide_x_ticks : bool):
+def sort_bar_plot_data(df_facets : pd.DataFrame, x_column : str, sorting_key : str, ascending : bool):
+    """
+    Function to sort the bar plot's data by the x-axis values (sample IDs) or by the values of one property.
+
+    Parameters
+    ----------
+    df_facets : pd.DataFrame
+        Columns x_column, 'prop name', and 'prop value', for the properties to be plotted (no NaNs).
+    x_column : str
+        The name of the column of x-axis values, e.g. 'Patient ID'.
+    sorting_key : str
+        x_column, or the property (a value in 'prop name') by whose values the bars should be sorted.
+    ascending : bool
+        The direction of the sort.
+
+    Returns
+    -------
+    pd.DataFrame, list
+        The sorted DataFrame, and the properties in facet order (sorting_key first if it's a property).
+    """
+    if x_column == sorting_key:
+        # Coding hint: If your x_column values require a sort order different from
+        # standard string sort order, add code here to implement that.
+        # Hint: If your x_column values have different parts ('part1_part2', 'p1-p2-p3', etc.),
+        # you can add columns to a copy of df_facets, sort on those, and then drop those columns.
+        # E.g.:
+        # df_final = df_facets.copy()
+        # df_final['p1'] = list of 'part1' substrings from your x_column values
+        # df_final['p2'] = ditto for 'part2' substrings
+        # df_final = df_final.sort_values(by=['p1','p2'],
+        #                                 ascending=[ascending,ascending]).drop(['p1','p2'],
+        #                                                                       axis=1).reset_index(drop=True)
+        # It might be best to use an if/else block:
+        # if fancy_sort_needed: fancy_sort else: standard_sort
+        df_final = df_facets.sort_values(by=[x_column], ascending=[ascending])
+        props = df_final['prop name'].unique().tolist()
+    else:
+        props = df_facets['prop name'].unique().tolist() # returned in the order in which they appear at the moment
+        props[props.index(sorting_key)] = props[0]
+        props[0] = sorting_key
+        this_sort_order = dict(zip(props, range(len(props))))
+        df_prelim = df_facets.sort_values(by=['prop value'], ascending=[ascending])
+        # Critically important: Must choose a final 'kind' of sorting that's stable, i.e. that preserves the prelim sort.
+        # According to the pandas docs, the two stable options are 'stable' and 'mergesort'.
+        df_final = df_prelim.sort_values(by=['prop name'], key=lambda z : z.map(this_sort_order), kind='stable')
+    return df_final, props
+
+
+def make_custom_multifaceted_bar_plot(df_in : pd.DataFrame, props : list, sample_to_label_id : dict,
+                                      label_table : dict, x_column : str, hide_x_ticks : bool,
+                                      sample_positions : dict=None):
     """
     Function for making (or updating) vertically stacked bar plots (a.k.a. a faceted plot),
     with sample IDs on the x-axis. This function assumes the input has been validated, formatted,
     and sorted by a callback function.
+
+    The bars are grouped into one trace per (label, facet), and each trace's legendgroup is the
+    label's id (as a str). This lets a callback rename or recolor a label by patching only that
+    label's traces, instead of rebuilding the figure.
     
     Parameters
     ----------
@@ -177,42 +262,54 @@ def make_custom_multifaceted_bar_plot(df_in : pd.DataFrame, props : list, custom
         and the value in parameter x_column.
     props : list
         The unique entries in column 'prop name', in the appropriate sort order.
-    custom_color_mapping : dict
-        A mapping from x_column value (str) to color (str, hex value). The bars of the bar plot
-        will be colored according to this mapping.        
-    label_list : list of dict
-        A list of the labels the user has (interactively) defined. Each label has a name and a color.
-        For each entry, its 'value' key gives the name. The 'label' key gives what's essentially a JSON
-        string that contains the color and a duplicate copy of the name. This parameter is used to
-        retrieve the label names that correspond to the colors in custom_color_mapping; these names
-        will be shown in the plot's legend. Labels created by the user but not assigned to any sample
-        will be excluded from the legend.
+    sample_to_label_id : dict
+        A mapping from x_column value (str) to the id (int) of the label the sample carries,
+        with the default label already resolved. Samples mapped to -1 (no label) are shown in LIGHT_GRAY.
+    label_table : dict
+        The labels the user has (interactively) defined: {'names':[...], 'colors':[...]},
+        where a label's id is its position in these lists. Labels created by the user
+        but not assigned to any sample will be excluded from the legend.
     x_column : str
         The name of the column in df_in to be plotted on the x-axis. Typically 'sample' or 'Patient ID'.
     hide_x_ticks : bool
         Whether to hide the ticks for the x-axis.
+    sample_positions : dict, default : None
+        A mapping from x_column value to the sample's position (int) in the full sort order.
+        If given, df_in holds only some of the samples (a window of the sorted samples), and each bar
+        is placed at its sample's position on a numeric x-axis whose ticks show the sample IDs.
     
     Returns
     -------
     figure
         A faceted stacked bar plot with a common x-axis.
     """
-    fig = default_format_fig(px.bar(df_in,
-                                    x=x_column, y='prop value', facet_row='prop name',
-                                    color=x_column, color_discrete_map=custom_color_mapping))
-    color_to_label = {}
-    if label_list is not None:
-        unique_colors_used = list(set(custom_color_mapping.values()))
-        for label in label_list:
-            label_name = label['value']
-            label_color = label['label']['props']['children'][0]['props']['style']['color']
-            if label_color in unique_colors_used:
-                color_to_label[label_color] = label_name
-        if len(color_to_label) == 0:
-            # This will be the case after the user defines a label and before any label is assigned to a sample.
-            fig.update_layout(showlegend=False)
-    else:
+    df_plot = df_in.copy()
+    df_plot['label id'] = [str(sample_to_label_id.get(sample, -1)) for sample in df_plot[x_column]]
+    label_ids_used = df_plot['label id'].unique().tolist()
+    color_map = {label_id : LIGHT_GRAY if label_id == '-1' else label_table['colors'][int(label_id)]
+                 for label_id in label_ids_used}
+    x = x_column
+    hover_data = {'label id':False}
+    if sample_positions is not None:
+        x = 'position'
+        df_plot[x] = df_plot[x_column].map(sample_positions)
+        hover_data.update({x_column:True, x:False})
+    fig = default_format_fig(px.bar(df_plot,
+                                    x=x, y='prop value', facet_row='prop name',
+                                    color='label id', color_discrete_map=color_map,
+                                    category_orders={x_column:list(dict.fromkeys(df_plot[x_column])),
+                                                     'prop name':props},
+                                    hover_data=hover_data))
+    for trace in fig.data:
+        # trace.legendgroup is the label id (str); px also used it as the trace's name.
+        if trace.legendgroup == '-1':
+            trace.update(showlegend=False)
+        else:
+            trace.update(name=label_table['names'][int(trace.legendgroup)])
+    if label_ids_used == ['-1']:
+        # This will be the case after the user defines a label and before any label is assigned to a sample.
         fig.update_layout(showlegend=False)
+    fig.update_layout(legend_title_text=None) # personal preference: no legend title
     fig.update_yaxes(matches=None) # enforce distinct y-axis ranges
 
     num_facets = len(props)
@@ -230,28 +327,84 @@ def make_custom_multifaceted_bar_plot(df_in : pd.DataFrame, props : list, custom
         fig['layout'][yaxis_name]['title']['text'] = ylabel
         fig['layout'][yaxis_name]['title']['font']['size'] = ylabel_font_size
     fig.update_xaxes(tickangle=-90) # put the "business end" of the Parent ID closest to the data
-    if len(color_to_label) > 0:
-        # Here we build the legend, using the example shown here:
-        # https://stackoverflow.com/questions/69683950/manually-defined-legend-in-plotly-on-python
-        # (Eric tried to find a way to do this without using plotly.graph_objects, but didn't find one.)
-        # Eric found empirically that setting y=[None] keeps the bar plot looking the way we want it to,
-        # whereas providing no 'y' parameter (i.e. y=None rather than y=[None]) shifts the bars rightward (boo!).
-        # Another note: parameter 'marker_color', shown on the web page above, seems to work well,
-        # despite not being listed in the documentation(?!) for go.Bar.
-        fig.update_traces(showlegend=False).add_traces([go.Bar(x=[fig.data[0].x[0]],
-                                                               y=[None],
-                                                               name=color_to_label[c],
-                                                               marker_color=c,
-                                                               showlegend=True)
-                                                        for c in color_to_label])
-        fig.update_layout(legend_title_text=None) # personal preference: no legend title
+    if sample_positions is not None and len(df_plot) > 0:
+        positions = df_plot.drop_duplicates(x_column)
+        fig.update_xaxes(tickmode='array', tickvals=positions[x].tolist(), ticktext=positions[x_column].tolist(),
+                         range=[positions[x].min() - 0.5, positions[x].max() + 0.5], title_text=x_column)
     if hide_x_ticks:
         fig.update_xaxes(tickcolor='white',tickfont={'color':'white'},tickangle=0) # maybe add 'size':1 or 4 or ...?        
     return fig
 
 
+def make_binned_bar_plot(df_in : pd.DataFrame, props : list, sample_to_label_id : dict, label_table : dict,
+                         x_column : str, reverse_x : bool=False, bins : int=BAR_HISTOGRAM_BINS):
+    """
+    Function for making the distribution view of the bar plot: per property (facet), a histogram
+    of the samples' values, each bar stacked by label. Its size doesn't depend on the number of samples.
+    Like make_custom_multifaceted_bar_plot(), there's one trace per (label, facet), whose legendgroup
+    is the label's id (as a str), so label edits can patch the figure in place.
+
+    Parameters
+    ----------
+    df_in : pd.DataFrame
+        As for make_custom_multifaceted_bar_plot() (no NaNs).
+    props : list
+        The unique entries in column 'prop name', in the order of the facets (top to bottom).
+    sample_to_label_id, label_table, x_column
+        As for make_custom_multifaceted_bar_plot().
+    reverse_x : bool, default : False
+        Whether the x-axes (the values) run from high to low, e.g. when the samples are sorted in descending order.
+    bins : int, default : BAR_HISTOGRAM_BINS
+        The number of bins per facet, spanning the range of that facet's values.
+
+    Returns
+    -------
+    figure
+        A faceted plot of stacked histograms, one per property.
+    """
+    # All the facets are binned at once: each value's bin is computed from its facet's range,
+    # and the counts per (facet, label, bin) are a single bincount.
+    facet_codes = df_in['prop name'].map(dict(zip(props, range(len(props))))).to_numpy()
+    label_ids = np.array([sample_to_label_id.get(sample, -1) for sample in df_in[x_column]], dtype=np.int64)
+    label_codes, label_values = pd.factorize(label_ids, sort=True) # unlabeled (-1) first, i.e. at the bottom
+    values = df_in['prop value'].to_numpy(dtype=float)
+    low = np.full(len(props), np.inf)
+    high = np.full(len(props), -np.inf)
+    np.minimum.at(low, facet_codes, values)
+    np.maximum.at(high, facet_codes, values)
+    high = np.where(high > low, high, low + 1) # a facet with a single value gets bins of width 1/bins
+    width = (high - low)/bins
+    which_bin = np.clip(((values - low[facet_codes])/width[facet_codes]).astype(np.int64), 0, bins - 1)
+    counts = np.bincount((facet_codes*len(label_values) + label_codes)*bins + which_bin,
+                         minlength=len(props)*len(label_values)*bins).reshape(len(props), len(label_values), bins)
+
+    fig = make_subplots(rows=len(props), cols=1, vertical_spacing=min(0.3/max(len(props), 1), 0.08))
+    in_legend = set()
+    for i, prop in enumerate(props):
+        centers = low[i] + (np.arange(bins) + 0.5)*width[i]
+        for j, label_id in enumerate(label_values.tolist()):
+            if not counts[i, j].any():
+                continue
+            group = str(label_id)
+            fig.add_trace(go.Bar(x=centers, y=counts[i, j], width=width[i], legendgroup=group,
+                                 name=label_table['names'][label_id] if label_id >= 0 else group,
+                                 marker={'color':LIGHT_GRAY if label_id < 0 else label_table['colors'][label_id]},
+                                 showlegend=label_id >= 0 and group not in in_legend,
+                                 hovertemplate=f'{prop}: %{{x:.3g}}<br>samples: %{{y}}<extra></extra>'),
+                          row=i + 1, col=1)
+            in_legend.add(group)
+        ylabel, ylabel_font_size = linewrap_ylabel(prop, len(props))
+        fig.update_yaxes(title_text=ylabel, title_font_size=ylabel_font_size, row=i + 1, col=1)
+    fig = default_format_fig(fig)
+    fig.update_layout(barmode='stack', bargap=0, legend_title_text=None, height=max(450, 160*len(props)),
+                      showlegend=bool(in_legend - {'-1'}))
+    fig.update_xaxes(autorange='reversed' if reverse_x else True)
+    return fig
+
+
 def make_custom_multifaceted_line_plot(df_in : pd.DataFrame, x_column : str='day', line_group : str='sample',
-                                       agg_group : str='Treatment', display_meanSD : bool=False, dt : float=0):
+                                       agg_group : str='Treatment', display_meanSD : bool=False, dt : float=0,
+                                       df_summary : pd.DataFrame=None, group_order : list=None):
     """
     Function to make a multi-faceted (or single facet) line plot.
 
@@ -270,6 +423,14 @@ def make_custom_multifaceted_line_plot(df_in : pd.DataFrame, x_column : str='day
        Whether to display one line per replicate, or mean ± SD over line_group.
     dt : float, default : 0
        The value by which to subtly spread data points along the x-axis. See xexpand_MeanAndSD_vs_Day().
+    df_summary : pd.DataFrame, default : None
+       Precomputed mean ± SD per (agg_group, x_column, 'prop name'), with columns 'mean' and 'std'
+       (see stats_cube.summarize()). Only used if display_meanSD is True;
+       if None, mean ± SD are computed from df_in.
+    group_order : list, default : None
+       The values of agg_group in the order in which they get their colors. Pass this when plotting
+       facets one at a time, so that each group keeps the color it has in the plot of all facets together.
+       If None, the order of first appearance in the data is used.
 
     Returns
     --------
@@ -280,31 +441,36 @@ def make_custom_multifaceted_line_plot(df_in : pd.DataFrame, x_column : str='day
     -----
     Calls default_format_fig().
     Calls xexpand_MeanAndSD_vs_Day() if display_meanSD is True.
+    Replicate plots with many facets and rows are built facet-by-facet in a process pool;
+    see parallel_figures.py.
     """
     these_colors = tableau20
     if display_meanSD:
-        df_copy = df_in.copy()
-        df_copy['mean'] = df_copy['prop value'].copy()
-        df_copy['std'] = df_copy['prop value'].copy()
-        # Go ahead and compute mean ± SD regardless of replicates. We'll remove NaNs immediately afterwards.
-        df_agg = df_copy.groupby([agg_group, x_column, 'prop name'],
-                                 as_index=False).agg({agg_group:'first',
-                                                      x_column:'first',
-                                                      'prop name':'first',
-                                                      'mean':'mean',
-                                                      'std':'std'})
-        df_agg['std'] = df_agg['std'].fillna(0)        
+        if df_summary is None:
+            # Compute mean ± SD regardless of replicates (single-member groups get SD 0).
+            df_summary = stats_cube.summarize(stats_cube.build_stats_cube(df_in, [agg_group], x_column), agg_group)
+        df_agg = df_summary[[agg_group, x_column, 'prop name', 'mean', 'std']]
         plot_options = {'x':x_column, 'y':'mean', 'error_y':'std', 'facet_row':'prop name',
                         'color':agg_group, 'color_discrete_sequence':these_colors, 'height':540}
+        if group_order is not None:
+            plot_options['category_orders'] = {agg_group:list(group_order)}
         if x_column.lower() == 'day':
             plot_options['hover_data'] = {x_column:':.0f'} # display Day as an integer
         ret_val = xexpand_MeanAndSD_vs_Day(df_agg, group=agg_group, delta_t=dt)
         fig = default_format_fig(px.line(xexpand_MeanAndSD_vs_Day(df_agg, group=agg_group, delta_t=dt),
                                          **plot_options))
     else:
-        fig = default_format_fig(px.line(df_in, x=x_column, y='prop value', facet_row='prop name',
-                                         line_group=line_group, color=agg_group, color_discrete_sequence=these_colors,
-                                         height=540))
+        fig = None
+        if parallel_figures.should_build_in_parallel(df_in):
+            # Many facets and rows: build the facets in the process pool (returns None if the pool is unusable).
+            fig = parallel_figures.make_facet_parallel_line_plot(df_in, x_column, line_group, agg_group,
+                                                                 these_colors, 540, group_order)
+        if fig is None:
+            fig = px.line(df_in, x=x_column, y='prop value', facet_row='prop name',
+                          line_group=line_group, color=agg_group, color_discrete_sequence=these_colors,
+                          category_orders={agg_group:list(group_order)} if group_order is not None else None,
+                          height=540)
+        fig = default_format_fig(fig)
     fig.update_yaxes(matches=None) # enforce distinct y-axis ranges
     num_facets = len(fig.layout.annotations)
     for i in range(num_facets):
@@ -322,6 +488,51 @@ def make_custom_multifaceted_line_plot(df_in : pd.DataFrame, x_column : str='day
     return fig
 
 
+def make_density_line_plot(df_in : pd.DataFrame, x_column : str='day', line_group : str='sample',
+                           agg_group : str='Treatment', df_summary : pd.DataFrame=None, group_order : list=None):
+    """
+    Function to make the density view of a multi-faceted (or single facet) line plot: per facet,
+    a heatmap of the number of trajectories (one per line_group value) passing through each cell
+    of a grid of x_column x 'prop value' (see trajectory_density.py), overlaid with mean ± SD per agg_group value.
+
+    Parameters
+    ----------
+    df_in, x_column, line_group, agg_group, df_summary, group_order
+       As for make_custom_multifaceted_line_plot(). The overlays are that function's mean ± SD traces
+       (one per group value per facet), so they're styled (and recolored) like those of the mean ± SD view.
+
+    Returns
+    --------
+    Figure
+       A (multifaceted) line plot figure whose first traces are the heatmaps, one per facet.
+    """
+    fig = make_custom_multifaceted_line_plot(df_in, x_column=x_column, line_group=line_group, agg_group=agg_group,
+                                             display_meanSD=True, df_summary=df_summary, group_order=group_order)
+    facet_axes = {}
+    for trace in fig.data:
+        curve_data = dict(entry.split('=', 1) for entry in trace.hovertemplate.split('<br>'))
+        facet_axes.setdefault(curve_data['prop name'], (trace.xaxis, trace.yaxis))
+    x_range = (df_in[x_column].min(), df_in[x_column].max())
+    heatmaps = []
+    for facet, (xaxis, yaxis) in facet_axes.items():
+        counts, x_centers, y_centers = trajectory_density.bin_trajectories(df_in[df_in['prop name'] == facet],
+                                                                          x_column, line_group, x_range=x_range)
+        heatmaps.append(go.Heatmap(z=counts, x=x_centers, y=y_centers, xaxis=xaxis, yaxis=yaxis,
+                                   colorscale=DENSITY_COLORSCALE, zmin=0, showscale=False,
+                                   name=facet, hovertemplate=f'{x_column}=%{{x:.1f}}<br>value=%{{y:.3g}}<br>'
+                                                             f'trajectories=%{{z}}<extra>{facet}</extra>'))
+    fig.add_traces(heatmaps)
+    fig.data = fig.data[-len(heatmaps):] + fig.data[:-len(heatmaps)] if heatmaps else fig.data # heatmaps underneath
+    return fig
+
+
+def is_styled_trace(trace : dict):
+    """
+    Return True if a trace of a line plot is styled from the style map (i.e. is a line, not a density heatmap).
+    """
+    return (trace['type'] if 'type' in trace else 'scatter') != 'heatmap'
+
+
 def add_group_to_style_map(group : str, style_map : dict, fig : dict, df : pd.DataFrame, sample_string : str,
                            one_trace_per_group : bool, samples_string : str='Sample IDs'):
     """
@@ -408,11 +619,13 @@ def add_group_to_style_map(group : str, style_map : dict, fig : dict, df : pd.Da
         for group_value in df[group].unique(): # e.g., group='Treatment', group_value='Placebo'
             samples_with_this_val = df[df[group]==group_value][sample_string].tolist() # sample_string = 'Patient ID', etc.
             group_value = str(group_value) # needed for rare(?) case of val being numeric, e.g. group='Age (yrs)', val=5
-            group_values_to_sampleIDs[val] = samples_with_this_val
+            group_values_to_sampleIDs[group_value] = samples_with_this_val
 
     # Iterate through all the curves (or 'traces') in all the facets of the figure,
     # extract the labeling data and color for each, and store that color in the style map. 
     for curve_number in range(len(fig['data'])):
+        if not is_styled_trace(fig['data'][curve_number]):
+            continue
         hov_str = fig['data'][curve_number]['hovertemplate'] # it's an HTML string! :)
         curve_data = {}
         for entry in hov_str.split('<br>'):
@@ -451,6 +664,50 @@ def add_group_to_style_map(group : str, style_map : dict, fig : dict, df : pd.Da
     return style_map
 
 
+def apply_style_map_to_line_plot(fig : dict, style_map : dict, group : str, sample_string : str,
+                                 one_trace_per_group : bool, samples_string : str='Sample IDs'):
+    """
+    Function to set the line style (color, dashing) of every trace in a line plot from the style map.
+
+    Parameters
+    ----------
+    fig : dict
+       A figure that was created & returned by make_custom_multifaceted_line_plot().
+       Its traces are modified in place.
+    style_map : dict
+       The style map. Must contain `group` (see add_group_to_style_map()).
+    group : str
+       The property by which the samples are grouped (colored, aggregated), e.g. 'Treatment'.
+    sample_string : str
+       The name of the column of sample IDs, e.g. 'sample', 'Patient ID'.
+    one_trace_per_group : bool
+       True if the plot shows one trace per group (e.g. mean ± SD), False if one trace per sample.
+    samples_string : str, default : 'Sample IDs'
+       The key in style_map for the per-sample styles.
+
+    Returns
+    -------
+    dict
+       The same figure.
+    """
+    for curve_number in range(len(fig['data'])):
+        if not is_styled_trace(fig['data'][curve_number]):
+            continue
+        hov_str = fig['data'][curve_number]['hovertemplate']
+        curve_data = {}
+        for entry in hov_str.split('<br>'):
+            key, value = entry.split('=')
+            curve_data[key] = value
+        group_value = curve_data[group] # e.g., group='Treatment', group_value='Placebo'
+        facet = curve_data['prop name']
+        if one_trace_per_group:
+            fig['data'][curve_number]['line'] = style_map[group][group_value]['facets'][facet]
+        else:
+            sample_id = curve_data[sample_string] # sample_string is 'sample', 'Sample ID', etc.
+            fig['data'][curve_number]['line'] = style_map[samples_string][sample_id]['facets'][group][facet]
+    return fig
+
+
 def add_facet_to_style_map(style_map : dict, new_facet : str, samples_string : str='Sample IDs'):
 
     """
@@ -0,0 +1,80 @@
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# ------- Begin background warm-up ---------------
+#
+# Right after a data set is loaded, the first click on 'show plot', the first switch to mean ± SD,
+# and the first bar plot sort each pay the full cost of building what they show.
+# Instead, load_fake_demo_data() hands start() a list of tasks that build those things
+# (the default figures and sort orders; see callbacks._warm_up_tasks()) and put them in the caches;
+# they're run one after another in a background thread, so the first user interactions are cache hits.
+# If the user gets there first, the request builds what it needs itself, as it would without the warm-up.
+#
+# The warm-up runs at most once per data set per server process. It can be turned off with the
+# environment variable PLOTTING_PARTNER_WARM_UP=0.
+# NOTE: Each server process (e.g. each gunicorn worker) warms up only its own caches,
+# i.e. those of the process that loaded the data set.
+WARM_UP = os.environ.get('PLOTTING_PARTNER_WARM_UP', '1') not in ['', '0']
+
+# dataset_key -> {'state':'running' or 'done', 'tasks':{task name:seconds, or the error message}}
+_warmed = {}
+_lock = threading.Lock()
+#
+# ------- End background warm-up -----------------
+
+
+def _run(dataset_key : str, tasks : list):
+    results = _warmed[dataset_key]['tasks']
+    for name, task in tasks:
+        start = time.perf_counter()
+        try:
+            task()
+            results[name] = time.perf_counter() - start
+        except Exception as e:
+            # A failed task only means the first request that needs it builds it itself.
+            results[name] = str(e)
+            logger.warning("Warm-up task '%s' failed for data set %s: %s", name, dataset_key, e)
+    with _lock:
+        _warmed[dataset_key]['state'] = 'done'
+
+
+def start(dataset_key : str, tasks : list):
+    """
+    Run warm-up tasks for a data set in a background thread, unless they've already been started
+    for that data set (in this server process) or the warm-up is turned off.
+
+    Parameters
+    ----------
+    dataset_key : str
+       The key of the data set; see datasets.make_dataset_key().
+    tasks : list of (str, callable)
+       Names and functions of no arguments, run in this order. Their return values are ignored.
+
+    Returns
+    -------
+    threading.Thread, or None
+       The thread running the tasks, or None if they weren't started.
+    """
+    if not WARM_UP or not dataset_key or not tasks:
+        return None
+    with _lock:
+        if dataset_key in _warmed:
+            return None
+        _warmed[dataset_key] = {'state':'running', 'tasks':{}}
+    thread = threading.Thread(target=_run, args=(dataset_key, tasks), name=f'warm-up {dataset_key}', daemon=True)
+    thread.start()
+    return thread
+
+
+def status(dataset_key : str):
+    """
+    Return the warm-up's state for a data set ('running' or 'done', or None if it wasn't started)
+    and, per task run so far, its duration in seconds or its error message.
+    """
+    with _lock:
+        entry = _warmed.get(dataset_key)
+        return None if entry is None else {'state':entry['state'], 'tasks':dict(entry['tasks'])}